@@ -0,0 +1,446 @@
+"""
+Channel layer shared by several ASGI/judge processes on one host, with no
+broker to run: messages and group memberships live in a SQLite database
+(WAL mode) that every process opens.
+
+Channels made by new_channel belong to the event loop that made them. Each
+such loop runs one poller that fetches the messages of all its channels
+with a single indexed query, and only while something is waiting in
+receive(). A send from the same process wakes the poller right away, one
+from another process is picked up within poll_interval. group_send fans a
+message out with one INSERT ... SELECT over the group's members.
+
+The presence extension keeps who is connected to which room (see
+problem/presence.py) in the same database, so every process sees the
+members of all processes. A member expires presence_expiry seconds after
+it joined or was last refreshed, so the members of a process that died
+disappear without it leaving; the published snapshot of a room goes with
+its last member.
+
+Messages are stored as JSON (bytes values base64 encoded).
+"""
+import asyncio
+import base64
+import json
+import sqlite3
+import threading
+import time
+import weakref
+from collections import deque
+from uuid import uuid4
+
+from channels.exceptions import ChannelFull
+from channels.layers import BaseChannelLayer
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    inbox TEXT NOT NULL,
+    channel TEXT NOT NULL,
+    expires REAL NOT NULL,
+    body TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS messages_inbox ON messages (inbox, id);
+CREATE INDEX IF NOT EXISTS messages_channel ON messages (channel);
+CREATE TABLE IF NOT EXISTS group_members (
+    group_name TEXT NOT NULL,
+    channel TEXT NOT NULL,
+    inbox TEXT NOT NULL,
+    expires REAL NOT NULL,
+    PRIMARY KEY (group_name, channel)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS presence (
+    room TEXT NOT NULL,
+    channel TEXT NOT NULL,
+    username TEXT NOT NULL,
+    expires REAL NOT NULL,
+    PRIMARY KEY (room, channel)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS presence_published (
+    room TEXT PRIMARY KEY,
+    members TEXT NOT NULL
+) WITHOUT ROWID;
+"""
+
+# messages taken per poll
+FETCH_LIMIT = 500
+# expired messages, group memberships and presence are purged this often (s)
+CLEANUP_INTERVAL = 10.0
+
+
+def _encode(message):
+    def default(value):
+        if isinstance(value, bytes):
+            return {'__bytes__': base64.b64encode(value).decode()}
+        raise TypeError(f"{type(value).__name__} can't be sent over the channel layer")
+    return json.dumps(message, default=default)
+
+
+def _decode(body):
+    def object_hook(value):
+        if len(value) == 1 and '__bytes__' in value:
+            return base64.b64decode(value['__bytes__'])
+        return value
+    return json.loads(body, object_hook=object_hook)
+
+
+class _Receiver:
+    """
+    The channels of one event loop: messages fetched but not received yet,
+    and the receive() calls waiting for one.
+    """
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.token = uuid4().hex
+        self.inboxes = set()
+        self.buffers = {}   # channel -> deque of (expires, message)
+        self.waiters = {}   # channel -> Future
+        self.wakeup = asyncio.Event()
+        self.task = None
+
+    def deliver(self, channel, expires, message):
+        waiter = self.waiters.pop(channel, None)
+        if waiter is not None and not waiter.done():
+            waiter.set_result(message)
+        else:
+            self.buffers.setdefault(channel, deque()).append((expires, message))
+
+    def take(self, channel):
+        buffer = self.buffers.get(channel)
+        now = time.time()
+        while buffer:
+            expires, message = buffer.popleft()
+            if expires > now:
+                return message
+        self.buffers.pop(channel, None)
+        return None
+
+    def drop_expired(self):
+        now = time.time()
+        for channel, buffer in list(self.buffers.items()):
+            while buffer and buffer[0][0] <= now:
+                buffer.popleft()
+            if not buffer:
+                del self.buffers[channel]
+
+
+class SQLiteChannelLayer(BaseChannelLayer):
+    extensions = ['groups', 'flush', 'presence']
+
+    def __init__(self, path='channels.sqlite3', expiry=60, group_expiry=86400, capacity=100,
+                 channel_capacity=None, poll_interval=0.01, presence_expiry=30):
+        super().__init__(expiry=expiry, capacity=capacity, channel_capacity=channel_capacity)
+        self.channel_capacity = self.compile_capacities(self.channel_capacity)
+        self.path = str(path)
+        self.group_expiry = group_expiry
+        self.presence_expiry = presence_expiry
+        self.poll_interval = poll_interval
+        self._local = threading.local()
+        self._receivers = weakref.WeakKeyDictionary()  # event loop -> _Receiver
+        self._by_inbox = {}  # inbox -> _Receiver, for waking up local receivers
+        self._lock = threading.Lock()
+        self._last_cleanup = 0.0
+
+    # Database, used from worker threads
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.executescript(SCHEMA)
+            self._local.connection = connection
+        return connection
+
+    def _write(self, statements):
+        """
+        Run statements(connection) in one write transaction.
+        """
+        connection = self._connection()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            result = statements(connection)
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        connection.execute('COMMIT')
+        return result
+
+    def _insert(self, channel, body):
+        def statements(connection):
+            (pending,) = connection.execute(
+                'SELECT COUNT(*) FROM messages WHERE channel = ?', (channel,)
+            ).fetchone()
+            if pending >= self.get_capacity(channel):
+                raise ChannelFull(channel)
+            connection.execute(
+                'INSERT INTO messages (inbox, channel, expires, body) VALUES (?, ?, ?, ?)',
+                (self.non_local_name(channel), channel, time.time() + self.expiry, body),
+            )
+        self._write(statements)
+
+    def _insert_group(self, group, body):
+        """
+        Fan body out to every member of group that isn't at capacity.
+        Returns the inboxes of the members.
+        """
+        def statements(connection):
+            now = time.time()
+            full = [
+                channel for channel, pending in connection.execute(
+                    'SELECT m.channel, COUNT(*) FROM messages m JOIN group_members g'
+                    ' ON g.channel = m.channel WHERE g.group_name = ? GROUP BY m.channel',
+                    (group,),
+                )
+                if pending >= self.get_capacity(channel)
+            ]
+            connection.execute(
+                'INSERT INTO messages (inbox, channel, expires, body)'
+                ' SELECT inbox, channel, ?, ? FROM group_members'
+                ' WHERE group_name = ? AND expires > ?'
+                f' AND channel NOT IN ({", ".join("?" * len(full))})',
+                (now + self.expiry, body, group, now, *full),
+            )
+            return [inbox for (inbox,) in connection.execute(
+                'SELECT DISTINCT inbox FROM group_members WHERE group_name = ?', (group,)
+            )]
+        return self._write(statements)
+
+    def _fetch(self, inboxes):
+        """
+        Take the messages waiting in inboxes, oldest first. Only one poller
+        reads an inbox, so selecting and then deleting is safe.
+        """
+        connection = self._connection()
+        self._cleanup(connection)
+        placeholders = ', '.join('?' * len(inboxes))
+        rows = connection.execute(
+            f'SELECT id, channel, expires, body FROM messages WHERE inbox IN ({placeholders})'
+            ' ORDER BY id LIMIT ?',
+            (*inboxes, FETCH_LIMIT),
+        ).fetchall()
+        if rows:
+            connection.execute(
+                f'DELETE FROM messages WHERE inbox IN ({placeholders}) AND id <= ?',
+                (*inboxes, rows[-1][0]),
+            )
+        now = time.time()
+        return [(channel, expires, body) for _, channel, expires, body in rows if expires > now]
+
+    def _take(self, channel):
+        """
+        Take the oldest message of a single channel, None if there is none.
+        """
+        def statements(connection):
+            now = time.time()
+            while True:
+                row = connection.execute(
+                    'SELECT id, expires, body FROM messages WHERE inbox = ? AND channel = ?'
+                    ' ORDER BY id LIMIT 1',
+                    (self.non_local_name(channel), channel),
+                ).fetchone()
+                if row is None:
+                    return None
+                connection.execute('DELETE FROM messages WHERE id = ?', (row[0],))
+                if row[1] > now:
+                    return row[2]
+        return self._write(statements)
+
+    def _cleanup(self, connection):
+        now = time.time()
+        if now - self._last_cleanup < CLEANUP_INTERVAL:
+            return
+        self._last_cleanup = now
+        connection.execute('DELETE FROM messages WHERE expires <= ?', (now,))
+        connection.execute('DELETE FROM group_members WHERE expires <= ?', (now,))
+        connection.execute('DELETE FROM presence WHERE expires <= ?', (now,))
+        connection.execute('DELETE FROM presence_published WHERE room NOT IN (SELECT room FROM presence)')
+
+    # Receiving
+
+    def _receiver(self):
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            receiver = self._receivers.get(loop)
+            if receiver is None:
+                receiver = self._receivers[loop] = _Receiver(loop)
+            return receiver
+
+    def _wake(self, inboxes):
+        for inbox in inboxes:
+            receiver = self._by_inbox.get(inbox)
+            if receiver is not None and not receiver.loop.is_closed():
+                receiver.loop.call_soon_threadsafe(receiver.wakeup.set)
+
+    async def _poll(self, receiver):
+        try:
+            while receiver.waiters:
+                rows = await asyncio.to_thread(self._fetch, tuple(receiver.inboxes))
+                for channel, expires, body in rows:
+                    receiver.deliver(channel, expires, _decode(body))
+                if len(rows) == FETCH_LIMIT:
+                    continue
+                receiver.drop_expired()
+                receiver.wakeup.clear()
+                try:
+                    await asyncio.wait_for(receiver.wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            receiver.task = None
+
+    async def new_channel(self, prefix='specific.'):
+        receiver = self._receiver()
+        inbox = f'{prefix}{receiver.token}!'
+        with self._lock:
+            receiver.inboxes.add(inbox)
+            self._by_inbox[inbox] = receiver
+        return inbox + uuid4().hex
+
+    async def receive(self, channel):
+        self.require_valid_channel_name(channel)
+        receiver = self._by_inbox.get(self.non_local_name(channel))
+        if receiver is None or receiver.loop is not asyncio.get_running_loop():
+            return await self._receive_direct(channel)
+
+        message = receiver.take(channel)
+        if message is not None:
+            return message
+        waiter = receiver.waiters[channel] = receiver.loop.create_future()
+        if receiver.task is None:
+            receiver.task = asyncio.ensure_future(self._poll(receiver))
+        receiver.wakeup.set()
+        try:
+            return await waiter
+        finally:
+            if receiver.waiters.get(channel) is waiter:
+                del receiver.waiters[channel]
+
+    async def _receive_direct(self, channel):
+        """
+        Receive on a channel not made by this event loop: poll for it alone.
+        """
+        while True:
+            body = await asyncio.to_thread(self._take, channel)
+            if body is not None:
+                return _decode(body)
+            await asyncio.sleep(self.poll_interval)
+
+    # Sending
+
+    async def send(self, channel, message):
+        assert isinstance(message, dict), "message is not a dict"
+        self.require_valid_channel_name(channel)
+        assert "__asgi_channel__" not in message
+        await asyncio.to_thread(self._insert, channel, _encode(message))
+        self._wake([self.non_local_name(channel)])
+
+    # Groups
+
+    async def group_add(self, group, channel):
+        self.require_valid_group_name(group)
+        self.require_valid_channel_name(channel)
+
+        def statements(connection):
+            connection.execute(
+                'INSERT OR REPLACE INTO group_members (group_name, channel, inbox, expires)'
+                ' VALUES (?, ?, ?, ?)',
+                (group, channel, self.non_local_name(channel), time.time() + self.group_expiry),
+            )
+        await asyncio.to_thread(self._write, statements)
+
+    async def group_discard(self, group, channel):
+        self.require_valid_group_name(group)
+        self.require_valid_channel_name(channel)
+
+        def statements(connection):
+            connection.execute(
+                'DELETE FROM group_members WHERE group_name = ? AND channel = ?', (group, channel)
+            )
+        await asyncio.to_thread(self._write, statements)
+
+    async def group_send(self, group, message):
+        assert isinstance(message, dict), "Message is not a dict"
+        self.require_valid_group_name(group)
+        inboxes = await asyncio.to_thread(self._insert_group, group, _encode(message))
+        self._wake(inboxes)
+
+    # Presence extension
+
+    def _presence_members(self, connection, room):
+        return [username for (username,) in connection.execute(
+            'SELECT DISTINCT username FROM presence WHERE room = ? AND expires > ? ORDER BY username',
+            (room, time.time()),
+        )]
+
+    async def presence_join(self, room, channel, username):
+        def statements(connection):
+            connection.execute(
+                'INSERT OR REPLACE INTO presence (room, channel, username, expires) VALUES (?, ?, ?, ?)',
+                (room, channel, username, time.time() + self.presence_expiry),
+            )
+        await asyncio.to_thread(self._write, statements)
+
+    async def presence_refresh(self, members):
+        """
+        Push back the expiry of members, (room, channel) pairs that are
+        still connected. Members that left meanwhile stay gone.
+        """
+        def statements(connection):
+            expires = time.time() + self.presence_expiry
+            connection.executemany(
+                'UPDATE presence SET expires = ? WHERE room = ? AND channel = ?',
+                [(expires, room, channel) for room, channel in members],
+            )
+        await asyncio.to_thread(self._write, statements)
+
+    async def presence_leave(self, room, channel):
+        def statements(connection):
+            connection.execute('DELETE FROM presence WHERE room = ? AND channel = ?', (room, channel))
+        await asyncio.to_thread(self._write, statements)
+
+    async def presence_members(self, room):
+        """
+        The usernames connected to room, in any process.
+        """
+        return await asyncio.to_thread(lambda: self._presence_members(self._connection(), room))
+
+    async def presence_publish(self, room):
+        """
+        The members of room if they changed since the last call (by any
+        process) returned them, None otherwise. One change is returned once.
+        """
+        def statements(connection):
+            members = self._presence_members(connection, room)
+            row = connection.execute(
+                'SELECT members FROM presence_published WHERE room = ?', (room,)
+            ).fetchone()
+            if members == (json.loads(row[0]) if row else []):
+                return None
+            if members:
+                connection.execute(
+                    'INSERT OR REPLACE INTO presence_published (room, members) VALUES (?, ?)',
+                    (room, json.dumps(members)),
+                )
+            else:
+                connection.execute('DELETE FROM presence_published WHERE room = ?', (room,))
+            return members
+        return await asyncio.to_thread(self._write, statements)
+
+    # Flush extension
+
+    async def flush(self):
+        def statements(connection):
+            connection.execute('DELETE FROM messages')
+            connection.execute('DELETE FROM group_members')
+            connection.execute('DELETE FROM presence')
+            connection.execute('DELETE FROM presence_published')
+        await asyncio.to_thread(self._write, statements)
+        with self._lock:
+            for receiver in list(self._receivers.values()):
+                receiver.buffers.clear()
+
+    async def close(self):
+        pass
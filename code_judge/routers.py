@@ -0,0 +1,18 @@
+class CacheRouter:
+    """
+    Keeps the cache table (DatabaseCache) in the "cache" database, and
+    nothing else in it.
+    """
+    database = 'cache'
+
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label == 'django_cache':
+            return self.database
+        return None
+
+    db_for_write = db_for_read
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if app_label == 'django_cache':
+            return db == self.database
+        return None if db != self.database else False
@@ -82,12 +82,82 @@ TEMPLATES = [
 ]
 
 # Channels settings
+# Shared by every ASGI and judge process on this host (see code_judge/channel_layer.py)
 CHANNEL_LAYERS = {
     'default': {
-        'BACKEND': 'channels.layers.InMemoryChannelLayer',
+        'BACKEND': 'code_judge.channel_layer.SQLiteChannelLayer',
+        'CONFIG': {
+            'path': os.getenv('CHANNEL_LAYER_PATH', str(BASE_DIR / 'channels.sqlite3')),
+            'poll_interval': 0.01,
+            # chatspace members of a process that died are shown this long (s)
+            'presence_expiry': 30,
+        },
     },
 }
 
+# Judge settings
+# Number of judge worker processes draining the submission queue,
+# 0 judges submissions inline in the request thread.
+JUDGE_WORKERS = int(os.getenv('JUDGE_WORKERS', 2))
+# Testcases of one submission judged concurrently by each worker,
+# 1 judges them one after another.
+JUDGE_PARALLEL_CASES = int(os.getenv('JUDGE_PARALLEL_CASES', 1))
+# Finished verdicts kept around for polling.
+JUDGE_RESULT_RETENTION = 1000
+# Sandbox limits on top of each problem's time_limit/memory_limit.
+JUDGE_MAX_PROCESSES = 64
+# A judge running as root runs submissions as this (unprivileged) user:
+# the process cap doesn't apply to root.
+JUDGE_SANDBOX_USER = os.getenv('JUDGE_SANDBOX_USER', '')
+JUDGE_MAX_OUTPUT_BYTES = 16 * 1024 * 1024
+JUDGE_WALL_TIME_FACTOR = 2.0
+JUDGE_COMPILE_TIMEOUT = 10
+# Pre-started Python interpreters kept warm per judge process,
+# 0 starts a fresh interpreter for every testcase.
+JUDGE_PYTHON_RUNNERS = int(os.getenv('JUDGE_PYTHON_RUNNERS', 4))
+# Memory budget of the per-process cache of parsed testcases.
+JUDGE_TESTCASE_CACHE_BYTES = 64 * 1024 * 1024
+# Size limit of the on-disk cache of compiled C/C++ executables.
+JUDGE_COMPILE_CACHE_BYTES = 256 * 1024 * 1024
+# Submission counters are buffered in memory and written this often (s),
+# 0 writes every increment right away.
+JUDGE_COUNTER_FLUSH_INTERVAL = 1.0
+
+# Chat settings
+# Chat messages are written in batches: every CHAT_FLUSH_MESSAGES messages
+# or CHAT_FLUSH_INTERVAL seconds, whichever comes first.
+CHAT_FLUSH_MESSAGES = 50
+CHAT_FLUSH_INTERVAL = 0.2
+# Messages per history page sent to chatspace members.
+CHAT_HISTORY_PAGE = 50
+# Joins and leaves are sent to a chatspace as one presence snapshot this often (s).
+CHAT_PRESENCE_INTERVAL = 1.0
+
+# AI feedback settings
+# 'gemini' (needs GEMINI_API_KEY) or 'stub', a local backend without network.
+AI_FEEDBACK_BACKEND = os.getenv('AI_FEEDBACK_BACKEND', 'gemini')
+# Concurrent AI calls per process; more requests wait their turn.
+AI_FEEDBACK_CONCURRENCY = 4
+# Feedback is cached per problem and error signature for this long (s).
+AI_FEEDBACK_CACHE_TIMEOUT = 24 * 60 * 60
+
+# Recommender settings
+RECOMMENDER_INDEX_PATH = os.path.join(BASE_DIR, 'recommender', 'embedding', 'problems.faiss')
+# Memory-map the FAISS index instead of reading it into each process.
+RECOMMENDER_MMAP_INDEX = True
+# How the index stores vectors: 'float32', 'float16' (half the size,
+# recall@20 0.999 on 100k problems) or 'int8' (a quarter, 0.98); see
+# bench_embedding_store. Changing it takes a genembeddng run.
+RECOMMENDER_VECTOR_DTYPE = 'float16'
+# Candidates (nearest by embedding) scored per recommendation.
+RECOMMENDER_CANDIDATES = 1000
+# Recommendations are cached this long (s), and kept warm in the background
+# every RECOMMENDER_WARM_INTERVAL seconds (0 disables) for the users who
+# logged in within RECOMMENDER_ACTIVE_DAYS.
+RECOMMENDER_CACHE_TIMEOUT = 60 * 60
+RECOMMENDER_WARM_INTERVAL = 60.0
+RECOMMENDER_ACTIVE_DAYS = 7
+
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
@@ -95,6 +165,29 @@ DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
         "NAME": BASE_DIR / "db.sqlite3",
+    },
+    # the cache's own file, so cache writes never wait on (or hold) the
+    # write lock of the app's database
+    "cache": {
+        "ENGINE": "django.db.backends.sqlite3",
+        "NAME": os.getenv('CACHE_DB', BASE_DIR / "cache.sqlite3"),
+    },
+}
+DATABASE_ROUTERS = ['code_judge.routers.CacheRouter']
+
+# Cache
+# Shared by every process (web, judge and management commands), so cached
+# recommendations and AI feedback are computed once, not once per process.
+# Stored in the "cache" database, its table is made by
+# `python manage.py createcachetable --database cache`.
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.db.DatabaseCache",
+        "LOCATION": "django_cache",
+        "OPTIONS": {
+            # three recommendation lists per active user, and AI feedback
+            "MAX_ENTRIES": 100_000,
+        },
     }
 }
 
@@ -0,0 +1,165 @@
+"""
+Content-addressed cache of compiled C/C++ executables.
+
+Entries are keyed by a hash of the source, the language, the compiler
+version and the compiler flags, so resubmitting byte-identical code skips
+the compiler entirely. The cache directory is shared by every judge
+process; the least recently used entries are evicted once it grows past
+its size limit.
+"""
+import hashlib
+import os
+import shutil
+import subprocess
+import threading
+import uuid
+from functools import lru_cache
+
+
+@lru_cache(maxsize=None)
+def compiler_version(compiler):
+    """
+    First line of `<compiler> --version`, part of every cache key so a
+    compiler upgrade doesn't serve stale binaries.
+    """
+    try:
+        process = subprocess.run(
+            [compiler, '--version'],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            timeout=10,
+        )
+    except (OSError, subprocess.TimeoutExpired):
+        return compiler
+    return process.stdout.decode('utf-8', errors='replace').partition('\n')[0]
+
+
+def _link_or_copy(src, dst):
+    """
+    Hard link src to dst (copy across filesystems). A linked executable
+    stays valid even if the cache entry is evicted while it runs.
+    """
+    try:
+        os.link(src, dst)
+    except FileNotFoundError:
+        raise
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+class CompileCache:
+    def __init__(self, root, max_bytes):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._size = None  # estimated bytes on disk, computed lazily
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(language, source, compiler, flags):
+        """
+        Cache key of a source file compiled with compiler and flags.
+        """
+        digest = hashlib.sha256()
+        for part in (language, compiler_version(compiler), ' '.join(flags)):
+            digest.update(part.encode())
+            digest.update(b'\0')
+        digest.update(source)
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return self.root / key
+
+    def fetch(self, key, exec_path):
+        """
+        Place the cached executable for key at exec_path.
+        Returns True on a hit, False on a miss.
+        """
+        path = self._path(key)
+        try:
+            _link_or_copy(path, exec_path)
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return False
+
+        # the mtime is the LRU clock shared between judge processes
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        with self._lock:
+            self.hits += 1
+        return True
+
+    def store(self, key, exec_path):
+        """
+        Add a freshly compiled executable to the cache.
+        """
+        self.root.mkdir(parents=True, exist_ok=True)
+        path = self._path(key)
+        tmp_path = self.root / f'.{key}.{uuid.uuid4().hex}'
+        try:
+            _link_or_copy(exec_path, tmp_path)
+            os.replace(tmp_path, path)
+        except OSError:
+            try:
+                os.remove(tmp_path)
+            except FileNotFoundError:
+                pass
+            return
+
+        with self._lock:
+            if self._size is None:
+                self._size = self._disk_usage()
+            else:
+                self._size += os.path.getsize(path)
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _entries(self):
+        try:
+            with os.scandir(self.root) as entries:
+                return [
+                    (entry.stat().st_mtime, entry.stat().st_size, entry.path)
+                    for entry in entries
+                    if entry.is_file() and not entry.name.startswith('.')
+                ]
+        except FileNotFoundError:
+            return []
+
+    def _disk_usage(self):
+        return sum(size for _, size, _ in self._entries())
+
+    def _evict(self):
+        """
+        Drop least recently used entries until the cache is back under 90%
+        of its limit, leaving room for the next few stores.
+        """
+        entries = sorted(self._entries())
+        size = sum(size for _, size, _ in entries)
+        target = self.max_bytes * 0.9
+        for _, entry_size, entry_path in entries:
+            if size <= target:
+                break
+            try:
+                os.remove(entry_path)
+            except FileNotFoundError:
+                pass
+            size -= entry_size
+        self._size = size
+
+    def stats(self):
+        """
+        Hit/miss counters of this process and the size of the shared cache.
+        """
+        entries = self._entries()
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'entries': len(entries),
+                'bytes': sum(size for _, size, _ in entries),
+                'max_bytes': self.max_bytes,
+            }
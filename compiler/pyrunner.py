@@ -0,0 +1,136 @@
+"""
+Warm Python runner, started ahead of time by compiler.runner_pool.
+
+The interpreter startup is paid before there is a job: the runner reports
+"ready <cpu seconds used so far>" on stdout, then waits for a single job
+header line on stdin, applies the job's rlimits and runs the submission as
+__main__, with the rest of stdin as the submission's input. One runner
+serves exactly one job and exits.
+
+In batch (harness) mode the rest of stdin is a sequence of framed
+testcase inputs, "<size>\n<size bytes>", and the submission is run once
+per frame with that frame as its stdin. After each testcase the runner
+writes "\n<token> <cpu seconds>\n" to stdout, so the judge can split the
+output per testcase. A testcase running past its own CPU time limit is
+killed by SIGPROF.
+
+The submission runs in this interpreter, so it can read the token and
+stop the timer: neither is trusted. The judge measures each testcase's
+CPU time itself and kills the runner at the limit (see
+PythonRunnerPool.run_batch); the timer and the reported times only make
+an honest submission's verdict precise.
+
+Runs as a plain script: no Django, and nothing from the judge beyond the
+standard library.
+"""
+import json
+import os
+import pkgutil  # noqa: F401 -- imported lazily by runpy.run_path, load it while warming up
+import resource
+import runpy
+import signal
+import sys
+import tempfile
+import traceback
+
+
+def _read_line(fd):
+    """
+    Read a line straight from fd, one byte at a time, so that not a single
+    byte of the submission's input ends up in a Python-level buffer
+    (submissions may read fd 0 directly, e.g. open(0).read()).
+    """
+    line = bytearray()
+    while True:
+        byte = os.read(fd, 1)
+        if not byte or byte == b'\n':
+            return bytes(line)
+        line += byte
+
+
+def _read_exact(fd, size):
+    data = bytearray()
+    while len(data) < size:
+        chunk = os.read(fd, size - len(data))
+        if not chunk:
+            break
+        data += chunk
+    return bytes(data)
+
+
+def _cpu_time():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def _run(path):
+    try:
+        runpy.run_path(path, run_name='__main__')
+    except SystemExit:
+        raise
+    except BaseException:
+        # print the traceback `python path` would, without the runner's frames
+        exc_type, exc, tb = sys.exc_info()
+        while tb is not None and tb.tb_frame.f_code.co_filename != path:
+            tb = tb.tb_next
+        traceback.print_exception(exc_type, exc, tb)
+        sys.exit(1)
+
+
+def _stdin_from(data):
+    """
+    Make data the whole of fd 0 and sys.stdin.
+    """
+    if hasattr(os, 'memfd_create'):
+        fd = os.memfd_create('stdin')
+    else:
+        fd = os.dup(tempfile.TemporaryFile().fileno())
+    os.write(fd, data)
+    os.lseek(fd, 0, os.SEEK_SET)
+    os.dup2(fd, 0)
+    os.close(fd)
+    sys.stdin = open(0, 'r', closefd=False)
+
+
+def _run_batch(path, token, time_limit):
+    frames = os.dup(0)
+    while True:
+        size = _read_line(frames)
+        if not size:
+            return
+        _stdin_from(_read_exact(frames, int(size)))
+
+        start = _cpu_time()
+        signal.setitimer(signal.ITIMER_PROF, time_limit)
+        try:
+            _run(path)
+        except SystemExit as e:
+            # a solution ending with sys.exit() / exit(0) just finished its testcase
+            if e.code not in (None, 0):
+                raise
+        signal.setitimer(signal.ITIMER_PROF, 0)
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os.write(1, f"\n{token} {_cpu_time() - start:.6f}\n".encode())
+
+
+def main():
+    sys.stdout.write(f"ready {_cpu_time()}\n")
+    sys.stdout.flush()
+
+    header = json.loads(_read_line(0))
+    for name, value in header['rlimits'].items():
+        resource.setrlimit(getattr(resource, name), tuple(value))
+
+    path = header['path']
+    sys.argv = [path]
+    sys.path[0] = os.path.dirname(path)
+
+    if header.get('batch'):
+        _run_batch(path, header['batch'], header['time_limit'])
+    else:
+        _run(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,179 @@
+"""
+Pool of pre-started Python runners (see compiler/pyrunner.py).
+
+Python submissions are handed to a runner whose interpreter is already up,
+so a testcase only pays for the solution itself instead of 20-40 ms of
+interpreter startup. Each runner serves a single job in its own process
+group and exits; a replacement is started as soon as one is taken.
+"""
+import atexit
+import json
+import queue
+import re
+import signal
+import subprocess
+import threading
+from pathlib import Path
+from uuid import uuid4
+
+from django.conf import settings
+
+from .sandbox import (
+    CLOCK_TICKS, MAX_OUTPUT_BYTES, TLE, _cpu_time, resource, rlimits, sandbox_user, supervise
+)
+
+RUNNER_PATH = Path(__file__).resolve().parent / 'pyrunner.py'
+POOL_SIZE = getattr(settings, 'JUDGE_PYTHON_RUNNERS', 4)
+# the judge reads CPU time in clock ticks, and a testcase marker a moment
+# after it is written
+TICK_SLACK = 2 / CLOCK_TICKS
+
+
+class PythonRunnerPool:
+    def __init__(self, size):
+        self.size = size
+        self._ready = queue.Queue()
+        self._lock = threading.Lock()
+
+    def _spawn(self):
+        return subprocess.Popen(
+            ['python', str(RUNNER_PATH)],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            start_new_session=True,
+            **sandbox_user(),
+        )
+
+    def _fill(self):
+        with self._lock:
+            while self._ready.qsize() < self.size:
+                self._ready.put(self._spawn())
+
+    def acquire(self):
+        """
+        Take a warm runner (or start one if the pool ran dry) and wait for
+        it to be ready. Returns (process, CPU seconds its startup used).
+        """
+        while True:
+            try:
+                proc = self._ready.get_nowait()
+            except queue.Empty:
+                proc = self._spawn()
+            self._fill()
+
+            line = proc.stdout.readline().split()
+            if len(line) == 2 and line[0] == b'ready':
+                return proc, float(line[1])
+            # the runner died while idle, try the next one
+            proc.kill()
+            proc.wait()
+
+    def run(self, path, cinput, time_limit=1.0, memory_limit=256, output_limit=None, stdout_sink=None):
+        """
+        Run the python file at path on a warm runner; same arguments and
+        result as sandbox.run_sandboxed.
+        """
+        output_limit = output_limit or MAX_OUTPUT_BYTES
+        proc, startup_cpu = self.acquire()
+        header = {
+            'path': str(path),
+            'rlimits': rlimits(time_limit, memory_limit, output_limit, cpu_offset=startup_cpu),
+        }
+        stdin_data = json.dumps(header).encode() + b'\n' + cinput.encode()
+        return supervise(
+            proc, stdin_data, time_limit, memory_limit, output_limit,
+            cpu_offset=startup_cpu, stdout_sink=stdout_sink,
+        )
+
+    def run_batch(self, path, cinputs, time_limit=1.0, memory_limit=256, output_limit=None):
+        """
+        Run the python file at path once for all cinputs (harness mode).
+        time_limit applies per testcase. Returns (outputs, cpu_times,
+        run_process): the stdout and CPU time of every testcase that
+        completed, and the sandbox result of the whole run, whose stdout and
+        cpu_time are what the unfinished testcase printed and used.
+
+        The submission shares the runner's interpreter, so it could forge
+        the runner's testcase markers or stop its SIGPROF timer. The judge
+        therefore also reads the runner's CPU time itself whenever a marker
+        arrives: a testcase is charged the larger of the two, and a run
+        whose current testcase exceeds time_limit by the judge's clock is
+        killed. What remains is that a submission reading ahead of its
+        input could spread work across testcases, never past the total.
+        """
+        output_limit = output_limit or MAX_OUTPUT_BYTES
+        total_time_limit = time_limit * len(cinputs)
+        token = uuid4().hex
+        marker = re.compile(rb'\n' + token.encode() + rb' ([0-9.]+)\n')
+
+        proc, startup_cpu = self.acquire()
+        header = {
+            'path': str(path),
+            'rlimits': rlimits(total_time_limit, memory_limit, output_limit, cpu_offset=startup_cpu),
+            'batch': token,
+            'time_limit': time_limit,
+        }
+        frames = [json.dumps(header).encode() + b'\n']
+        for cinput in cinputs:
+            data = cinput.encode()
+            frames.append(f'{len(data)}\n'.encode() + data)
+
+        outputs, cpu_times = [], []
+        pending = bytearray()
+        marks = [startup_cpu]  # the runner's CPU time at the start of each testcase
+
+        def split_testcases(data):
+            pending.extend(data)
+            while (match := marker.search(pending)) is not None:
+                cpu = _cpu_time(proc.pid)
+                outputs.append(bytes(pending[:match.start()]))
+                cpu_times.append(max(float(match.group(1)), cpu - marks[-1] - TICK_SLACK))
+                marks.append(cpu)
+                del pending[:match.end()]
+            return True
+
+        def cpu_limit():
+            return min(marks[-1] + time_limit + TICK_SLACK, startup_cpu + total_time_limit)
+
+        run_process = supervise(
+            proc, b''.join(frames), total_time_limit, memory_limit, output_limit,
+            cpu_offset=startup_cpu, stdout_sink=split_testcases, cpu_limit=cpu_limit,
+        )
+        if run_process['returncode'] == -signal.SIGPROF:
+            # the runner's per-testcase CPU timer went off
+            run_process['verdict'] = TLE
+        run_process['stdout'] = bytes(pending)
+        run_process['cpu_time'] = max(0.0, run_process['cpu_time'] - (marks[-1] - startup_cpu))
+        return outputs, cpu_times, run_process
+
+    def close(self):
+        """
+        Stop the idle runners.
+        """
+        while True:
+            try:
+                proc = self._ready.get_nowait()
+            except queue.Empty:
+                return
+            proc.kill()
+            proc.wait()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """
+    The process-wide runner pool, or None when warm runners are disabled
+    (JUDGE_PYTHON_RUNNERS = 0) or unsupported on this platform.
+    """
+    global _pool
+    if POOL_SIZE <= 0 or resource is None:
+        return None
+    with _pool_lock:
+        if _pool is None:
+            _pool = PythonRunnerPool(POOL_SIZE)
+            atexit.register(_pool.close)
+        return _pool
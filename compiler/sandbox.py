@@ -0,0 +1,366 @@
+"""
+Resource-limited execution of submitted programs.
+
+Every run gets a wall-clock limit, a CPU-time limit, an address-space cap,
+a process-count cap and an output-size cap (setrlimit on Linux), and is
+classified into one of the verdicts below.
+
+RLIMIT_NPROC counts the processes of a uid and doesn't apply to root, so a
+judge running as root runs submissions as JUDGE_SANDBOX_USER. The process
+cap is then shared by the submissions being judged at the same time.
+"""
+import logging
+import math
+import os
+import selectors
+import signal
+import subprocess
+import time
+
+from django.conf import settings
+
+try:
+    import pwd
+    import resource
+except ImportError:  # Windows: only the wall-clock and output limits apply
+    resource = None
+
+OK = 'OK'
+TLE = 'TLE'
+MLE = 'MLE'
+OLE = 'OLE'
+RE = 'RE'
+# the stdout sink asked to stop the program (e.g. its output already mismatched)
+STOPPED = 'STOPPED'
+
+VERDICT_MESSAGES = {
+    TLE: "Time Limit Exceeded",
+    MLE: "Memory Limit Exceeded",
+    OLE: "Output Limit Exceeded",
+    RE: "Runtime Error",
+}
+
+MAX_PROCESSES = getattr(settings, 'JUDGE_MAX_PROCESSES', 64)
+SANDBOX_USER = getattr(settings, 'JUDGE_SANDBOX_USER', '')
+MAX_OUTPUT_BYTES = getattr(settings, 'JUDGE_MAX_OUTPUT_BYTES', 16 * 1024 * 1024)
+# wall-clock limit = WALL_TIME_FACTOR * time_limit + WALL_TIME_SLACK, so a
+# program sleeping or blocked on input can't hold a judge slot forever
+WALL_TIME_FACTOR = getattr(settings, 'JUDGE_WALL_TIME_FACTOR', 2.0)
+WALL_TIME_SLACK = 0.5
+
+CHUNK_SIZE = 64 * 1024
+# how often a silent program's memory and CPU time are sampled
+SAMPLE_INTERVAL = 0.02
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+
+OOM_MARKERS = (b'MemoryError', b'std::bad_alloc', b'Cannot allocate memory')
+
+logger = logging.getLogger(__name__)
+
+if resource is not None and os.geteuid() == 0 and not SANDBOX_USER:
+    logger.warning("The judge runs as root without JUDGE_SANDBOX_USER: submissions have no process cap")
+
+
+def sandbox_user():
+    """
+    subprocess.Popen arguments running the program as JUDGE_SANDBOX_USER,
+    when the judge runs as root (nobody else can switch users).
+    """
+    if resource is None or not SANDBOX_USER or os.geteuid() != 0:
+        return {}
+    user = pwd.getpwnam(SANDBOX_USER)
+    return {'user': user.pw_uid, 'group': user.pw_gid, 'extra_groups': []}
+
+
+def rlimits(time_limit, memory_limit, output_limit, cpu_offset=0.0):
+    """
+    The rlimits of a run as {RLIMIT name: (soft, hard)}. cpu_offset is CPU
+    time the process already used before the submission started (a warm
+    runner's interpreter startup).
+    """
+    cpu_seconds = max(1, math.ceil(cpu_offset + time_limit))
+    memory_bytes = memory_limit * 1024 * 1024
+    return {
+        'RLIMIT_CPU': (cpu_seconds, cpu_seconds + 1),
+        'RLIMIT_AS': (memory_bytes, memory_bytes),
+        'RLIMIT_NPROC': (MAX_PROCESSES, MAX_PROCESSES),
+        'RLIMIT_FSIZE': (output_limit, output_limit),
+        'RLIMIT_CORE': (0, 0),
+    }
+
+
+def _limit_resources(time_limit, memory_limit, output_limit):
+    """
+    Returns the preexec function applying the rlimits in the child, between
+    fork and exec (after the switch to sandbox_user()). It only makes raw
+    setrlimit calls, so it is safe to use from a multi-threaded judge.
+    """
+    limits = [
+        (getattr(resource, name), value)
+        for name, value in rlimits(time_limit, memory_limit, output_limit).items()
+    ]
+
+    def preexec():
+        os.setsid()
+        for limit, value in limits:
+            resource.setrlimit(limit, value)
+
+    return preexec
+
+
+def _kill(proc):
+    """
+    Kill the program together with anything it spawned.
+    """
+    try:
+        if resource is not None:
+            os.killpg(proc.pid, signal.SIGKILL)
+        else:
+            proc.kill()
+    except (ProcessLookupError, PermissionError):
+        pass
+
+
+def _peak_rss(pid):
+    """
+    Peak RSS in KB of a running program, 0 once it has exited.
+    ru_maxrss can't be used for this: it keeps the judge's own RSS from
+    before the exec.
+    """
+    try:
+        with open(f'/proc/{pid}/status', 'rb') as f:
+            for line in f:
+                if line.startswith(b'VmHWM:'):
+                    return int(line.split()[1])
+    except (OSError, ValueError):
+        pass
+    return 0
+
+
+def _cpu_time(pid):
+    """
+    CPU seconds used so far by a running program, 0 once it has exited.
+    Lets the judge stop a program at its fractional time limit instead of
+    the whole second RLIMIT_CPU is rounded up to.
+    """
+    try:
+        with open(f'/proc/{pid}/stat', 'rb') as f:
+            fields = f.read().rpartition(b')')[2].split()
+        return (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+    except (OSError, ValueError, IndexError):
+        return 0.0
+
+
+def _classify(verdict, returncode, cpu_time, memory, stderr, time_limit, memory_limit):
+    if verdict is not None:
+        return verdict
+    if returncode == -signal.SIGXCPU or cpu_time > time_limit:
+        return TLE
+    if returncode == -signal.SIGXFSZ:
+        return OLE
+    if memory > memory_limit * 1024:
+        return MLE
+    if returncode != 0:
+        if any(marker in stderr for marker in OOM_MARKERS):
+            return MLE
+        return RE
+    return OK
+
+
+def _communicate(proc, stdin_data, deadline, cpu_limit, output_limit, stdout_sink=None):
+    """
+    Feed stdin and drain stdout/stderr without blocking, until both pipes
+    are closed, the deadline or the CPU time limit passes (TLE) or the
+    output cap is hit (OLE). cpu_limit may be a callable, returning the
+    CPU seconds the program may have used by now.
+    With a stdout_sink, stdout is handed to it chunk by chunk instead of
+    being collected; the run is STOPPED as soon as the sink returns False.
+    """
+    stdout, stderr = bytearray(), bytearray()
+    output_size = 0
+    selector = selectors.DefaultSelector()
+    selector.register(proc.stdout, selectors.EVENT_READ, stdout)
+    selector.register(proc.stderr, selectors.EVENT_READ, stderr)
+
+    stdin_view = memoryview(stdin_data)
+    if stdin_data:
+        os.set_blocking(proc.stdin.fileno(), False)
+        selector.register(proc.stdin, selectors.EVENT_WRITE)
+    else:
+        proc.stdin.close()
+
+    verdict = None
+    memory = 0
+    try:
+        while selector.get_map() and verdict is None:
+            memory = max(memory, _peak_rss(proc.pid))
+            timeout = deadline - time.monotonic()
+            limit = cpu_limit() if callable(cpu_limit) else cpu_limit
+            if timeout <= 0 or _cpu_time(proc.pid) > limit:
+                verdict = TLE
+                break
+
+            for key, _ in selector.select(min(timeout, SAMPLE_INTERVAL)):
+                if key.fileobj is proc.stdin:
+                    try:
+                        written = os.write(key.fd, stdin_view[:CHUNK_SIZE])
+                    except BlockingIOError:
+                        continue
+                    except BrokenPipeError:
+                        written = len(stdin_view)
+                    stdin_view = stdin_view[written:]
+                    if not stdin_view:
+                        selector.unregister(proc.stdin)
+                        proc.stdin.close()
+                    continue
+
+                data = os.read(key.fd, CHUNK_SIZE)
+                if not data:
+                    selector.unregister(key.fileobj)
+                    continue
+                output_size += len(data)
+                if output_size > output_limit:
+                    verdict = OLE
+                    break
+                if key.data is stdout and stdout_sink is not None:
+                    if not stdout_sink(data):
+                        verdict = STOPPED
+                        break
+                    continue
+                key.data.extend(data)
+    finally:
+        selector.close()
+
+    return verdict, bytes(stdout), bytes(stderr), memory
+
+
+def _wait(proc, deadline, memory):
+    """
+    Reap the program, killing it at the deadline.
+    Returns (timed_out, returncode, cpu_time, peak memory in KB).
+    """
+    timed_out = False
+    while True:
+        memory = max(memory, _peak_rss(proc.pid))
+        pid, status, usage = os.wait4(proc.pid, os.WNOHANG)
+        if pid:
+            break
+        if time.monotonic() >= deadline:
+            timed_out = True
+            _kill(proc)
+            pid, status, usage = os.wait4(proc.pid, 0)
+            break
+        time.sleep(0.005)
+
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    return timed_out, proc.returncode, usage.ru_utime + usage.ru_stime, memory
+
+
+def run_sandboxed(cmd, cinput, time_limit=1.0, memory_limit=256, output_limit=None, stdout_sink=None):
+    """
+    Run cmd with cinput on stdin under the given limits
+    (time_limit in seconds, memory_limit in MB, output_limit in bytes).
+    Returns dict(verdict, stdout, stderr, returncode, time, cpu_time, memory)
+    where time/cpu_time are in seconds and memory is the peak RSS in KB.
+    With a stdout_sink (see _communicate) the returned stdout is empty.
+    """
+    output_limit = output_limit or MAX_OUTPUT_BYTES
+    stdin_data = cinput.encode() if isinstance(cinput, str) else cinput
+
+    if resource is None:
+        return _run_portable(cmd, stdin_data, time_limit, output_limit, stdout_sink)
+
+    proc = subprocess.Popen(
+        cmd,
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        preexec_fn=_limit_resources(time_limit, memory_limit, output_limit),
+        **sandbox_user(),
+    )
+    return supervise(proc, stdin_data, time_limit, memory_limit, output_limit, stdout_sink=stdout_sink)
+
+
+def supervise(proc, stdin_data, time_limit=1.0, memory_limit=256, output_limit=None, cpu_offset=0.0,
+              stdout_sink=None, cpu_limit=None):
+    """
+    Drive an already started, already limited program: feed it stdin_data,
+    collect its output and enforce the wall-clock and output limits.
+    proc must lead its own process group. cpu_offset is subtracted from the
+    measured CPU time. cpu_limit (see _communicate) replaces the CPU limit
+    time_limit + cpu_offset. Returns the same dict as run_sandboxed.
+    """
+    output_limit = output_limit or MAX_OUTPUT_BYTES
+    start = time.monotonic()
+    deadline = start + WALL_TIME_FACTOR * time_limit + WALL_TIME_SLACK
+
+    try:
+        verdict, stdout, stderr, memory = _communicate(
+            proc, stdin_data, deadline, cpu_limit or time_limit + cpu_offset, output_limit, stdout_sink
+        )
+        if verdict is not None:
+            _kill(proc)
+        timed_out, returncode, cpu_time, memory = _wait(proc, deadline, memory)
+    finally:
+        # take down whatever the program left behind in its process group
+        _kill(proc)
+        for pipe in (proc.stdin, proc.stdout, proc.stderr):
+            pipe.close()
+
+    if timed_out and verdict is None:
+        verdict = TLE
+    cpu_time = max(0.0, cpu_time - cpu_offset)
+
+    return {
+        'verdict': _classify(verdict, returncode, cpu_time, memory, stderr, time_limit, memory_limit),
+        'stdout': stdout,
+        'stderr': stderr,
+        'returncode': returncode,
+        'time': time.monotonic() - start,
+        'cpu_time': cpu_time,
+        'memory': memory,
+    }
+
+
+def _run_portable(cmd, stdin_data, time_limit, output_limit, stdout_sink=None):
+    """
+    Fallback for platforms without setrlimit/wait4: wall-clock and output
+    limits only. A stdout_sink gets the whole stdout at once.
+    """
+    start = time.monotonic()
+    proc = subprocess.Popen(
+        cmd,
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    )
+    verdict = None
+    try:
+        stdout, stderr = proc.communicate(
+            stdin_data, timeout=WALL_TIME_FACTOR * time_limit + WALL_TIME_SLACK
+        )
+    except subprocess.TimeoutExpired:
+        proc.kill()
+        stdout, stderr = proc.communicate()
+        verdict = TLE
+
+    if verdict is None and len(stdout) + len(stderr) > output_limit:
+        verdict = OLE
+    elif verdict is None:
+        verdict = OK if proc.returncode == 0 else RE
+
+    if stdout_sink is not None:
+        if verdict in (OK, RE) and not stdout_sink(stdout[:output_limit]):
+            verdict = STOPPED
+        stdout = b''
+
+    elapsed = time.monotonic() - start
+    return {
+        'verdict': verdict,
+        'stdout': stdout[:output_limit],
+        'stderr': stderr[:output_limit],
+        'returncode': proc.returncode,
+        'time': elapsed,
+        'cpu_time': elapsed,
+        'memory': 0,
+    }
@@ -1,3 +1,174 @@
-from django.test import TestCase
+import os
+import pwd
+import sys
+import tempfile
+from pathlib import Path
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.test import SimpleTestCase
+
+from compiler import sandbox, views
+from compiler.cache import CompileCache
+from compiler.runner_pool import PythonRunnerPool
+
+
+class SandboxTestCase(SimpleTestCase):
+    def run_python(self, code, cinput="", **limits):
+        return sandbox.run_sandboxed([sys.executable, '-c', code], cinput, **limits)
+
+    def test_ok(self):
+        result = self.run_python("print(input()[::-1])", "judge")
+        self.assertEqual(result['verdict'], sandbox.OK)
+        self.assertEqual(result['stdout'], b"egduj\n")
+
+    def test_infinite_loop_is_tle(self):
+        result = self.run_python("while True: pass", time_limit=0.5)
+        self.assertEqual(result['verdict'], sandbox.TLE)
+
+    def test_sleeping_is_tle(self):
+        result = self.run_python("import time; time.sleep(30)", time_limit=0.5)
+        self.assertEqual(result['verdict'], sandbox.TLE)
+
+    def test_allocation_is_mle(self):
+        result = self.run_python("x = [0] * (10 ** 9)", memory_limit=64)
+        self.assertEqual(result['verdict'], sandbox.MLE)
+
+    def test_flood_is_ole(self):
+        result = self.run_python("while True: print('x' * 1000)", output_limit=1024 * 1024)
+        self.assertEqual(result['verdict'], sandbox.OLE)
+
+    def test_crash_is_re(self):
+        result = self.run_python("raise ValueError('boom')")
+        self.assertEqual(result['verdict'], sandbox.RE)
+        self.assertIn(b"ValueError", result['stderr'])
+
+    @skipUnless(sandbox.resource is not None and os.geteuid() == 0, "needs a root judge")
+    def test_root_judge_runs_submissions_unprivileged(self):
+        with mock.patch.object(sandbox, 'SANDBOX_USER', 'nobody'):
+            result = sandbox.run_sandboxed(['/bin/sh', '-c', 'id -u'], "")
+            self.assertEqual(result['stdout'], b"%d\n" % pwd.getpwnam('nobody').pw_uid)
+
+            with mock.patch.object(sandbox, 'MAX_PROCESSES', 8):
+                fork_bomb = "for i in $(seq 50); do sleep 5 >/dev/null 2>&1 & done; wait"
+                result = sandbox.run_sandboxed(['/bin/sh', '-c', fork_bomb], "", time_limit=0.5)
+            self.assertEqual(result['verdict'], sandbox.RE)
+            self.assertIn(b"fork", result['stderr'])
+
+
+class CompileCacheTestCase(SimpleTestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.root = Path(tmp.name)
+        self.cache = CompileCache(self.root / 'cache', max_bytes=1024 * 1024)
+
+    def test_identical_source_skips_the_compiler(self):
+        code = "#include <stdio.h>\nint main() { printf(\"hi\"); }"
+        with mock.patch.object(views, 'compile_cache', self.cache), \
+                mock.patch.object(views, '_compile', wraps=views._compile) as compile_mock:
+            first = views.execute('c', code, "")
+            second = views.execute('c', code, "")
+
+        self.assertEqual(first['coutput'], "hi")
+        self.assertEqual(second['coutput'], "hi")
+        self.assertEqual(compile_mock.call_count, 1)
+        self.assertEqual(self.cache.stats()['hits'], 1)
+        self.assertEqual(self.cache.stats()['misses'], 1)
+
+    def test_least_recently_used_entries_are_evicted(self):
+        self.cache.max_bytes = 2500
+        exec_path = self.root / 'exec'
+        for i in range(3):
+            exec_path.write_bytes(b'x' * 1000)
+            self.cache.store(f'key{i}', exec_path)
+            os.remove(exec_path)
+            os.utime(self.cache.root / f'key{i}', (i, i))
+
+        exec_path.write_bytes(b'x' * 1000)
+        self.cache.store('key3', exec_path)
+
+        self.assertFalse(self.cache.fetch('key0', self.root / 'out0'))
+        self.assertTrue(self.cache.fetch('key3', self.root / 'out3'))
+        self.assertLessEqual(self.cache.stats()['bytes'], 2500)
+
+
+class PythonRunnerPoolTestCase(SimpleTestCase):
+    def setUp(self):
+        self.pool = PythonRunnerPool(1)
+        self.addCleanup(self.pool.close)
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = Path(tmp.name) / 'solution.py'
+
+    def run_code(self, code, cinput="", **limits):
+        self.path.write_text(code)
+        return self.pool.run(self.path, cinput, **limits)
+
+    def test_runs_as_main_with_stdin(self):
+        result = self.run_code(
+            "import sys\nif __name__ == '__main__':\n    print(sys.stdin.read().upper())",
+            "warm",
+        )
+        self.assertEqual(result['verdict'], sandbox.OK)
+        self.assertEqual(result['stdout'], b"WARM\n")
+
+    def test_limits_apply(self):
+        result = self.run_code("while True: pass", time_limit=0.5)
+        self.assertEqual(result['verdict'], sandbox.TLE)
+
+    def test_traceback_points_at_the_submission(self):
+        result = self.run_code("raise ValueError('boom')")
+        self.assertEqual(result['verdict'], sandbox.RE)
+        self.assertIn(b"solution.py", result['stderr'])
+        self.assertNotIn(b"runpy", result['stderr'])
+
+    def test_batch_times_are_the_judges(self):
+        # stops the runner's timer and reports forged CPU times
+        self.path.write_text(
+            "import os, signal, sys, time\n"
+            "signal.setitimer(signal.ITIMER_PROF, 0)\n"
+            "frame = sys._getframe()\n"
+            "while 'token' not in frame.f_locals:\n"
+            "    frame = frame.f_back\n"
+            "spin = 0.3 if sys.stdin.read() == '1' else 10\n"
+            "start = time.process_time()\n"
+            "while time.process_time() - start < spin:\n"
+            "    pass\n"
+            "sys.stdout.flush()\n"
+            "os.write(1, f\"\\n{frame.f_locals['token']} 0.01\\n\".encode())\n"
+        )
+        outputs, cpu_times, run_process = self.pool.run_batch(self.path, ["1", "2", "3"], time_limit=0.4)
+        self.assertGreater(cpu_times[0], 0.25)
+        # killed once the second testcase ran past its own time limit
+        self.assertEqual(run_process['verdict'], sandbox.TLE)
+        # the second testcase's own CPU time, not the whole run's
+        self.assertGreater(run_process['cpu_time'], 0.3)
+        self.assertLess(run_process['cpu_time'], 0.8)
+
+    def test_single_and_batch_runs_report_cpu_time(self):
+        artifact = views.compile_code('py', "import time\ntime.sleep(0.3)\nprint(input())")
+        self.addCleanup(views.cleanup, artifact)
+        single = views.run_artifact(artifact, "1")
+        results, failure = views.run_artifact_batch(artifact, ["1", "2"])
+        self.assertIsNone(failure)
+        # sleeping takes wall time, not CPU time
+        self.assertLess(single['time'], 0.2)
+        self.assertTrue(all(result['time'] < 0.2 for result in results))
+
+
+class StreamingOutputTestCase(SimpleTestCase):
+    def test_sink_gets_the_output_and_can_stop_the_run(self):
+        received = []
+
+        def sink(chunk):
+            received.append(chunk)
+            return sum(map(len, received)) < 1024 * 1024
+
+        result = sandbox.run_sandboxed(
+            [sys.executable, '-c', "while True: print('x' * 1000)"], "",
+            time_limit=5, stdout_sink=sink,
+        )
+        self.assertEqual(result['verdict'], sandbox.STOPPED)
+        self.assertEqual(result['stdout'], b"")
+        self.assertLess(result['time'], 5)
+        self.assertTrue(b''.join(received).startswith(b'x' * 1000))
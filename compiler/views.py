@@ -1,9 +1,14 @@
 import os
 from pathlib import Path
 import subprocess
+import time
 from django.conf import settings
 import uuid
 
+from .cache import CompileCache
+from .runner_pool import PythonRunnerPool, get_pool
+from .sandbox import resource, run_sandboxed, OK, RE, STOPPED, TLE, VERDICT_MESSAGES
+
 # define path to tmp directory
 
 
@@ -11,83 +16,103 @@ COMPILER_DIR = Path(settings.BASE_DIR) / 'compiler' / 'tmp'
 CODE_DIR = COMPILER_DIR / 'code'
 EXEC_DIR = COMPILER_DIR / 'executable'
 
-def compile_python(path, cinput):
+COMPILE_TIMEOUT = getattr(settings, 'JUDGE_COMPILE_TIMEOUT', 10)
+
+# compiler and flags per language, the flags are part of the cache key
+COMPILERS = {
+    'c': ('gcc', []),
+    'cpp': ('g++', []),
+}
+
+compile_cache = CompileCache(
+    COMPILER_DIR / 'cache',
+    getattr(settings, 'JUDGE_COMPILE_CACHE_BYTES', 256 * 1024 * 1024),
+)
+
+CE = 'CE'
+
+
+def _run_result(run_process):
     """
-    execute python code
+    Turn a sandboxed run into the dict(coutput, cerr, verdict, ...) returned
+    by run_artifact. Limit violations and crashes are reported in cerror so
+    callers treat them as failures. time is CPU time, what the time limit
+    is enforced on, in batch mode too.
     """
-    process = subprocess.run(
-        ['python', str(path)],
-        input=cinput.encode(),
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-    )
-    return {
-        'coutput': process.stdout.decode('utf-8', errors='replace'),
-        'cerr': process.stderr.decode('utf-8', errors='replace')
+    result = {
+        'coutput': run_process['stdout'].decode('utf-8', errors='replace'),
+        'cerr': run_process['stderr'].decode('utf-8', errors='replace'),
+        'verdict': run_process['verdict'],
+        'time': run_process['cpu_time'],
+        'memory': run_process['memory'],
     }
+    if run_process['verdict'] not in (OK, STOPPED):
+        result['cerror'] = f"{VERDICT_MESSAGES[run_process['verdict']]}\n{result['cerr']}".strip()
+    return result
+
 
-def compile_c(path, cinput):
+def _compile(cmd):
     """
-    compile and execute C code
+    Run a compiler command, returns the compile error message or None.
     """
-    uuid_name = path.stem
-    exec_path = EXEC_DIR / f'{uuid_name}'
+    try:
+        compile_process = subprocess.run(
+            cmd,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            timeout=COMPILE_TIMEOUT,
+        )
+    except subprocess.TimeoutExpired:
+        return f"Compilation timed out after {COMPILE_TIMEOUT}s"
+
+    if compile_process.returncode != 0:
+        return compile_process.stderr.decode('utf-8', errors='replace')
+    return None
+
+
+def _exec_path(path):
+    exec_path = EXEC_DIR / f'{path.stem}'
     if os.name == 'nt':
         exec_path = exec_path.with_suffix('.exe')
-    
-    compile_process = subprocess.run(
-        ['gcc', str(path), '-o', str(exec_path)],
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-    )
+    return exec_path
 
-    if compile_process.returncode != 0:
-        return {
-            'coutput': '',
-            'cerror' : compile_process.stderr.decode('utf-8', errors='replace')
-        }
-    
-    run_process = subprocess.run(
-        [str(exec_path)],
-        input=cinput.encode(),
-        capture_output=True,
-    )
-    return {
-        'coutput': run_process.stdout.decode('utf-8', errors='replace'),
-        'cerr': run_process.stderr.decode('utf-8', errors='replace')
-    }
 
-def compile_cpp(path, cinput):
+def compile_python(path):
     """
-    compile and execute C++ code
+    python needs no compile step, the artifact runs the source
     """
-    uuid_name = path.stem
-    exec_path = EXEC_DIR / f'{uuid_name}'
-    
-    if os.name == 'nt':
-        exec_path = exec_path.with_suffix('.exe')
-    
-    compile_process = subprocess.run(
-        ['g++', str(path), '-o', str(exec_path)],
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-    )
+    return {'cmd': ['python', str(path)], 'path': path, 'files': [path]}
 
-    if compile_process.returncode != 0:
-        return {
-            'coutput': '',
-            'cerror' : compile_process.stderr.decode('utf-8', errors='replace')
-        }
-    
-    run_process = subprocess.run(
-        [str(exec_path)],
-        input=cinput.encode(),
-        capture_output=True,
-    )
-    return {
-        'coutput': run_process.stdout.decode('utf-8', errors='replace'),
-        'cerr': run_process.stderr.decode('utf-8', errors='replace')
-    }
+def _compile_native(path, language):
+    """
+    compile C/C++ code, or take the executable from the compile cache
+    when the same source was compiled before
+    """
+    compiler, flags = COMPILERS[language]
+    exec_path = _exec_path(path)
+
+    key = compile_cache.key(language, path.read_bytes(), compiler, flags)
+    if compile_cache.fetch(key, exec_path):
+        return {'cmd': [str(exec_path)], 'files': [path, exec_path], 'cached': True}
+
+    compile_error = _compile([compiler, str(path), *flags, '-o', str(exec_path)])
+    if compile_error is not None:
+        return {'cerror': compile_error, 'files': [path]}
+
+    compile_cache.store(key, exec_path)
+    return {'cmd': [str(exec_path)], 'files': [path, exec_path], 'cached': False}
+
+def compile_c(path):
+    """
+    compile C code
+    """
+    return _compile_native(path, 'c')
+
+def compile_cpp(path):
+    """
+    compile C++ code
+    """
+    return _compile_native(path, 'cpp')
 
 LANGAUGE_DISPATCH = {
     'py' : compile_python,
@@ -95,34 +120,142 @@ LANGAUGE_DISPATCH = {
     'c' : compile_c,
 }
 
-def execute(language, code, cinput) :
+def compile_code(language, code):
     """
-     write the code to a file,
-     call compile function
-     return dict(coutput, cerror) 
+     write the code to a file and call the compile function once.
+     return the artifact dict(language, cmd, compile_time, files),
+     or dict(coutput, cerror, verdict=CE) on a compile error.
+     The artifact is meant to be run with run_artifact for every testcase
+     and released with cleanup.
     """
+    if language not in LANGAUGE_DISPATCH:
+        return {
+            'coutput': '',
+            'cerror': 'Unsupported language',
+            'verdict': CE,
+        }
 
     uuid_name = uuid.uuid4()
 
-
     CODE_DIR.mkdir(parents=True, exist_ok=True)
     EXEC_DIR.mkdir(parents=True, exist_ok=True)
 
-    path = None
     if language in ['cpp', 'c']:
-        cinput = cinput.replace("None", "null")
         path = CODE_DIR / f'{uuid_name}.{language}'
-    else: 
-        cinput = cinput.replace("null", "None")
+    else:
         path = EXEC_DIR / f'{uuid_name}.py'
 
-    if path is None:
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(code)
+
+    start = time.monotonic()
+    artifact = LANGAUGE_DISPATCH[language](path)
+    artifact['compile_time'] = time.monotonic() - start
+    artifact['language'] = language
+
+    if 'cerror' in artifact:
+        cleanup(artifact)
         return {
             'coutput': '',
-            'cerr': 'Unsupported language'
+            'cerror': artifact['cerror'],
+            'verdict': CE,
+            'compile_time': artifact['compile_time'],
         }
+    return artifact
 
-    with open(path, 'w', encoding='utf-8') as f:
-        f.write(code)
+def run_artifact(artifact, cinput, time_limit=1.0, memory_limit=256, stdout_sink=None):
+    """
+     run a compiled artifact on cinput under the time (s) and memory (MB) limits
+     return dict(coutput, cerr, cerror, verdict, time, memory), time in CPU seconds
+     with a stdout_sink the output is streamed to it instead of returned in
+     coutput, and the run is stopped (verdict STOPPED) once the sink returns False
+    """
+    if artifact['language'] in ['cpp', 'c']:
+        cinput = cinput.replace("None", "null")
+    else:
+        cinput = cinput.replace("null", "None")
+
+    pool = get_pool() if artifact['language'] == 'py' else None
+    if pool is not None:
+        # warm interpreter, no startup cost
+        run_process = pool.run(
+            artifact['path'], cinput, time_limit, memory_limit, stdout_sink=stdout_sink
+        )
+    else:
+        run_process = run_sandboxed(
+            artifact['cmd'], cinput,
+            time_limit=time_limit, memory_limit=memory_limit, stdout_sink=stdout_sink,
+        )
+    return _run_result(run_process)
+
+def supports_batch(language):
+    """
+     whether run_artifact_batch can run artifacts of language
+    """
+    return language == 'py' and resource is not None
+
+def run_artifact_batch(artifact, cinputs, time_limit=1.0, memory_limit=256):
+    """
+     run a python artifact once for all cinputs (harness mode), time_limit
+     applies per testcase
+     return (results, failure): dict(coutput, time, memory) for every testcase that
+     completed, and the run result of the first testcase that didn't
+     (None if all passed the limits)
+    """
+    cinputs = [cinput.replace("null", "None") for cinput in cinputs]
+    # without warm runners a single cold runner serves the batch
+    pool = get_pool() or PythonRunnerPool(0)
+    outputs, cpu_times, run_process = pool.run_batch(
+        artifact['path'], cinputs, time_limit, memory_limit
+    )
+
+    results = []
+    for output, cpu_time in zip(outputs, cpu_times):
+        if cpu_time > time_limit:
+            return results, {
+                'coutput': output.decode('utf-8', errors='replace'),
+                'cerror': VERDICT_MESSAGES[TLE],
+                'verdict': TLE,
+                'time': cpu_time,
+                'memory': run_process['memory'],
+            }
+        results.append({
+            'coutput': output.decode('utf-8', errors='replace'),
+            'time': cpu_time,
+            # the harness process' peak, testcases share the process
+            'memory': run_process['memory'],
+        })
+
+    if len(results) < len(cinputs):
+        if run_process['verdict'] == OK:
+            # exited cleanly without finishing the testcase (e.g. os._exit)
+            run_process['verdict'] = RE
+        return results, _run_result(run_process)
+    return results, None
+
+def cleanup(artifact):
+    """
+     remove the source and executable files of an artifact
+    """
+    for path in artifact.get('files', []):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+def execute(language, code, cinput, time_limit=1.0, memory_limit=256) :
+    """
+     compile the code, run it once on cinput under the time (s) and
+     memory (MB) limits
+     return dict(coutput, cerror, verdict, compile_time, time)
+    """
+    artifact = compile_code(language, code)
+    if artifact.get('verdict') == CE:
+        return artifact
 
-    return LANGAUGE_DISPATCH[language](path, cinput)
+    try:
+        result = run_artifact(artifact, cinput, time_limit, memory_limit)
+    finally:
+        cleanup(artifact)
+    result['compile_time'] = artifact['compile_time']
+    return result
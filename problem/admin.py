@@ -1,5 +1,6 @@
 from django.contrib import admin
 from . import models, forms
+from .testcase_store import testcase_store
 import os
 
 class ProblemAdmin(admin.ModelAdmin):
@@ -20,6 +21,15 @@ class ProblemAdmin(admin.ModelAdmin):
 
             with open(testcases_file, 'w') as f:
                 f.write(testcases)
+            testcase_store.invalidate(obj.id)
 
 
-admin.site.register(models.Problem, ProblemAdmin)
\ No newline at end of file
+admin.site.register(models.Problem, ProblemAdmin)
+
+
+class SubmissionAdmin(admin.ModelAdmin):
+    list_display = ('id', 'user', 'problem', 'language', 'verdict', 'created_at')
+    list_filter = ('verdict', 'language')
+
+
+admin.site.register(models.Submission, SubmissionAdmin)
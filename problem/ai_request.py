@@ -2,52 +2,91 @@ from google import genai
 from google.genai import types
 
 import os
+import threading
+from django.conf import settings
 from dotenv import load_dotenv
 
+load_dotenv()
 
-def aicall(payload:list[str], action):
+SYSTEM_PROMPT = [
+        "You are a highly skilled programming assistant. \
+        Your purpose is to help the user progress toward the correct code without giving complete solution.\
+        Your task:\
+            1. If the user is solving a problem, provide 1-5 concise, actionable hints that guide them toward the right code.\
+                * Focus on thought process, approach and concept rather than exact code.\
+                * Hints must be short, concise, clear and avoid any step-by-step solution.\
+            2. If the user shares code, review it and give concise feedback for refactoring.\
+                * Identify key issues, suggest improvement and highlight best practices.\
+                * Feedback should be high-level and  avoid rewriting any complete code.\
+        Important: \
+            * Choose exactly one direction per request (either hint or code review), never both\
+            * never write or rewrite the complete code.\
+            * keep response concise and practical.\
+            * Avoid any step-by-step solution or complete code.\
+        "
+    ]
+
+
+class AIError(Exception):
+    pass
+
+
+_client = None
+_client_lock = threading.Lock()
 
-    load_dotenv()
-    api_key = os.getenv('GEMINI_API_KEY')
-
-    if not api_key:
-        raise ValueError("GEMINI_API_KEY environment variable is not set.")
-
-    system_prompt = [
-            "You are a highly skilled programming assistant. \
-            Your purpose is to help the user progress toward the correct code without giving complete solution.\
-            Your task:\
-                1. If the user is solving a problem, provide 1-5 concise, actionable hints that guide them toward the right code.\
-                    * Focus on thought process, approach and concept rather than exact code.\
-                    * Hints must be short, concise, clear and avoid any step-by-step solution.\
-                2. If the user shares code, review it and give concise feedback for refactoring.\
-                    * Identify key issues, suggest improvement and highlight best practices.\
-                    * Feedback should be high-level and  avoid rewriting any complete code.\
-            Important: \
-                * Choose exactly one direction per request (either hint or code review), never both\
-                * never write or rewrite the complete code.\
-                * keep response concise and practical.\
-                * Avoid any step-by-step solution or complete code.\
-            "
-        ]
 
+def _get_client():
+    """
+    One client per process, it keeps its HTTP connections alive between calls.
+    """
+    global _client
+    with _client_lock:
+        if _client is None:
+            api_key = os.getenv('GEMINI_API_KEY')
+            if not api_key:
+                raise ValueError("GEMINI_API_KEY environment variable is not set.")
+            _client = genai.Client(api_key=api_key)
+        return _client
+
+
+def _gemini(user_query, action):
     config = types.GenerateContentConfig(
-        system_instruction=system_prompt,
+        system_instruction=SYSTEM_PROMPT,
         thinking_config=types.ThinkingConfig(
             thinking_budget=0,
         )
     )
+    response = _get_client().models.generate_content(
+        model="gemini-2.5-flash",
+        contents=user_query,
+        config=config,
+    )
+    return response.text
+
 
+def _stub(user_query, action):
+    """
+    Local backend for development and tests: no network, no API key.
+    """
+    lines = user_query[0].splitlines()
+    return f"[stub {action}] Hint for: {lines[0] if lines else ''}"
+
+
+BACKENDS = {
+    'gemini': _gemini,
+    'stub': _stub,
+}
+
+
+def aicall(payload:list[str], action):
+    """
+    Ask the configured AI backend (AI_FEEDBACK_BACKEND) for feedback.
+    Raises AIError if it fails.
+    """
     user_query = ["\n".join(filter(None, (s.strip() for s in payload)))]
-    
-    try:
-        client = genai.Client(api_key=api_key)
-        response = client.models.generate_content(
-            model="gemini-2.5-flash",
-            contents=user_query,
-            config=config,
-        )
+    backend = BACKENDS[getattr(settings, 'AI_FEEDBACK_BACKEND', 'gemini')]
 
-        return response.text
+    try:
+        return backend(user_query, action)
     except Exception as e:
-        return f"An error occurred while communicating with the AI. {e}"
\ No newline at end of file
+        raise AIError(f"An error occurred while communicating with the AI. {e}") from e
@@ -0,0 +1,137 @@
+"""
+Chatspace messages: write-behind persistence and history.
+
+Chat messages are broadcast as soon as they arrive but written to the
+database in batches, one bulk INSERT every CHAT_FLUSH_MESSAGES messages or
+CHAT_FLUSH_INTERVAL seconds, whichever comes first, instead of a write
+(and SQLite's write lock) per message. history() pages through a
+chatspace's messages, including the ones of this process that aren't
+written yet, so someone joining late gets the backlog in one payload.
+"""
+import atexit
+import threading
+
+from django.conf import settings
+from django.db import OperationalError, connections
+from django.utils import timezone
+
+FLUSH_MESSAGES = getattr(settings, 'CHAT_FLUSH_MESSAGES', 50)
+FLUSH_INTERVAL = getattr(settings, 'CHAT_FLUSH_INTERVAL', 0.2)
+HISTORY_PAGE = getattr(settings, 'CHAT_HISTORY_PAGE', 50)
+
+
+def serialize(chat_message):
+    return {
+        'id': chat_message.id,
+        'username': chat_message.username,
+        'message': chat_message.message,
+        'created_at': chat_message.created_at.isoformat(),
+    }
+
+
+class ChatLog:
+    def __init__(self, max_messages, interval):
+        self.max_messages = max_messages
+        self.interval = interval
+        self._pending = []  # ChatMessages not written yet, oldest first
+        self._writing = []  # batches being written right now
+        self._lock = threading.Lock()
+        self._timer = None
+
+    def add(self, chatspace_id, user, message):
+        """
+        Record a chat message, written with the next batch. Doesn't touch
+        the database, so it can be called from the event loop.
+        """
+        from .models import ChatMessage
+
+        chat_message = ChatMessage(
+            chatspace_id=chatspace_id, user_id=user.id, username=user.username,
+            message=message, created_at=timezone.now(),
+        )
+        with self._lock:
+            self._pending.append(chat_message)
+            if len(self._pending) >= self.max_messages:
+                threading.Thread(target=self._flush_in_background, daemon=True).start()
+            else:
+                self._schedule()
+        return chat_message
+
+    def _schedule(self):
+        # called with the lock held
+        if self._timer is None:
+            self._timer = threading.Timer(self.interval, self._flush_in_background)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _flush_in_background(self):
+        try:
+            self.flush()
+        finally:
+            # the thread's own database connection
+            connections.close_all()
+
+    def flush(self):
+        """
+        Write the pending messages. If the database is busy they are kept
+        and retried at the next interval.
+        """
+        from .models import ChatMessage
+
+        with self._lock:
+            batch, self._pending = self._pending, []
+            timer, self._timer = self._timer, None
+            if batch:
+                self._writing.append(batch)
+        if timer is not None:
+            timer.cancel()
+        if not batch:
+            return
+
+        try:
+            ChatMessage.objects.bulk_create(batch)
+        except OperationalError:
+            with self._lock:
+                self._pending[:0] = batch
+                self._schedule()
+            raise
+        finally:
+            with self._lock:
+                self._writing.remove(batch)
+
+    def _unsaved(self, chatspace_id):
+        with self._lock:
+            batches = [*self._writing, self._pending]
+        return [m for batch in batches for m in batch if m.chatspace_id == chatspace_id]
+
+    def history(self, chatspace_id, before=None, limit=HISTORY_PAGE):
+        """
+        The latest limit messages of a chatspace, oldest first, or the ones
+        before message id `before` for older pages. The latest page also
+        has this process' messages that aren't written yet.
+        Returns {'messages': [...], 'more': older messages exist,
+        'before': cursor for the next older page}.
+        """
+        from .models import ChatMessage
+
+        # taken before the query, so a batch written meanwhile is in the
+        # page or in here, or in both (de-duplicated by id below)
+        unsaved = self._unsaved(chatspace_id) if before is None else []
+        rows = ChatMessage.objects.filter(chatspace_id=chatspace_id)
+        if before is not None:
+            rows = rows.filter(id__lt=before)
+        page = list(rows.order_by('-id')[:limit + 1])
+        more = len(page) > limit
+        page = page[:limit][::-1]
+        cursor = page[0].id if page else None
+
+        if unsaved:
+            written = {m.id for m in page}
+            unsaved = [m for m in unsaved if m.id not in written]
+            page = sorted(page + unsaved, key=lambda m: m.created_at)
+
+        return {'messages': [serialize(m) for m in page], 'more': more, 'before': cursor}
+
+
+chat_log = ChatLog(FLUSH_MESSAGES, FLUSH_INTERVAL)
+atexit.register(chat_log.flush)
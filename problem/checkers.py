@@ -0,0 +1,297 @@
+"""
+Streaming output checkers.
+
+A checker is fed the program's stdout chunk by chunk while it runs
+(feed returns False as soon as the output can no longer match, so the judge
+stops the program there) and gives its answer in finish(). Only a bounded
+preview of the output is kept, for error messages, so judging a program
+that prints hundreds of MB takes constant memory.
+
+Every problem picks one of the checkers below (Problem.checker); all of
+them but the special judge ignore letter case, like the judge always did.
+"""
+import codecs
+import os
+import tempfile
+from collections import Counter
+
+from compiler.sandbox import OK, RE, VERDICT_MESSAGES, run_sandboxed
+
+EXACT = 'exact'
+TOKENS = 'tokens'
+FLOAT = 'float'
+UNORDERED = 'unordered'
+SPECIAL = 'special'
+
+# characters of the output kept for error messages
+PREVIEW_CHARS = 1000
+# a token may grow this much past the longest expected token before it
+# can't match anything anymore
+TOKEN_SLACK = 1024
+
+# limits of one special judge run
+SPECIAL_JUDGE_TIME_LIMIT = 5.0
+SPECIAL_JUDGE_MEMORY_LIMIT = 512
+
+
+class Checker:
+    """
+    Decodes the output incrementally, keeps its preview and hands the
+    lowercased text to _check; subclasses implement _check and _complete.
+    """
+    comment = ''
+    # why finish() couldn't decide, a judge error rather than a wrong answer
+    error = None
+
+    def __init__(self):
+        self._decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        self._mismatch = False
+        self._preview = []
+        self._preview_size = 0
+
+    def _keep_preview(self, text):
+        if self._preview_size < PREVIEW_CHARS:
+            text = text[:PREVIEW_CHARS - self._preview_size]
+            self._preview.append(text)
+            self._preview_size += len(text)
+
+    def _check(self, text, final=False):
+        raise NotImplementedError
+
+    def _complete(self):
+        raise NotImplementedError
+
+    def feed(self, chunk):
+        """
+        Check the next chunk of output. Returns False once the output can't
+        match anymore.
+        """
+        if self._mismatch:
+            return False
+        text = self._decoder.decode(chunk)
+        self._keep_preview(text)
+        self._check(text.lower())
+        return not self._mismatch
+
+    def finish(self):
+        """
+        True if the whole output matched.
+        """
+        if not self._mismatch:
+            text = self._decoder.decode(b'', final=True)
+            self._keep_preview(text)
+            self._check(text.lower(), final=True)
+        return not self._mismatch and self._complete()
+
+    @property
+    def output(self):
+        """
+        The start of the output, normalized the way it was compared.
+        """
+        preview = ''.join(self._preview).strip().lower()
+        if self._preview_size >= PREVIEW_CHARS:
+            preview += '...'
+        return preview
+
+
+class ExactChecker(Checker):
+    """
+    The output must equal the expected output up to surrounding whitespace
+    and letter case, i.e. output.strip().lower() == expected where expected
+    is already normalized (see validate.normalize_output).
+    """
+
+    def __init__(self, expected):
+        super().__init__()
+        self.expected = expected
+        self._pos = 0            # how much of expected has been matched
+        self._started = False    # past the leading whitespace
+        self._pending = ''       # whitespace that is only accepted if more output follows
+
+    def _check(self, text, final=False):
+        if not self._started:
+            text = text.lstrip()
+            if not text:
+                return
+            self._started = True
+
+        body = text.rstrip()
+        trailing = text[len(body):]
+        if body:
+            body = self._pending + body
+            self._pending = ''
+            if not self.expected.startswith(body, self._pos):
+                self._mismatch = True
+                return
+            self._pos += len(body)
+
+        # whitespace longer than what is left to match can only be trailing,
+        # there is no need to remember more of it than that
+        room = len(self.expected) - self._pos + 1
+        self._pending = (self._pending + trailing)[:room]
+
+    def _complete(self):
+        return self._pos == len(self.expected)
+
+
+class TokenChecker(Checker):
+    """
+    The output must have the expected whitespace separated tokens, however
+    they are spaced or split over lines.
+    """
+
+    def __init__(self, expected):
+        super().__init__()
+        self.expected = expected.split()
+        self._pos = 0
+        self._partial = ''   # token cut by the chunk boundary
+        self._max_token = max(map(len, self.expected), default=0) + TOKEN_SLACK
+
+    def _check(self, text, final=False):
+        text = self._partial + text
+        tokens = text.split()
+        self._partial = ''
+        if not final and tokens and not text[-1].isspace():
+            self._partial = tokens.pop()
+            if len(self._partial) > self._max_token:
+                self._mismatch = True
+                return
+        if tokens:
+            self._match(tokens)
+
+    def _match(self, tokens):
+        end = self._pos + len(tokens)
+        # one list comparison per chunk instead of a Python loop per token
+        if tokens != self.expected[self._pos:end]:
+            self._mismatch = True
+        self._pos = end
+
+    def _complete(self):
+        return self._pos == len(self.expected)
+
+
+class FloatChecker(TokenChecker):
+    """
+    TokenChecker where numbers only have to be within epsilon of the
+    expected ones, absolutely or relatively (whichever is looser).
+    """
+
+    def __init__(self, expected, epsilon):
+        super().__init__(expected)
+        self.epsilon = epsilon
+
+    def _close(self, token, expected):
+        if token == expected:
+            return True
+        try:
+            value, expected_value = float(token), float(expected)
+        except ValueError:
+            return False
+        return abs(value - expected_value) <= self.epsilon * max(1.0, abs(expected_value))
+
+    def _match(self, tokens):
+        end = self._pos + len(tokens)
+        expected = self.expected[self._pos:end]
+        if len(expected) < len(tokens) or (
+            tokens != expected and not all(map(self._close, tokens, expected))
+        ):
+            self._mismatch = True
+        self._pos = end
+
+
+class UnorderedChecker(TokenChecker):
+    """
+    The output must have the expected tokens, in any order.
+    """
+
+    def __init__(self, expected):
+        super().__init__(expected)
+        self._remaining = Counter(self.expected)
+        self._left = len(self.expected)
+
+    def _match(self, tokens):
+        self._remaining.subtract(tokens)
+        self._left -= len(tokens)
+        if self._left < 0 or any(self._remaining[token] < 0 for token in set(tokens)):
+            self._mismatch = True
+
+    def _complete(self):
+        # nothing went negative, so a total of 0 means every count is 0
+        return self._left == 0
+
+
+class SpecialChecker(Checker):
+    """
+    A problem-specific judge program decides. The output is streamed to a
+    temporary file; finish() runs the judge as
+        judge <input file> <output file> <answer file>
+    and the output passes if it exits with 0, fails with any other exit
+    code. Whatever it prints is kept as the comment on the verdict. A judge
+    that runs out of time or memory or is killed by a signal decided
+    nothing: that is the checker's error.
+    """
+
+    def __init__(self, judge, cinput, answer):
+        super().__init__()
+        self.judge = judge
+        self.cinput = cinput
+        self.answer = answer
+        self._output = tempfile.NamedTemporaryFile(prefix='output-')
+
+    def feed(self, chunk):
+        self._output.write(chunk)
+        if self._preview_size < PREVIEW_CHARS:
+            self._keep_preview(self._decoder.decode(chunk))
+        return True
+
+    def finish(self):
+        with self._output, \
+                tempfile.NamedTemporaryFile('w', prefix='input-') as input_file, \
+                tempfile.NamedTemporaryFile('w', prefix='answer-') as answer_file:
+            self._output.flush()
+            # the judge may run as the sandbox user (see compiler/sandbox.py)
+            for f in (self._output, input_file, answer_file):
+                os.chmod(f.name, 0o644)
+            input_file.write(self.cinput)
+            input_file.flush()
+            answer_file.write(self.answer)
+            answer_file.flush()
+            result = run_sandboxed(
+                [*self.judge['cmd'], input_file.name, self._output.name, answer_file.name], "",
+                time_limit=SPECIAL_JUDGE_TIME_LIMIT, memory_limit=SPECIAL_JUDGE_MEMORY_LIMIT,
+            )
+
+        comment = (result['stdout'] + result['stderr']).decode('utf-8', errors='replace')
+        self.comment = comment.strip()[:PREVIEW_CHARS]
+        if result['verdict'] not in (OK, RE) or result['returncode'] < 0:
+            self.error = "Special judge failed: " + VERDICT_MESSAGES.get(result['verdict'], result['verdict'])
+            if result['verdict'] == RE:
+                self.error += f" (signal {-result['returncode']})"
+        return result['verdict'] == OK
+
+
+def _answer(output):
+    """
+    The expected output of a JSON testcase as given to a special judge:
+    lists space separated, otherwise as is.
+    """
+    if isinstance(output, list):
+        return " ".join(map(str, output))
+    return str(output)
+
+
+def make_checker(spec, case, judge=None):
+    """
+    The checker for a prepared testcase. spec is Problem.checker_spec (None
+    for exact matching), judge the compiled special judge artifact.
+    """
+    name = spec['name'] if spec else EXACT
+    if name == TOKENS:
+        return TokenChecker(case['expected'])
+    if name == FLOAT:
+        return FloatChecker(case['expected'], spec['epsilon'])
+    if name == UNORDERED:
+        return UnorderedChecker(case['expected'])
+    if name == SPECIAL:
+        return SpecialChecker(judge, case['stdin'], _answer(case['output']))
+    return ExactChecker(case['expected'])
@@ -1,52 +1,93 @@
 import json
+from channels.db import database_sync_to_async
 from channels.generic.websocket import AsyncWebsocketConsumer
 
+
+def _join_chatspace(problem_id, chatspace_uuid):
+    """
+    The chatspace of a problem, created by its first visitor. None if the
+    uuid is malformed or belongs to another problem's chatspace.
+    """
+    from django.core.exceptions import ValidationError
+    from .models import Chatspace
+
+    try:
+        chatspace, _ = Chatspace.objects.get_or_create(
+            id=chatspace_uuid, defaults={'problem_id': problem_id}
+        )
+    except (ValidationError, ValueError):
+        return None
+    return chatspace if chatspace.problem_id == int(problem_id) else None
+
+
+def _chat_history(chatspace_id, before=None):
+    from .chat import chat_log
+
+    return chat_log.history(chatspace_id, before)
+
+
 class ProblemConsumer(AsyncWebsocketConsumer):
     async def connect(self):
+        # imported here, routing is loaded before Django is set up
+        from .presence import presence, room_name
+
         self.problem_id = self.scope['url_route']['kwargs']['problem_id']
         self.chatspace_uuid = self.scope['url_route']['kwargs']['chatspace_uuid']
-        self.room_group_name = f'problem_{self.problem_id}_{self.chatspace_uuid}'
+        self.room_group_name = room_name(self.problem_id, self.chatspace_uuid)
         self.user = self.scope['user']
 
         if not self.user.is_authenticated:
             await self.close()
             return 
-        
-        await self.accept()
+
+        self.chatspace = await database_sync_to_async(_join_chatspace)(
+            self.problem_id, self.chatspace_uuid
+        )
+        if self.chatspace is None:
+            await self.close()
+            return
 
         await self.channel_layer.group_add(
             self.room_group_name,
             self.channel_name
         )
-        
-        await self.channel_layer.group_send(
-            self.room_group_name,
-            {
-                'type': 'system_message',
-                'message': f"User '{self.user.username}' has joined."
-            }
-        )
+        await self.accept()
+
+        # the backlog in one frame, not a send per message
+        await self.send_history()
+
+        # the room hears about the join with the next presence snapshot
+        await presence.join(self.room_group_name, self.channel_name, self.user.username)
+        await self.send(text_data=json.dumps({
+            'type': 'presence',
+            **await presence.snapshot(self.room_group_name)
+        }))
+
+    async def send_history(self, before=None):
+        history = await database_sync_to_async(_chat_history)(self.chatspace.id, before)
+        await self.send(text_data=json.dumps({'type': 'history', **history}))
 
     async def disconnect(self, close_code):
-        await self.channel_layer.group_send(
-            self.room_group_name,
-            {
-                'type': 'system_message',
-                    'message': f"User '{self.user.username}' has left."
-                }
-        )
+        from .presence import presence
+
+        if getattr(self, 'chatspace', None) is None:
+            return
+        await presence.leave(self.room_group_name, self.channel_name)
         await self.channel_layer.group_discard(
             self.room_group_name,
             self.channel_name
         )
 
     async def receive(self, text_data):
+        from .chat import chat_log
+
         data = json.loads(text_data)
         message_type = data.get('type')
 
         if message_type == 'chat_message' and self.user.is_authenticated:
             message = data.get('message', '')
             if message:
+                chat_log.add(self.chatspace.id, self.user, message)
                 await self.channel_layer.group_send(
                     self.room_group_name,
                     {
@@ -55,6 +96,8 @@ class ProblemConsumer(AsyncWebsocketConsumer):
                         'username': self.user.username
                     }
                 )
+        elif message_type == 'history' and isinstance(data.get('before'), int):
+            await self.send_history(data['before'])
 
     async def chat_message(self, event):
         message = event['message']
@@ -65,9 +108,66 @@ class ProblemConsumer(AsyncWebsocketConsumer):
             'username': username
         }))
 
+    async def presence_snapshot(self, event):
+        await self.send(text_data=json.dumps({
+            'type': 'presence',
+            'count': event['count'],
+            'members': event['members']
+        }))
+
     async def system_message(self, event):
         message = event['message']
         await self.send(text_data=json.dumps({
             'type': 'system',
             'message': message
-        }))
\ No newline at end of file
+        }))
+
+class SubmissionConsumer(AsyncWebsocketConsumer):
+    """
+    Streams the judge's progress on one submission: 'compiling', 'running',
+    one 'case' event per testcase, 'done' with the verdict and, for a failed
+    submission, 'feedback' once the AI feedback is ready.
+    """
+    async def connect(self):
+        # imported here, routing is loaded before Django is set up
+        from .feedback import feedback_state
+        from .judge_queue import group_name
+        from .utils import submission_state
+
+        self.submission_id = self.scope['url_route']['kwargs']['submission_id']
+        self.group_name = group_name(self.submission_id)
+        self.user = self.scope['user']
+
+        if not self.user.is_authenticated:
+            await self.close()
+            return
+
+        # join before accepting: once the client is connected it may submit,
+        # and no event may be published before the group has this channel
+        await self.channel_layer.group_add(
+            self.group_name,
+            self.channel_name
+        )
+        await self.accept()
+
+        # the verdict (and feedback) may be in before the socket was opened
+        state = await database_sync_to_async(submission_state)(self.submission_id)
+        if state and state['state'] == 'done':
+            feedback = feedback_state(state['feedback_id']) if 'feedback_id' in state else None
+            if feedback and feedback['state'] == 'done':
+                del state['feedback_id']
+                state['ai_feedback'] = feedback['ai_feedback']
+            await self.send(text_data=json.dumps({'type': 'judge', 'stage': 'done', **state}))
+
+    async def disconnect(self, close_code):
+        if hasattr(self, 'group_name'):
+            await self.channel_layer.group_discard(
+                self.group_name,
+                self.channel_name
+            )
+
+    async def judge_progress(self, event):
+        await self.send(text_data=json.dumps({
+            'type': 'judge',
+            **event['event']
+        }))
@@ -0,0 +1,87 @@
+"""
+Buffered Problem.submissions counters.
+
+Counting a submission used to load the problem, add one in Python and save
+every column back: concurrent submits lost increments, and each one held
+SQLite's write lock while rewriting the problem (embedding included).
+Increments are now collected in memory and written every
+JUDGE_COUNTER_FLUSH_INTERVAL seconds as one database-side
+UPDATE ... SET submissions = submissions + n per problem, so a hot problem
+costs one short write per interval instead of one per submission.
+"""
+import atexit
+import threading
+from collections import Counter
+
+from django.conf import settings
+from django.db import DatabaseError, connections, transaction
+from django.db.models import F
+
+FLUSH_INTERVAL = getattr(settings, 'JUDGE_COUNTER_FLUSH_INTERVAL', 1.0)
+
+
+def _apply(increments):
+    from .models import Problem
+
+    with transaction.atomic():
+        for pid, count in increments.items():
+            Problem.objects.filter(id=pid).update(submissions=F('submissions') + count)
+
+
+class SubmissionCounter:
+    def __init__(self, interval):
+        self.interval = interval
+        self._pending = Counter()  # pid -> increments not written yet
+        self._lock = threading.Lock()
+        self._timer = None
+
+    def add(self, pid, count=1):
+        """
+        Count submissions of a problem. With an interval of 0 the increment
+        is written right away (still atomically).
+        """
+        if self.interval <= 0:
+            _apply({pid: count})
+            return
+        with self._lock:
+            self._pending[pid] += count
+            self._schedule()
+
+    def _schedule(self):
+        # called with the lock held
+        if self._timer is None:
+            self._timer = threading.Timer(self.interval, self._flush_in_background)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _flush_in_background(self):
+        try:
+            self.flush()
+        finally:
+            # the timer thread's own database connection
+            connections.close_all()
+
+    def flush(self):
+        """
+        Write the pending increments. If the database refuses, they are
+        kept and retried at the next interval.
+        """
+        with self._lock:
+            pending, self._pending = self._pending, Counter()
+            timer, self._timer = self._timer, None
+        if timer is not None:
+            timer.cancel()
+        if not pending:
+            return
+
+        try:
+            _apply(pending)
+        except DatabaseError:
+            with self._lock:
+                self._pending.update(pending)
+                self._schedule()
+            raise
+
+
+submission_counter = SubmissionCounter(FLUSH_INTERVAL)
+atexit.register(submission_counter.flush)
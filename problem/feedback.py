@@ -0,0 +1,136 @@
+"""
+AI feedback on failed runs and submissions, off the request path.
+
+A failed run answers right away with a feedback id; the AI is asked in a
+background thread (at most AI_FEEDBACK_CONCURRENCY calls at a time per
+process) and the client polls FeedbackView for the text. Feedback is
+cached per problem and normalized error signature, so the same mistake on
+the same problem is answered from the cache, and identical requests in
+flight share one call.
+"""
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+
+from .ai_request import AIError, aicall
+
+CONCURRENCY = getattr(settings, 'AI_FEEDBACK_CONCURRENCY', 4)
+CACHE_TIMEOUT = getattr(settings, 'AI_FEEDBACK_CACHE_TIMEOUT', 24 * 60 * 60)
+# feedback kept around for polling
+RETENTION = 1000
+
+_executor = ThreadPoolExecutor(max_workers=CONCURRENCY, thread_name_prefix='ai-feedback')
+_lock = threading.Lock()
+_futures = OrderedDict()  # feedback_id -> Future of the feedback text
+_inflight = {}  # cache key -> Future, while the AI is being asked
+
+# per-run noise in error messages: generated source paths, addresses
+_NOISE = [
+    (re.compile(r'\S*[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}\S*'), '<source>'),
+    (re.compile(r'0x[0-9a-f]+'), '<address>'),
+    (re.compile(r'\s+'), ' '),
+]
+
+
+def error_signature(cerror):
+    """
+    The part of an error message that identifies the mistake.
+    """
+    signature = cerror.lower()
+    for pattern, replacement in _NOISE:
+        signature = pattern.sub(replacement, signature)
+    return signature.strip()[:2000]
+
+
+def cache_key(pid, cerror):
+    digest = hashlib.sha256(error_signature(cerror).encode()).hexdigest()
+    return f'ai_feedback:{pid}:{digest}'
+
+
+def _generate(key, pid, code, cerror, status, action):
+    from .models import Problem
+
+    try:
+        problem = Problem.objects.get(id=pid)
+        payload = [
+            problem.title,
+            ', '.join(problem.tags_list),
+            problem.constraints or "",
+            code,
+            cerror,
+            status,
+        ]
+        try:
+            text = aicall(payload, action)
+        except AIError as e:
+            return str(e)
+        cache.set(key, text, CACHE_TIMEOUT)
+        return text
+    finally:
+        with _lock:
+            _inflight.pop(key, None)
+        # this thread's own database connection
+        connections.close_all()
+
+
+def request_feedback(pid, code, result, action):
+    """
+    Ask for AI feedback on a failed result of problem pid. Returns
+    {'ai_feedback': text} when it is cached, otherwise {'feedback_id': id}
+    to fetch it later with feedback_state.
+    """
+    key = cache_key(pid, result['cerror'])
+    text = cache.get(key)
+    if text is not None:
+        return {'ai_feedback': text}
+
+    feedback_id = uuid4().hex
+    with _lock:
+        future = _inflight.get(key)
+        if future is None:
+            future = _executor.submit(
+                _generate, key, pid, code, result['cerror'], result.get('status', ""), action
+            )
+            _inflight[key] = future
+        _futures[feedback_id] = future
+        while len(_futures) > RETENTION:
+            _futures.popitem(last=False)
+    return {'feedback_id': feedback_id}
+
+
+def feedback_state(feedback_id):
+    """
+    Returns:
+        None - unknown (or long forgotten) feedback id,
+        {'state': 'pending'} - the AI hasn't answered yet,
+        {'state': 'done', 'ai_feedback': text}.
+    """
+    with _lock:
+        future = _futures.get(feedback_id)
+    if future is None:
+        return None
+    if not future.done():
+        return {'state': 'pending'}
+    try:
+        text = future.result()
+    except Exception as e:
+        text = f"An error occurred while generating feedback. {e}"
+    return {'state': 'done', 'ai_feedback': text}
+
+
+def when_ready(feedback_id, callback):
+    """
+    Call callback(feedback_state) once the feedback is done (right away if
+    it already is).
+    """
+    with _lock:
+        future = _futures.get(feedback_id)
+    if future is not None:
+        future.add_done_callback(lambda _: callback(feedback_state(feedback_id)))
@@ -38,13 +38,18 @@ class ProblemForm(forms.ModelForm):
             'tags',
             'description',
             'difficulty',
-            'constraints'
+            'constraints',
+            'batch_testcases',
+            'checker',
+            'checker_epsilon',
+            'checker_code'
         ]
 
         widgets = {
             'tags': forms.TextInput(attrs={'placeholder': 'Comma-separated tags'}),
             'description': forms.Textarea(attrs={'rows': 5, 'placeholder': 'the array of size n is...'}),
-            'constraints': forms.Textarea(attrs={'rows': 3})
+            'constraints': forms.Textarea(attrs={'rows': 3}),
+            'checker_code': forms.Textarea(attrs={'rows': 10, 'placeholder': 'int main(int argc, char **argv) {...'})
         }
 
     def __init__(self, *args, **kwargs):
@@ -62,5 +67,17 @@ class ProblemForm(forms.ModelForm):
         self.fields['testcases'].widget.attrs.update({'class': 'form-control'})
 
         self.fields['constraints'].required = False
+        self.fields['batch_testcases'].label = 'Run all testcases in one process (python)'
+        self.fields['checker'].widget.attrs.update({'class': 'form-select'})
+        self.fields['checker_epsilon'].widget.attrs.update({'class': 'form-control'})
+        self.fields['checker_code'].widget.attrs.update({'class': 'form-control'})
+        self.fields['checker_code'].required = False
+        self.fields['checker_code'].label = 'Special judge (C++, argv: input output answer)'
+
+    def clean(self):
+        cleaned_data = super().clean()
+        if cleaned_data.get('checker') == 'special' and not (cleaned_data.get('checker_code') or '').strip():
+            self.add_error('checker_code', "A special judge needs its code.")
+        return cleaned_data
 
         
\ No newline at end of file
@@ -0,0 +1,264 @@
+"""
+Submission queue in front of the judge.
+
+`ProblemView` puts a submission on the queue and answers right away with a
+submission id; a pool of judge worker processes drains the queue and the
+client polls `SubmissionView` for the verdict, or follows the judge's
+progress on the `SubmissionConsumer` websocket.
+
+Workers send their progress events back over a multiprocessing queue; a
+relay thread in the web process publishes them to the channel group
+`submission_<id>`.
+
+The queue is a local broker stand-in: jobs and results live in the web
+process that accepted the submission, so polling has to reach that same
+process (single Daphne/WSGI process, or sticky routing).
+"""
+import logging
+import multiprocessing
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+from uuid import uuid4
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+
+JUDGE_WORKERS = getattr(settings, 'JUDGE_WORKERS', 2)
+JUDGE_RESULT_RETENTION = getattr(settings, 'JUDGE_RESULT_RETENTION', 1000)
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_progress = None  # queue of (submission_id, event) from the workers to the web process
+_lock = threading.Lock()
+_jobs = OrderedDict()  # submission_id -> Future (or result dict when run inline)
+_feedback_context = {}  # submission_id -> (pid, code), until AI feedback is requested
+_feedback = {}  # submission_id -> AI feedback of a failed submission, see feedback.py
+
+
+def _init_worker(progress):
+    """
+    Judge workers are spawned, not forked, so each one sets Django up itself
+    instead of inheriting the web process' database connections.
+    """
+    import django
+
+    global _progress
+    _progress = progress
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "code_judge.settings")
+    django.setup()
+
+
+def _get_executor():
+    global _executor, _progress
+    with _lock:
+        if _executor is None:
+            context = multiprocessing.get_context('spawn')
+            _progress = context.Queue()
+            threading.Thread(target=_relay_progress, args=(_progress,), daemon=True).start()
+            _executor = ProcessPoolExecutor(
+                max_workers=JUDGE_WORKERS,
+                mp_context=context,
+                initializer=_init_worker,
+                initargs=(_progress,),
+            )
+        return _executor
+
+
+def _drop_executor(executor):
+    """
+    Forget a broken executor (one of its workers died, e.g. OOM-killed),
+    the next _get_executor() starts a new one.
+    """
+    global _executor, _progress
+    with _lock:
+        if _executor is not executor:
+            return  # already replaced by another request
+        _executor = None
+        progress, _progress = _progress, None
+    executor.shutdown(wait=False, cancel_futures=True)
+    if progress is not None:
+        progress.put(None)  # ends its relay thread
+
+
+def _submit(*args):
+    executor = _get_executor()
+    try:
+        return executor.submit(judge, *args)
+    except BrokenProcessPool:
+        logger.warning("Judge worker pool broken, starting a new one")
+        _drop_executor(executor)
+        return _get_executor().submit(judge, *args)
+
+
+def group_name(submission_id):
+    return f'submission_{submission_id}'
+
+
+def _publish(submission_id, event):
+    channel_layer = get_channel_layer()
+    if channel_layer is not None:
+        async_to_sync(channel_layer.group_send)(
+            group_name(submission_id), {'type': 'judge.progress', 'event': event}
+        )
+
+
+def _on_progress(submission_id, event):
+    """
+    Publish a progress event of a submission (in the web process). A failed
+    verdict gets its AI feedback requested, which follows as a 'feedback'
+    event once generated.
+    """
+    from .feedback import when_ready
+
+    if event['stage'] == 'done':
+        feedback = _submission_feedback(submission_id, event)
+        event = {**event, **feedback}
+        if 'feedback_id' in feedback:
+            when_ready(feedback['feedback_id'], lambda state: _publish(
+                submission_id, {'stage': 'feedback', 'ai_feedback': state and state['ai_feedback']}
+            ))
+    _publish(submission_id, event)
+
+
+def _relay_progress(progress):
+    while True:
+        item = progress.get()
+        if item is None:
+            return
+        submission_id, event = item
+        try:
+            _on_progress(submission_id, event)
+        except Exception:
+            # a lost progress event must not stop the relay, polling still works
+            logger.exception("Progress event %s of submission %s not relayed", event.get('stage'), submission_id)
+
+
+def _report(submission_id, event):
+    """
+    Progress reporter of a submission being judged: from a worker the
+    event goes to the web process, inline it is published right away.
+    """
+    if _progress is not None:
+        _progress.put((submission_id, event))
+    else:
+        _on_progress(submission_id, event)
+
+
+def judge(submission_id, user_id, code, language, testcases, pid, time_limit, memory_limit, batch,
+          checker):
+    """
+    Runs inside a judge worker: evaluate the submission and record it.
+    The verdict is reported even if it can't be recorded.
+    """
+    from .utils import record_submission
+    from .validate import evaluate_submission
+
+    result = evaluate_submission(
+        code, language, testcases, pid, time_limit, memory_limit, batch, checker,
+        on_progress=partial(_report, submission_id),
+    )
+    try:
+        record_submission(submission_id, user_id, pid, language, result)
+    except Exception:
+        logger.exception("Submission %s not recorded", submission_id)
+    _report(submission_id, {'stage': 'done', **result})
+    return result
+
+
+def _forget_old_jobs():
+    """
+    Drop the oldest finished jobs once more than JUDGE_RESULT_RETENTION are kept.
+    """
+    excess = len(_jobs) - JUDGE_RESULT_RETENTION
+    if excess <= 0:
+        return
+    for submission_id in list(_jobs):
+        if excess <= 0:
+            break
+        job = _jobs[submission_id]
+        if isinstance(job, dict) or job.done():
+            del _jobs[submission_id]
+            _feedback_context.pop(submission_id, None)
+            _feedback.pop(submission_id, None)
+            excess -= 1
+
+
+def enqueue(code, language, testcases, pid, time_limit=1.0, memory_limit=256, batch=False,
+            checker=None, user_id=None):
+    """
+    Queue a submission for judging and return its submission id, which is
+    also the id of its Submission record once judged.
+    With JUDGE_WORKERS = 0 the submission is judged inline instead.
+    """
+    submission_id = uuid4().hex
+    args = (
+        submission_id, user_id, code, language, testcases, pid,
+        time_limit, memory_limit, batch, checker,
+    )
+
+    with _lock:
+        _feedback_context[submission_id] = (pid, code)
+
+    if JUDGE_WORKERS <= 0:
+        job = judge(*args)
+    else:
+        job = _submit(*args)
+
+    with _lock:
+        _jobs[submission_id] = job
+        _forget_old_jobs()
+    return submission_id
+
+
+def poll(submission_id):
+    """
+    Returns the state of a queued submission:
+        None - unknown (or long forgotten) submission id,
+        {'state': 'queued' | 'running'} - not judged yet,
+        {'state': 'done', ...result} - verdict is available, with the AI
+        feedback (or its feedback_id) if the submission failed.
+    """
+    with _lock:
+        job = _jobs.get(submission_id)
+
+    if job is None:
+        return None
+    if isinstance(job, dict):
+        return {'state': 'done', **job, **_submission_feedback(submission_id, job)}
+    if not job.done():
+        return {'state': 'running' if job.running() else 'queued'}
+
+    try:
+        result = job.result()
+    except Exception as e:
+        return {
+            'state': 'done',
+            'status': "Judge error, please resubmit.",
+            'cerror': f"The judge failed to evaluate this submission. {e}"
+        }
+    return {'state': 'done', **result, **_submission_feedback(submission_id, result)}
+
+
+def _submission_feedback(submission_id, result):
+    """
+    AI feedback on a failed submission. It is requested the first time the
+    verdict is polled, so the judge workers never wait on the AI.
+    """
+    from .feedback import request_feedback
+
+    if not result.get("cerror"):
+        return {}
+    with _lock:
+        if submission_id not in _feedback:
+            context = _feedback_context.pop(submission_id, None)
+            if context is None:
+                return {}
+            pid, code = context
+            _feedback[submission_id] = request_feedback(pid, code, result, 'submit')
+        return _feedback[submission_id]
@@ -0,0 +1,121 @@
+import asyncio
+import multiprocessing
+import os
+import statistics
+import time
+from uuid import uuid4
+
+from channels.layers import get_channel_layer
+from django.core.management.base import BaseCommand
+
+
+async def _join(layer, group, members):
+    channels = [await layer.new_channel() for _ in range(members)]
+    for channel in channels:
+        await layer.group_add(group, channel)
+    return channels
+
+
+async def _drain(layer, channels, messages):
+    """
+    Receive messages on every channel; returns the delivery latencies (s).
+    """
+    async def drain(channel):
+        latencies = []
+        for _ in range(messages):
+            message = await layer.receive(channel)
+            latencies.append(time.time() - message['sent'])
+        return latencies
+
+    per_channel = await asyncio.gather(*map(drain, channels))
+    return [latency for latencies in per_channel for latency in latencies]
+
+
+async def _send(layer, group, messages, interval):
+    started = time.perf_counter()
+    for _ in range(messages):
+        await layer.group_send(group, {'type': 'bench', 'sent': time.time()})
+        await asyncio.sleep(interval)
+    return (time.perf_counter() - started - messages * interval) / messages
+
+
+def _receiver(group, members, messages, ready, results):
+    """
+    A receiver process: members channels of group, like the websockets of
+    one Daphne process.
+    """
+    import django
+
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "code_judge.settings")
+    django.setup()
+    layer = get_channel_layer()
+
+    async def run():
+        channels = await _join(layer, group, members)
+        ready.put(members)
+        return await _drain(layer, channels, messages)
+
+    results.put(asyncio.run(run()))
+
+
+class Command(BaseCommand):
+    help = ('Measures channel layer fan-out: latency from group_send until every member '
+            'has received the message, for growing group sizes.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='1,10,100,500',
+                            help='comma separated group sizes')
+        parser.add_argument('--processes', type=int, default=4,
+                            help='receiver processes the members are spread over '
+                                 '(0: receive in this process)')
+        parser.add_argument('--messages', type=int, default=20,
+                            help='messages sent to each group')
+        parser.add_argument('--interval', type=float, default=0.01,
+                            help='pause between messages (s)')
+
+    def handle(self, *args, **options):
+        layer = get_channel_layer()
+        self.stdout.write(f"{type(layer).__name__}, {options['processes']} receiver processes, "
+                          f"{options['messages']} messages per group")
+        self.stdout.write(f"{'members':>8} {'p50 ms':>8} {'p95 ms':>8} {'max ms':>8} {'send ms':>8}")
+        for size in map(int, options['sizes'].split(',')):
+            group = f'bench_{uuid4().hex}'
+            if options['processes'] > 0:
+                latencies, send_time = self._across_processes(layer, group, size, options)
+            else:
+                latencies, send_time = asyncio.run(self._in_process(layer, group, size, options))
+            latencies.sort()
+            self.stdout.write(
+                f"{size:>8} {statistics.median(latencies) * 1000:>8.2f} "
+                f"{latencies[int(len(latencies) * 0.95) - 1] * 1000:>8.2f} "
+                f"{latencies[-1] * 1000:>8.2f} {send_time * 1000:>8.2f}"
+            )
+
+    async def _in_process(self, layer, group, size, options):
+        channels = await _join(layer, group, size)
+        drained = asyncio.ensure_future(_drain(layer, channels, options['messages']))
+        send_time = await _send(layer, group, options['messages'], options['interval'])
+        return await drained, send_time
+
+    def _across_processes(self, layer, group, size, options):
+        context = multiprocessing.get_context('spawn')
+        ready, results = context.Queue(), context.Queue()
+        processes = options['processes']
+        shares = [size // processes + (i < size % processes) for i in range(processes)]
+        receivers = [
+            context.Process(target=_receiver,
+                            args=(group, members, options['messages'], ready, results))
+            for members in shares if members
+        ]
+        for receiver in receivers:
+            receiver.start()
+        for _ in receivers:
+            ready.get(timeout=60)
+
+        send_time = asyncio.run(_send(layer, group, options['messages'], options['interval']))
+        latencies = []
+        for _ in receivers:
+            latencies += results.get(timeout=60)
+        for receiver in receivers:
+            receiver.join()
+        return latencies, send_time
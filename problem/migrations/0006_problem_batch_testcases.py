@@ -0,0 +1,42 @@
+# Generated by Django 5.2.4 on 2026-10-18 15:49
+
+import django.db.models.deletion
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("problem", "0005_problem_embedding_alter_problem_creator"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="problem",
+            name="batch_testcases",
+            field=models.BooleanField(default=False),
+        ),
+        migrations.CreateModel(
+            name="Chatspace",
+            fields=[
+                (
+                    "id",
+                    models.UUIDField(
+                        default=uuid.uuid4,
+                        editable=False,
+                        primary_key=True,
+                        serialize=False,
+                    ),
+                ),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                (
+                    "problem",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="problem.problem",
+                    ),
+                ),
+            ],
+        ),
+    ]
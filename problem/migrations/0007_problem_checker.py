@@ -0,0 +1,38 @@
+# Generated by Django 5.2.4 on 2026-10-18 15:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("problem", "0006_problem_batch_testcases"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="problem",
+            name="checker",
+            field=models.CharField(
+                choices=[
+                    ("exact", "Exact match"),
+                    ("tokens", "Tokens, any whitespace"),
+                    ("float", "Tokens, numbers within epsilon"),
+                    ("unordered", "Tokens in any order"),
+                    ("special", "Special judge (C++)"),
+                ],
+                default="exact",
+                max_length=10,
+            ),
+        ),
+        migrations.AddField(
+            model_name="problem",
+            name="checker_code",
+            field=models.TextField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="problem",
+            name="checker_epsilon",
+            field=models.FloatField(blank=True, default=1e-06),
+        ),
+    ]
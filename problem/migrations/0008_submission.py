@@ -0,0 +1,101 @@
+# Generated by Django 5.2.4 on 2026-10-18 15:57
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("problem", "0007_problem_checker"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="Submission",
+            fields=[
+                (
+                    "id",
+                    models.CharField(
+                        editable=False, max_length=32, primary_key=True, serialize=False
+                    ),
+                ),
+                ("language", models.CharField(max_length=10)),
+                ("verdict", models.CharField(max_length=10)),
+                ("status", models.TextField(blank=True)),
+                ("compile_time", models.FloatField(default=0.0)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                (
+                    "problem",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="problem.problem",
+                    ),
+                ),
+                (
+                    "user",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+        ),
+        migrations.CreateModel(
+            name="TestcaseResult",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("index", models.PositiveIntegerField()),
+                ("verdict", models.CharField(max_length=10)),
+                ("time", models.FloatField()),
+                ("memory", models.IntegerField()),
+                (
+                    "submission",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="testcase_results",
+                        to="problem.submission",
+                    ),
+                ),
+            ],
+            options={
+                "ordering": ["index"],
+            },
+        ),
+        migrations.AddIndex(
+            model_name="submission",
+            index=models.Index(
+                fields=["user", "-created_at"], name="problem_sub_user_id_9a6d16_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="submission",
+            index=models.Index(
+                fields=["problem", "-created_at"], name="problem_sub_problem_739c7d_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="submission",
+            index=models.Index(
+                fields=["-created_at"], name="problem_sub_created_eb28e6_idx"
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="testcaseresult",
+            constraint=models.UniqueConstraint(
+                fields=("submission", "index"), name="unique_testcase_result"
+            ),
+        ),
+    ]
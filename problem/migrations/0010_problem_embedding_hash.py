@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-18 16:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("problem", "0009_chatmessage"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="problem",
+            name="embedding_hash",
+            field=models.CharField(blank=True, default="", max_length=64),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-18 17:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("problem", "0010_problem_embedding_hash"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="problem",
+            name="checker_epsilon",
+            field=models.FloatField(default=1e-06),
+        ),
+    ]
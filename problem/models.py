@@ -1,7 +1,17 @@
+from django.conf import settings
 from django.db import models
+from django.utils import timezone
 from uuid import uuid4
 
 # Create your models here.
+CHECKERS = [
+    ('exact', 'Exact match'),
+    ('tokens', 'Tokens, any whitespace'),
+    ('float', 'Tokens, numbers within epsilon'),
+    ('unordered', 'Tokens in any order'),
+    ('special', 'Special judge (C++)'),
+]
+
 class Tag(models.Model):
     name = models.CharField(max_length=50, unique=True)
 
@@ -28,16 +38,83 @@ class Problem(models.Model):
 
     time_limit = models.FloatField(default=1.0, blank=True)  # In seconds
     memory_limit = models.IntegerField(default=256, blank=True)  # In MB
+    # harness mode: one process runs every testcase (python submissions)
+    batch_testcases = models.BooleanField(default=False)
+
+    # how outputs are compared, see problem/checkers.py
+    checker = models.CharField(max_length=10, choices=CHECKERS, default='exact')
+    checker_epsilon = models.FloatField(default=1e-6)
+    # C++ source of the special judge: judge <input> <output> <answer>, exit 0 = accepted
+    checker_code = models.TextField(blank=True, null=True)
     
     embedding = models.BinaryField(null=True, blank=True)
+    # hash of the text the embedding was made from, see recommender/embeddings.py
+    embedding_hash = models.CharField(max_length=64, blank=True, default='')
     @property
     def tags_list(self) -> list[str]:
         return [tag.name for tag in self.tags.all()]
 
+    @property
+    def checker_spec(self) -> dict:
+        return {
+            'name': self.checker,
+            'epsilon': self.checker_epsilon,
+            'code': self.checker_code,
+        }
+
     def __str__(self):
         return self.title
 
 class Chatspace(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid4, editable=False)
     problem = models.ForeignKey(Problem, on_delete=models.CASCADE)
-    created_at = models.DateTimeField(auto_now_add=True)
\ No newline at end of file
+    created_at = models.DateTimeField(auto_now_add=True)
+
+class ChatMessage(models.Model):
+    chatspace = models.ForeignKey(Chatspace, on_delete=models.CASCADE, related_name='messages')
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True)
+    username = models.CharField(max_length=150)
+    message = models.TextField()
+    # when it was sent; messages are written in batches, later (see chat.py)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['chatspace', '-id']),
+        ]
+
+class Submission(models.Model):
+    # the judge queue's submission id
+    id = models.CharField(primary_key=True, max_length=32, editable=False)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True)
+    problem = models.ForeignKey(Problem, on_delete=models.CASCADE)
+
+    language = models.CharField(max_length=10)
+    verdict = models.CharField(max_length=10)  # AC, WA, CE, TLE, ...
+    status = models.TextField(blank=True)
+    compile_time = models.FloatField(default=0.0)  # In seconds
+
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', '-created_at']),
+            models.Index(fields=['problem', '-created_at']),
+            models.Index(fields=['-created_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.id} {self.verdict}"
+
+class TestcaseResult(models.Model):
+    submission = models.ForeignKey(Submission, on_delete=models.CASCADE, related_name='testcase_results')
+    index = models.PositiveIntegerField()  # 0-based, in testcase file order
+    verdict = models.CharField(max_length=10)
+    time = models.FloatField()  # CPU time, in seconds
+    memory = models.IntegerField()  # Peak, in KB
+
+    class Meta:
+        ordering = ['index']
+        constraints = [
+            models.UniqueConstraint(fields=['submission', 'index'], name='unique_testcase_result'),
+        ]
@@ -0,0 +1,131 @@
+"""
+Who is connected to each chatspace.
+
+Every join and leave used to be broadcast to the whole room, so N members
+reconnecting cost O(N^2) messages. Presence changes are now collected per
+room and published every CHAT_PRESENCE_INTERVAL seconds as one snapshot
+(member count and names), and only if the room changed: a client that
+drops and reconnects within the interval causes no traffic at all.
+
+The members are kept by the channel layer's presence extension (see
+code_judge/channel_layer.py), shared by all ASGI processes, so a snapshot
+covers the room's sockets in every process. Each process publishes the
+rooms it saw change; the layer hands a change to one of them only, so a
+room gets one snapshot per change however many processes serve it.
+
+The layer forgets a member presence_expiry seconds after it was last
+refreshed. Every process refreshes its own sockets' members a few times
+per presence_expiry (the heartbeat) and then checks their rooms, so when
+a process dies its members expire and the rooms still served elsewhere
+get a snapshot without them.
+"""
+import threading
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+
+PRESENCE_INTERVAL = getattr(settings, 'CHAT_PRESENCE_INTERVAL', 1.0)
+# names listed in a snapshot; larger rooms only report the rest as a count
+MEMBERS_SHOWN = 100
+
+
+def room_name(problem_id, chatspace_id):
+    """
+    The channel group of a chatspace, also its key here.
+    """
+    return f'problem_{problem_id}_{chatspace_id}'
+
+
+def _snapshot(members):
+    return {'count': len(members), 'members': members[:MEMBERS_SHOWN]}
+
+
+class Presence:
+    def __init__(self, interval):
+        self.interval = interval
+        self._changed = set()  # rooms with joins or leaves in this process since the last flush
+        self._members = set()  # (room, channel) of this process' sockets
+        self._lock = threading.Lock()
+        self._timer = None
+        self._heartbeat = None
+
+    async def join(self, room, channel, username):
+        await get_channel_layer().presence_join(room, channel, username)
+        with self._lock:
+            self._members.add((room, channel))
+            self._schedule_heartbeat()
+        self._mark(room)
+
+    async def leave(self, room, channel):
+        with self._lock:
+            self._members.discard((room, channel))
+        await get_channel_layer().presence_leave(room, channel)
+        self._mark(room)
+
+    async def snapshot(self, room):
+        return _snapshot(await get_channel_layer().presence_members(room))
+
+    def _mark(self, room):
+        with self._lock:
+            self._changed.add(room)
+            if self._timer is None:
+                self._timer = threading.Timer(self.interval, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def _schedule_heartbeat(self):
+        # called with the lock held
+        if self._heartbeat is None:
+            self._heartbeat = threading.Timer(get_channel_layer().presence_expiry / 3, self.heartbeat)
+            self._heartbeat.daemon = True
+            self._heartbeat.start()
+
+    def heartbeat(self):
+        """
+        Refresh this process' members, and publish their rooms if members
+        changed meanwhile (e.g. those of a dead process expired).
+        """
+        with self._lock:
+            self._heartbeat = None
+            members = list(self._members)
+            if members:
+                self._schedule_heartbeat()
+        if not members:
+            return
+        async_to_sync(get_channel_layer().presence_refresh)(members)
+        with self._lock:
+            self._changed.update(room for room, _ in members)
+        self.flush()
+
+    def stop(self):
+        """
+        Stop the heartbeat, and publish what changed.
+        """
+        with self._lock:
+            self._members.clear()
+            heartbeat, self._heartbeat = self._heartbeat, None
+        if heartbeat is not None:
+            heartbeat.cancel()
+        self.flush()
+
+    def flush(self):
+        """
+        Publish a snapshot of every room whose members changed.
+        """
+        with self._lock:
+            changed, self._changed = self._changed, set()
+            timer, self._timer = self._timer, None
+        if timer is not None:
+            timer.cancel()
+
+        channel_layer = get_channel_layer()
+        for room in changed:
+            members = async_to_sync(channel_layer.presence_publish)(room)
+            if members is not None:
+                async_to_sync(channel_layer.group_send)(room, {
+                    'type': 'presence_snapshot', **_snapshot(members)
+                })
+
+
+presence = Presence(PRESENCE_INTERVAL)
@@ -3,4 +3,5 @@ from . import consumer
 
 ws_urlpatterns = [
     re_path(r'ws/problem/(?P<problem_id>\d+)/(?P<chatspace_uuid>[^/]+)/$', consumer.ProblemConsumer.as_asgi()),
+    re_path(r'ws/submission/(?P<submission_id>[0-9a-f]+)/$', consumer.SubmissionConsumer.as_asgi()),
 ]
\ No newline at end of file
@@ -0,0 +1,105 @@
+"""
+Process-wide cache of parsed testcases.
+
+Each testcases/<pid>.json is parsed once and its testcases are prepared
+(serialized stdin, normalized expected output) once. An entry is reloaded
+when the file's mtime or size changes, or dropped explicitly with
+invalidate() when a problem is saved. The least recently used problems are
+evicted once the cache holds more than its byte budget.
+"""
+import json
+import os
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+
+from .validate import prepare_testcase
+
+MAX_BYTES = getattr(settings, 'JUDGE_TESTCASE_CACHE_BYTES', 64 * 1024 * 1024)
+
+
+def testcase_path(pid):
+    return os.path.join(settings.BASE_DIR, 'testcases', f'{pid}.json')
+
+
+def _prepare(testcase):
+    """
+    Malformed testcases are kept as they are, evaluate_submission reports
+    them when it reaches them.
+    """
+    try:
+        return prepare_testcase(testcase)
+    except (KeyError, TypeError, AttributeError):
+        return testcase
+
+
+def _footprint(raw, testcases):
+    """
+    Rough memory footprint of an entry: the JSON text plus what was
+    precomputed from it.
+    """
+    return len(raw) + sum(
+        len(case['stdin']) + len(case['expected']) for case in testcases if 'stdin' in case
+    )
+
+
+class TestcaseStore:
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # pid -> (mtime_ns, size, testcases, footprint)
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, pid):
+        """
+        Prepared testcases of a problem: (testcases, None) or (None, error).
+        """
+        try:
+            stat = os.stat(testcase_path(pid))
+        except FileNotFoundError:
+            self.invalidate(pid)
+            return None, f"{pid}; Test cases not found for this problem."
+
+        with self._lock:
+            entry = self._entries.get(pid)
+            if entry and entry[:2] == (stat.st_mtime_ns, stat.st_size):
+                self._entries.move_to_end(pid)
+                return entry[2], None
+
+        return self._load(pid, stat)
+
+    def _load(self, pid, stat):
+        try:
+            with open(testcase_path(pid), 'r') as f:
+                raw = f.read()
+            testcases = [_prepare(testcase) for testcase in json.loads(raw)]
+        except FileNotFoundError:
+            return None, f"{pid}; Test cases not found for this problem."
+        except (json.JSONDecodeError, TypeError):
+            return None, f"{pid}; Invalid test case format."
+
+        footprint = _footprint(raw, testcases)
+        with self._lock:
+            self._drop(pid)
+            if footprint <= self.max_bytes:
+                self._entries[pid] = (stat.st_mtime_ns, stat.st_size, testcases, footprint)
+                self._bytes += footprint
+                while self._bytes > self.max_bytes:
+                    self._drop(next(iter(self._entries)))
+        return testcases, None
+
+    def _drop(self, pid):
+        entry = self._entries.pop(pid, None)
+        if entry:
+            self._bytes -= entry[3]
+
+    def invalidate(self, pid):
+        """
+        Forget a problem's testcases, e.g. after its file was rewritten.
+        """
+        with self._lock:
+            self._drop(pid)
+
+
+testcase_store = TestcaseStore(MAX_BYTES)
@@ -1,3 +1,744 @@
-from django.test import TestCase
+import asyncio
+import json
+import os
+import tempfile
+import time
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+import faiss
+import numpy as np
+from asgiref.sync import async_to_sync, sync_to_async
+from channels.exceptions import ChannelFull
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import DatabaseError, connection
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+
+from accounts.models import UserProfile
+
+from code_judge.channel_layer import SQLiteChannelLayer
+from compiler import views as compiler_views
+from compiler.cache import CompileCache
+from compiler.views import CE
+from problem import ai_request, feedback, judge_queue, validate
+from problem.chat import ChatLog
+from problem.checkers import ExactChecker, FloatChecker, TokenChecker, UnorderedChecker
+from problem.counters import SubmissionCounter
+from problem.forms import ProblemForm
+from problem.models import ChatMessage, Chatspace, Problem, Submission
+from problem.presence import Presence
+from problem.routing import ws_urlpatterns
+from problem.testcase_store import TestcaseStore
+from problem.validate import AC, evaluate_submission
+from problem_bank import recommendation_cache
+from recommender.state import RecommenderState
+
+
+def use_temporary_channel_layer(test):
+    """
+    Point the channel layer at a file in a temporary directory for the
+    duration of test, instead of the project's channels.sqlite3.
+    """
+    directory = tempfile.TemporaryDirectory()
+    test.addCleanup(directory.cleanup)
+    override = override_settings(CHANNEL_LAYERS={
+        'default': {
+            'BACKEND': 'code_judge.channel_layer.SQLiteChannelLayer',
+            'CONFIG': {'path': os.path.join(directory.name, 'channels.sqlite3'), 'poll_interval': 0.01},
+        },
+    })
+    override.enable()
+    test.addCleanup(override.disable)
+
+
+class JudgeQueueTestCase(TestCase):
+    # the AI feedback of failed submissions is cached
+    databases = {'default', 'cache'}
+
+    def setUp(self):
+        use_temporary_channel_layer(self)
+        self.testcases = [{"input": {"a": 1, "b": 2}, "output": 3}]
+        self.user = User.objects.create_user(username="judge", password="judge")
+        self.problem = Problem.objects.create(
+            title="A + B", description="Add a and b", difficulty="Easy", creator=self.user
+        )
+
+    @mock.patch.object(judge_queue, 'JUDGE_WORKERS', 0)
+    def test_inline_submission_is_done_on_poll(self):
+        code = "a = int(input())\nb = int(input())\nprint(a + b)"
+        submission_id = judge_queue.enqueue(code, 'py', self.testcases, self.problem.id)
+
+        result = judge_queue.poll(submission_id)
+        self.assertEqual(result['state'], 'done')
+        self.assertEqual(result['status'], "Accepted!")
+
+    @mock.patch.object(judge_queue, 'JUDGE_WORKERS', 0)
+    def test_judged_submission_is_recorded(self):
+        code = "a = int(input())\nb = int(input())\nprint(a + b)"
+        testcases = self.testcases + [{"input": {"a": 2, "b": 2}, "output": 5}]
+
+        failed = judge_queue.enqueue(code, 'py', testcases, self.problem.id, user_id=self.user.id)
+        submission = Submission.objects.get(id=failed)
+        self.assertEqual(submission.verdict, validate.WA)
+        self.assertEqual(
+            [(r.index, r.verdict) for r in submission.testcase_results.all()],
+            [(0, AC), (1, validate.WA)],
+        )
+        self.assertGreater(submission.testcase_results.first().memory, 0)
+        self.assertFalse(UserProfile.objects.filter(user=self.user).exists())
+
+        judge_queue.enqueue(code, 'py', self.testcases, self.problem.id, user_id=self.user.id)
+        profile = UserProfile.objects.get(user=self.user)
+        self.assertEqual(profile.last_5_solved_pids, [self.problem.id])
+
+    @mock.patch.object(judge_queue, 'JUDGE_WORKERS', 0)
+    def test_recent_solves_are_last(self):
+        code = "a = int(input())\nb = int(input())\nprint(a + b)"
+        problems = [self.problem] + [
+            Problem.objects.create(title=f"A + B {i}", difficulty="Easy", creator=self.user) for i in range(2)
+        ]
+        for problem in problems:
+            judge_queue.enqueue(code, 'py', self.testcases, problem.id, user_id=self.user.id)
+        profile = UserProfile.objects.get(user=self.user)
+        self.assertEqual(profile.last_5_solved_pids, [p.id for p in problems])
+
+        # the recommender's query is made of the two most recent
+        state = RecommenderState(
+            faiss.IndexIDMap2(faiss.IndexFlatL2(4)), np.array([p.id for p in problems]),
+            np.eye(3, 4, dtype=np.float32), np.array(["easy"] * 3), [[], [], []],
+        )
+        with mock.patch.object(recommendation_cache, 'rerank_recommendations', return_value=[]) as rerank:
+            recommendation_cache.recommend_ids(profile, state, "easy")
+        self.assertEqual(rerank.call_args.kwargs['last_solved_indices'][-2:], [1, 2])
+
+    @mock.patch.object(judge_queue, 'JUDGE_WORKERS', 0)
+    def test_malformed_testcase_is_a_judge_error(self):
+        code = "a = int(input())\nb = int(input())\nprint(a + b)"
+        testcases = self.testcases + [{"input": {"a": 2, "b": 2}}]
+
+        submission_id = judge_queue.enqueue(code, 'py', testcases, self.problem.id, user_id=self.user.id)
+        self.assertEqual(judge_queue.poll(submission_id)['state'], 'done')
+        submission = Submission.objects.get(id=submission_id)
+        self.assertEqual(submission.verdict, validate.JE)
+        self.assertIn("Invalid test case format", submission.status)
+
+    @mock.patch.object(judge_queue, 'JUDGE_WORKERS', 0)
+    def test_verdict_reported_when_it_cant_be_recorded(self):
+        code = "a = int(input())\nb = int(input())\nprint(a + b)"
+        with mock.patch('problem.utils.record_submission', side_effect=DatabaseError("locked")), \
+                self.assertLogs('problem.judge_queue', 'ERROR'):
+            submission_id = judge_queue.enqueue(code, 'py', self.testcases, self.problem.id)
+        self.assertEqual(judge_queue.poll(submission_id)['status'], "Accepted!")
+
+    def test_broken_worker_pool_is_replaced(self):
+        broken = mock.Mock()
+        broken.submit.side_effect = BrokenProcessPool("a worker died")
+        with mock.patch.object(judge_queue, '_executor', broken), \
+                mock.patch.object(judge_queue, '_progress', None), \
+                mock.patch.object(judge_queue, 'ProcessPoolExecutor') as pool, \
+                self.assertLogs('problem.judge_queue', 'WARNING'):
+            judge_queue.enqueue("print(3)", 'py', self.testcases, self.problem.id)
+            self.assertIs(judge_queue._executor, pool.return_value)
+        broken.shutdown.assert_called_once()
+        pool.return_value.submit.assert_called_once()
+
+    def test_unknown_submission(self):
+        self.assertIsNone(judge_queue.poll("does-not-exist"))
+
+
+class EvaluateSubmissionTestCase(TestCase):
+    def setUp(self):
+        self.testcases = [
+            {"input": {"a": a, "b": b}, "output": a + b} for a, b in [(1, 2), (5, 7), (10, 20)]
+        ]
+        self.code = "#include <iostream>\nint main() { int a, b; std::cin >> a >> b; std::cout << a + b; }"
+
+    def test_compiles_once_for_all_testcases(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        cache = CompileCache(Path(tmp.name), max_bytes=1024 * 1024)
+
+        with mock.patch.object(compiler_views, 'compile_cache', cache), \
+                mock.patch.object(compiler_views, '_compile', wraps=compiler_views._compile) as compile_mock:
+            result = evaluate_submission(self.code, 'cpp', self.testcases, 1)
+
+        self.assertEqual(result['verdict'], AC)
+        self.assertEqual(compile_mock.call_count, 1)
+        self.assertEqual(len(result['run_times']), len(self.testcases))
+        self.assertGreater(result['compile_time'], 0)
+
+    def test_compile_error(self):
+        result = evaluate_submission("int main( {", 'cpp', self.testcases, 1)
+        self.assertEqual(result['verdict'], CE)
+        self.assertEqual(result['run_times'], [])
+
+    @mock.patch.object(validate, 'PARALLEL_CASES', 4)
+    def test_parallel_reports_first_failing_testcase(self):
+        testcases = [
+            {"input": {"a": a, "b": b}, "output": out}
+            for a, b, out in [(1, 2, 3), (5, 7, 0), (10, 20, 30), (3, 3, 0), (4, 4, 8)]
+        ]
+        result = evaluate_submission(self.code, 'cpp', testcases, 1)
+
+        self.assertEqual(result['verdict'], validate.WA)
+        self.assertIn("Testcase 2 failed", result['status'])
+        self.assertEqual(len(result['run_times']), 2)
+
+    @mock.patch.object(validate, 'PARALLEL_CASES', 4)
+    def test_parallel_accepts(self):
+        result = evaluate_submission(self.code, 'cpp', self.testcases, 1)
+        self.assertEqual(result['verdict'], AC)
+        self.assertEqual(len(result['run_times']), len(self.testcases))
+
+
+class BatchEvaluationTestCase(TestCase):
+    def setUp(self):
+        self.testcases = [
+            {"input": {"s": s}, "output": s[::-1]} for s in ["judge", "harness", "mode"]
+        ]
+
+    def test_one_process_runs_every_testcase(self):
+        code = "print(input()[::-1])"
+        with mock.patch.object(validate, 'run_artifact') as run_artifact:
+            result = evaluate_submission(code, 'py', self.testcases, 1, batch=True)
+
+        self.assertEqual(result['verdict'], AC)
+        self.assertEqual(len(result['run_times']), len(self.testcases))
+        run_artifact.assert_not_called()
+
+    def test_failing_testcase_is_located(self):
+        code = "s = input()\nif s == 'harness':\n    raise ValueError(s)\nprint(s[::-1])"
+        result = evaluate_submission(code, 'py', self.testcases, 1, batch=True)
+
+        self.assertEqual(result['verdict'], 'RE')
+        self.assertIn("Error in testcase 2", result['status'])
+
+    def test_testcase_past_its_time_limit(self):
+        code = "s = input()\nwhile s == 'mode':\n    pass\nprint(s[::-1])"
+        result = evaluate_submission(code, 'py', self.testcases, 1, time_limit=0.5, batch=True)
+
+        self.assertEqual(result['verdict'], 'TLE')
+        self.assertIn("Error in testcase 3", result['status'])
+
+
+class TestcaseStoreTestCase(TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.base_dir = Path(tmp.name)
+        (self.base_dir / 'testcases').mkdir()
+        self.path = self.base_dir / 'testcases' / '7.json'
+        self.write([{"input": {"nums": [1, 2, 3]}, "output": [3, 2, 1]}])
+        self.store = TestcaseStore(max_bytes=1024 * 1024)
+
+    def write(self, testcases):
+        self.path.write_text(json.dumps(testcases))
+
+    def test_parses_once_and_precomputes(self):
+        with self.settings(BASE_DIR=self.base_dir):
+            first, error = self.store.get(7)
+            with mock.patch('problem.testcase_store.json.loads') as loads:
+                second, _ = self.store.get(7)
+
+        self.assertIsNone(error)
+        self.assertIs(first, second)
+        loads.assert_not_called()
+        self.assertEqual(first[0]['stdin'], "1 2 3")
+        self.assertEqual(first[0]['expected'], "3 2 1")
+
+    def test_reloads_when_the_file_changes(self):
+        with self.settings(BASE_DIR=self.base_dir):
+            self.store.get(7)
+            self.write([{"input": {"n": 10}, "output": 55}, {"input": {"n": 1}, "output": 1}])
+            os.utime(self.path, ns=(0, 10 ** 9))
+            testcases, _ = self.store.get(7)
+
+        self.assertEqual([case['stdin'] for case in testcases], ["10", "1"])
+
+    def test_missing_file(self):
+        with self.settings(BASE_DIR=self.base_dir):
+            testcases, error = self.store.get(8)
+        self.assertIsNone(testcases)
+        self.assertIn("not found", error)
+
+
+class ExactCheckerTestCase(SimpleTestCase):
+    def check(self, expected, *chunks):
+        checker = ExactChecker(expected)
+        for chunk in chunks:
+            if not checker.feed(chunk):
+                return False
+        return checker.finish()
+
+    def test_matches_across_chunk_boundaries(self):
+        self.assertTrue(self.check("3 2 1", b"  \n3", b" ", b"2 1", b"\n\n"))
+        self.assertTrue(self.check("hello", b"HEL", b"lo\n"))
+        self.assertTrue(self.check("1 2 3", b"1 ", b"2 ", b"3\n"))
+        self.assertTrue(self.check("1\n2\n3", b"1\n", b"2\n", b"3"))
+
+    def test_inner_whitespace_still_counts(self):
+        self.assertFalse(self.check("3 2 1", b"3\n2\n1"))
+        self.assertFalse(self.check("3 2 1", b"3 2", b"  1"))
+
+    def test_output_too_short_or_too_long(self):
+        self.assertFalse(self.check("3 2 1", b"3 2"))
+        self.assertFalse(self.check("3 2 1", b"3 2 1", b" 0"))
+
+    def test_split_utf8_character(self):
+        self.assertTrue(self.check("café", "CAFÉ".encode()[:4], "CAFÉ".encode()[4:]))
+
+    def test_stops_at_first_mismatch(self):
+        checker = ExactChecker("1 2 3")
+        self.assertFalse(checker.feed(b"1 9" + b"x" * 10 ** 6))
+        self.assertFalse(checker.feed(b"1 2 3"))
+        self.assertFalse(checker.finish())
+        self.assertTrue(checker.output.startswith("1 9"))
+        self.assertTrue(checker.output.endswith("..."))
+
+
+class CheckerTestCase(SimpleTestCase):
+    def check(self, checker, *chunks):
+        for chunk in chunks:
+            if not checker.feed(chunk):
+                return False
+        return checker.finish()
+
+    def test_tokens_ignore_spacing(self):
+        self.assertTrue(self.check(TokenChecker("1 2 3"), b"1\n2", b"\n3\n"))
+        self.assertTrue(self.check(TokenChecker("12 3"), b"1", b"2 3"))
+        self.assertFalse(self.check(TokenChecker("12 3"), b"1 2 3"))
+        self.assertFalse(self.check(TokenChecker("1 2"), b"1 2 3"))
+
+    def test_floats_within_epsilon(self):
+        self.assertTrue(self.check(FloatChecker("0.333333 x", 1e-6), b"0.3333331 X"))
+        self.assertTrue(self.check(FloatChecker("1000000", 1e-6), b"1000000.5"))
+        self.assertFalse(self.check(FloatChecker("0.333333", 1e-6), b"0.3334"))
+        self.assertFalse(self.check(FloatChecker("1", 1e-6), b"nan"))
+
+    def test_unordered(self):
+        self.assertTrue(self.check(UnorderedChecker("1 2 2 3"), b"2 3 ", b"1 2"))
+        self.assertFalse(self.check(UnorderedChecker("1 2 2 3"), b"2 2 2"))
+        self.assertFalse(self.check(UnorderedChecker("1 2 2 3"), b"3 2 1"))
+
+
+class SpecialJudgeTestCase(TestCase):
+    def test_special_judge_decides(self):
+        # accepts any pair of positive numbers adding up to the answer
+        judge = (
+            "#include <fstream>\n"
+            "int main(int argc, char **argv) {\n"
+            "    std::ifstream out(argv[2]), ans(argv[3]);\n"
+            "    long a, b, n;\n"
+            "    if (!(out >> a >> b) || !(ans >> n)) return 1;\n"
+            "    return a > 0 && b > 0 && a + b == n ? 0 : 1;\n"
+            "}\n"
+        )
+        spec = {'name': 'special', 'epsilon': 0, 'code': judge}
+        testcases = [{"input": {"n": n}, "output": n} for n in (2, 10, 7)]
+
+        result = evaluate_submission("n = int(input())\nprint(1, n - 1)", 'py', testcases, 1, checker=spec)
+        self.assertEqual(result['verdict'], AC)
+
+        result = evaluate_submission("n = int(input())\nprint(0, n)", 'py', testcases, 1, checker=spec)
+        self.assertEqual(result['verdict'], validate.WA)
+
+    def test_broken_special_judge(self):
+        spec = {'name': 'special', 'epsilon': 0, 'code': "int main( {"}
+        result = evaluate_submission("print(1)", 'py', [{"input": {}, "output": 1}], 1, checker=spec)
+        self.assertEqual(result['verdict'], validate.JE)
+
+    @mock.patch('problem.checkers.SPECIAL_JUDGE_TIME_LIMIT', 0.3)
+    def test_failing_special_judge_is_a_judge_error(self):
+        for code in ("int main() { for (;;); }", "#include <cstdlib>\nint main() { std::abort(); }"):
+            spec = {'name': 'special', 'epsilon': 0, 'code': code}
+            result = evaluate_submission("print(1)", 'py', [{"input": {}, "output": 1}], 1, checker=spec)
+            self.assertEqual(result['verdict'], validate.JE)
+            self.assertIn("Special judge failed", result['status'])
+
+
+class ProblemFormTestCase(SimpleTestCase):
+    def form(self, **data):
+        return ProblemForm({
+            'title': "A + B", 'description': "Add a and b", 'difficulty': "Easy",
+            'testcases': "[]", 'checker': "exact", 'checker_epsilon': "1e-6", **data,
+        })
+
+    def test_valid(self):
+        self.assertTrue(self.form().is_valid())
+
+    def test_epsilon_is_required(self):
+        form = self.form(checker_epsilon="")
+        self.assertFalse(form.is_valid())
+        self.assertIn('checker_epsilon', form.errors)
+
+    def test_special_judge_needs_code(self):
+        form = self.form(checker="special", checker_code="  ")
+        self.assertFalse(form.is_valid())
+        self.assertIn('checker_code', form.errors)
+        self.assertTrue(self.form(checker="special", checker_code="int main() {}").is_valid())
+
+
+class SubmissionCounterTestCase(TestCase):
+    def setUp(self):
+        user = User.objects.create_user(username="counter", password="counter")
+        self.problem = Problem.objects.create(
+            title="A + B", description="Add a and b", difficulty="Easy", creator=user
+        )
+
+    def submissions(self):
+        return Problem.objects.values_list('submissions', flat=True).get(id=self.problem.id)
+
+    def test_write_through(self):
+        counter = SubmissionCounter(0)
+        counter.add(self.problem.id)
+        counter.add(self.problem.id)
+        self.assertEqual(self.submissions(), 2)
+
+    def test_buffered_increments_are_written_together(self):
+        counter = SubmissionCounter(3600)
+        self.addCleanup(counter.flush)
+        for _ in range(5):
+            counter.add(self.problem.id)
+        self.assertEqual(self.submissions(), 0)
+
+        # increments written by another process meanwhile are kept
+        Problem.objects.filter(id=self.problem.id).update(submissions=10)
+        counter.flush()
+        self.assertEqual(self.submissions(), 15)
+
+
+@override_settings(AI_FEEDBACK_BACKEND='stub')
+class FeedbackTestCase(TransactionTestCase):
+    # the AI feedback of failed submissions is cached
+    databases = {'default', 'cache'}
+
+    def setUp(self):
+        use_temporary_channel_layer(self)
+        cache.clear()
+        user = User.objects.create_user(username="feedback", password="feedback")
+        self.problem = Problem.objects.create(
+            title="A + B", description="Add a and b", difficulty="Easy", creator=user
+        )
+
+    def wait(self, feedback_id):
+        feedback._futures[feedback_id].result(timeout=10)
+        return feedback.feedback_state(feedback_id)
+
+    def test_feedback_is_generated_in_the_background_and_cached(self):
+        first = {'cerror': "Runtime Error\nFile \"/tmp/3f2b8a9e-1c2d-4e5f-8a9b-0c1d2e3f4a5b.py\", line 2"}
+        second = {'cerror': "Runtime Error\nFile \"/tmp/9a8b7c6d-1c2d-4e5f-8a9b-0c1d2e3f4a5b.py\", line 2"}
+
+        backend = mock.Mock(wraps=ai_request._stub)
+        with mock.patch.dict(ai_request.BACKENDS, stub=backend):
+            pending = feedback.request_feedback(self.problem.id, "print(", first, 'run')
+            state = self.wait(pending['feedback_id'])
+            cached = feedback.request_feedback(self.problem.id, "print(", second, 'run')
+
+        self.assertEqual(state['state'], 'done')
+        self.assertIn("A + B", state['ai_feedback'])
+        self.assertEqual(cached, {'ai_feedback': state['ai_feedback']})
+        self.assertEqual(backend.call_count, 1)
+
+    @mock.patch.object(judge_queue, 'JUDGE_WORKERS', 0)
+    def test_failed_submission_gets_a_feedback_id(self):
+        testcases = [{"input": {"a": 1, "b": 2}, "output": 3}]
+        submission_id = judge_queue.enqueue("print(0)", 'py', testcases, self.problem.id)
+
+        result = judge_queue.poll(submission_id)
+        self.assertEqual(result['verdict'], validate.WA)
+        self.assertEqual(judge_queue.poll(submission_id)['feedback_id'], result['feedback_id'])
+        self.assertEqual(self.wait(result['feedback_id'])['state'], 'done')
+
+
+class SubmissionConsumerTestCase(TransactionTestCase):
+    def setUp(self):
+        use_temporary_channel_layer(self)
+        self.user = User.objects.create_user(username="progress", password="progress")
+        self.problem = Problem.objects.create(
+            title="A + B", description="Add a and b", difficulty="Easy", creator=self.user
+        )
+
+    @mock.patch.object(judge_queue, 'JUDGE_WORKERS', 0)
+    def test_progress_events(self):
+        testcases = [{"input": {"a": a, "b": b}, "output": a + b} for a, b in [(1, 2), (3, 4)]]
+        code = "a = int(input())\nb = int(input())\nprint(a + b)"
+
+        async def follow():
+            communicator = WebsocketCommunicator(
+                URLRouter(ws_urlpatterns), "/ws/submission/0123abcd/"
+            )
+            communicator.scope['user'] = self.user
+            connected, _ = await communicator.connect()
+            self.assertTrue(connected)
+
+            with mock.patch.object(judge_queue, 'uuid4', return_value=mock.Mock(hex="0123abcd")):
+                await sync_to_async(judge_queue.enqueue)(code, 'py', testcases, self.problem.id)
+
+            events = []
+            while not events or events[-1]['stage'] != 'done':
+                events.append(await communicator.receive_json_from(timeout=10))
+            await communicator.disconnect()
+            return events
+
+        events = async_to_sync(follow)()
+        self.assertEqual(
+            [(event['stage'], event.get('case')) for event in events],
+            [('compiling', None), ('running', None), ('case', 1), ('case', 2), ('done', None)],
+        )
+        self.assertEqual(events[-1]['verdict'], AC)
+
+
+class SQLiteChannelLayerTestCase(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'channels.sqlite3')
+        self.layer = SQLiteChannelLayer(path=self.path, capacity=3)
+
+    def test_send_receive(self):
+        async def roundtrip():
+            channel = await self.layer.new_channel()
+            await self.layer.send(channel, {'type': 'test', 'data': b'\x00\xff', 'n': [1, 2]})
+            return await asyncio.wait_for(self.layer.receive(channel), 5)
+
+        self.assertEqual(async_to_sync(roundtrip)(), {'type': 'test', 'data': b'\x00\xff', 'n': [1, 2]})
+
+    def test_group_send_from_another_process(self):
+        # a second layer on the same database stands in for another process:
+        # it shares no memory with the receiving one
+        sender = SQLiteChannelLayer(path=self.path)
+
+        async def fan_out():
+            channels = [await self.layer.new_channel() for _ in range(3)]
+            for channel in channels:
+                await self.layer.group_add('judge', channel)
+            await self.layer.group_discard('judge', channels[2])
+            await sender.group_send('judge', {'type': 'judge.progress', 'stage': 'done'})
+            received = await asyncio.wait_for(
+                asyncio.gather(*(self.layer.receive(channel) for channel in channels[:2])), 5
+            )
+            with self.assertRaises(asyncio.TimeoutError):
+                await asyncio.wait_for(self.layer.receive(channels[2]), 0.2)
+            return received
+
+        self.assertEqual(async_to_sync(fan_out)(), [{'type': 'judge.progress', 'stage': 'done'}] * 2)
+
+    def test_capacity_and_expiry(self):
+        async def fill():
+            channel = await self.layer.new_channel()
+            for i in range(3):
+                await self.layer.send(channel, {'type': 'test', 'i': i})
+            with self.assertRaises(ChannelFull):
+                await self.layer.send(channel, {'type': 'test', 'i': 3})
+            self.layer.expiry = -1
+            await self.layer.flush()
+            await self.layer.send(channel, {'type': 'test', 'i': 4})
+            with self.assertRaises(asyncio.TimeoutError):
+                await asyncio.wait_for(self.layer.receive(channel), 0.2)
+
+        async_to_sync(fill)()
+
+    def test_presence_expires_unless_refreshed(self):
+        async def expire():
+            self.layer.presence_expiry = 0.2
+            await self.layer.presence_join('room', 'a', "ann")
+            await self.layer.presence_join('room', 'b', "bob")
+            self.assertEqual(await self.layer.presence_publish('room'), ["ann", "bob"])
+            await asyncio.sleep(0.1)
+            await self.layer.presence_refresh([('room', 'a')])
+            await asyncio.sleep(0.15)
+            self.assertEqual(await self.layer.presence_members('room'), ["ann"])
+
+            # a member that left isn't brought back by a refresh
+            await self.layer.presence_leave('room', 'a')
+            await self.layer.presence_refresh([('room', 'a')])
+            self.assertEqual(await self.layer.presence_members('room'), [])
+
+        async_to_sync(expire)()
+        # the published snapshot goes with the room's last member
+        connection = self.layer._connection()
+        self.layer._cleanup(connection)
+        self.assertEqual(connection.execute('SELECT COUNT(*) FROM presence').fetchone(), (0,))
+        self.assertEqual(connection.execute('SELECT COUNT(*) FROM presence_published').fetchone(), (0,))
+
+
+class ChatLogTestCase(TransactionTestCase):
+    def setUp(self):
+        use_temporary_channel_layer(self)
+        self.user = User.objects.create_user(username="chatter", password="chatter")
+        problem = Problem.objects.create(
+            title="A + B", description="Add a and b", difficulty="Easy", creator=self.user
+        )
+        self.chatspace = Chatspace.objects.create(problem=problem)
+
+    def test_history_pages_and_unsaved_messages(self):
+        chat_log = ChatLog(max_messages=100, interval=3600)
+        self.addCleanup(chat_log.flush)
+        for i in range(3):
+            chat_log.add(self.chatspace.id, self.user, f"message {i}")
+        self.assertFalse(ChatMessage.objects.exists())
+        # not written yet, but already in the history
+        self.assertEqual(
+            [m['message'] for m in chat_log.history(self.chatspace.id)['messages']],
+            ["message 0", "message 1", "message 2"],
+        )
+
+        chat_log.flush()
+        chat_log.add(self.chatspace.id, self.user, "message 3")
+        latest = chat_log.history(self.chatspace.id, limit=2)
+        self.assertEqual(
+            [m['message'] for m in latest['messages']], ["message 1", "message 2", "message 3"]
+        )
+        self.assertTrue(latest['more'])
+        older = chat_log.history(self.chatspace.id, before=latest['before'], limit=2)
+        self.assertEqual([m['message'] for m in older['messages']], ["message 0"])
+        self.assertFalse(older['more'])
+
+    def test_batch_written_during_history_is_not_lost(self):
+        chat_log = ChatLog(max_messages=100, interval=3600)
+        self.addCleanup(chat_log.flush)
+        for i in range(3):
+            chat_log.add(self.chatspace.id, self.user, f"message {i}")
+
+        def flush_after_the_query(execute, sql, params, many, context):
+            result = execute(sql, params, many, context)
+            if sql.startswith('SELECT') and chat_log._pending:
+                chat_log.flush()
+            return result
+
+        with connection.execute_wrapper(flush_after_the_query):
+            history = chat_log.history(self.chatspace.id)
+        self.assertEqual(ChatMessage.objects.count(), 3)
+        self.assertEqual(
+            [m['message'] for m in history['messages']], ["message 0", "message 1", "message 2"]
+        )
+        self.assertEqual(
+            [m['message'] for m in chat_log.history(self.chatspace.id)['messages']],
+            ["message 0", "message 1", "message 2"],
+        )
+
+    def test_full_batch_is_written(self):
+        chat_log = ChatLog(max_messages=2, interval=3600)
+        self.addCleanup(chat_log.flush)
+        chat_log.add(self.chatspace.id, self.user, "first")
+        chat_log.add(self.chatspace.id, self.user, "second")
+        for _ in range(100):
+            if ChatMessage.objects.count() == 2:
+                break
+            time.sleep(0.05)
+        self.assertEqual(
+            list(ChatMessage.objects.order_by('id').values_list('message', flat=True)),
+            ["first", "second"],
+        )
+
+    def test_late_joiner_gets_history_in_one_frame(self):
+        ChatMessage.objects.bulk_create(
+            ChatMessage(chatspace=self.chatspace, user=self.user, username="chatter", message=m)
+            for m in ["hi", "hello"]
+        )
+
+        async def join():
+            communicator = WebsocketCommunicator(
+                URLRouter(ws_urlpatterns),
+                f"/ws/problem/{self.chatspace.problem_id}/{self.chatspace.id}/",
+            )
+            communicator.scope['user'] = self.user
+            connected, _ = await communicator.connect()
+            self.assertTrue(connected)
+            frames = [await communicator.receive_json_from(timeout=5) for _ in range(2)]
+            await communicator.disconnect()
+            return frames
+
+        history, presence = async_to_sync(join)()
+        self.assertEqual(history['type'], 'history')
+        self.assertEqual([m['message'] for m in history['messages']], ["hi", "hello"])
+        self.assertFalse(history['more'])
+        self.assertEqual(presence, {'type': 'presence', 'count': 1, 'members': ["chatter"]})
+
+
+class PresenceTestCase(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.layer = SQLiteChannelLayer(path=os.path.join(directory.name, 'channels.sqlite3'))
+        self.group_send = mock.AsyncMock()
+        patcher = mock.patch.object(self.layer, 'group_send', self.group_send)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch('problem.presence.get_channel_layer', return_value=self.layer)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.presence = Presence(3600)
+        self.addCleanup(self.presence.stop)
+
+    def join(self, username, channel, presence=None):
+        async_to_sync((presence or self.presence).join)('room', channel, username)
+
+    def leave(self, channel, presence=None):
+        async_to_sync((presence or self.presence).leave)('room', channel)
+
+    def snapshot(self):
+        return async_to_sync(self.presence.snapshot)('room')
+
+    def test_changes_are_coalesced_into_one_snapshot(self):
+        for username, channel in [("ann", "a"), ("bob", "b1"), ("bob", "b2"), ("cid", "c")]:
+            self.join(username, channel)
+        self.leave("c")
+        self.leave("b1")  # bob still has another socket open
+        self.presence.flush()
+
+        self.group_send.assert_awaited_once_with(
+            'room', {'type': 'presence_snapshot', 'count': 2, 'members': ["ann", "bob"]}
+        )
+        self.assertEqual(self.snapshot(), {'count': 2, 'members': ["ann", "bob"]})
+
+    def test_reconnect_within_the_interval_is_not_published(self):
+        self.join("ann", "a1")
+        self.presence.flush()
+        self.leave("a1")
+        self.join("ann", "a2")
+        self.presence.flush()
+        self.assertEqual(self.group_send.await_count, 1)
+
+        self.leave("a2")
+        self.presence.flush()
+        self.group_send.assert_awaited_with(
+            'room', {'type': 'presence_snapshot', 'count': 0, 'members': []}
+        )
+        self.assertEqual(self.snapshot(), {'count': 0, 'members': []})
+
+    def test_members_of_every_process(self):
+        # another Presence stands in for another ASGI process
+        other = Presence(3600)
+        self.addCleanup(other.stop)
+        self.join("ann", "a")
+        self.join("bob", "b", presence=other)
+        self.presence.flush()
+        other.flush()
+
+        # both processes' members, published once
+        self.group_send.assert_awaited_once_with(
+            'room', {'type': 'presence_snapshot', 'count': 2, 'members': ["ann", "bob"]}
+        )
+        self.assertEqual(async_to_sync(other.snapshot)('room'), self.snapshot())
+
+    def test_members_of_a_dead_process_expire(self):
+        self.layer.presence_expiry = 0.3
+        other = Presence(3600)
+        self.addCleanup(other.stop)
+        self.join("ann", "a")
+        self.join("bob", "b", presence=other)
+        self.presence.flush()
+        # the other process dies: no more heartbeats, bob never leaves
+        other.stop()
+
+        time.sleep(0.6)
+        # ann's heartbeats kept her, and published the room without bob
+        self.assertEqual(self.snapshot(), {'count': 1, 'members': ["ann"]})
+        self.group_send.assert_awaited_with(
+            'room', {'type': 'presence_snapshot', 'count': 1, 'members': ["ann"]}
+        )
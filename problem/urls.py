@@ -7,5 +7,8 @@ urlpatterns = [
     
     # This path is ONLY for the background JavaScript calls.
     path('api/<int:pid>/', views.ProblemView.as_view(), name='problem_api'),
+    path('api/submission/<str:submission_id>/', views.SubmissionView.as_view(), name='submission_status'),
+    path('api/feedback/<str:feedback_id>/', views.FeedbackView.as_view(), name='feedback_status'),
     path('api/chatspace/', views.create_chatspace_session, name='create_chatspace'),
+    path('api/chatspace/<uuid:chatspace_id>/presence/', views.ChatspacePresenceView.as_view(), name='chatspace_presence'),
 ]
\ No newline at end of file
@@ -1,51 +1,121 @@
-import os
-import json
+from django.db import transaction
 
-from django.conf import settings
+from accounts.models import UserProfile
 
-from .validate import evaluate_submission, run
+from .counters import submission_counter
+from .feedback import request_feedback
+from .judge_queue import enqueue, poll
+from .models import Submission, TestcaseResult
+from .testcase_store import testcase_store
+from .validate import AC, JE, run, serialize_input
 
 
 def load_testcases(pid):
     """
     Load test cases for a given pid.
+    The parsed testcases are cached per process, see testcase_store.
     """
-    testcase_file = os.path.join(settings.BASE_DIR, 'testcases', f'{pid}.json')
-    try:
-        with open(testcase_file, 'r') as f:
-            return json.load(f), None
-    except FileNotFoundError:
-        return None, f"{pid}; Test cases not found for this problem."
-    except json.JSONDecodeError:
-        return None, f"{pid}; Invalid test case format."
+    return testcase_store.get(pid)
 
 
-def handle_submission(code, language, testcases, problem):
+def handle_submission(code, language, testcases, problem, user=None):
     """
     Handle the submission action.
+    The submission is queued for the judge workers; the verdict is fetched
+    later with the returned submission id.
     """
-    evaluation_result = evaluate_submission(code, language, testcases, problem.id)
-    problem.submissions += 1
-    problem.save()
-    return evaluation_result
+    submission_id = enqueue(
+        code, language, testcases, problem.id,
+        user_id=user.id if user is not None and user.is_authenticated else None,
+        time_limit=problem.time_limit, memory_limit=problem.memory_limit,
+        batch=problem.batch_testcases, checker=problem.checker_spec
+    )
+    submission_counter.add(problem.id)
+    return {'submission_id': submission_id, 'status': "Queued"}
 
 
-def handle_run(code, language, testcases):
+def record_submission(submission_id, user_id, pid, language, result):
+    """
+    Persist a judged submission and the usage of every testcase that ran,
+    in one transaction at the end of the evaluation. An accepted solution
+    goes to the end of the user's last_5_solved_pids, the most recent last
+    as the recommender reads it.
+    """
+    verdict = result.get('verdict', JE)
+    run_times, memories = result.get('run_times', []), result.get('memories', [])
+    verdicts = [AC] * len(run_times)
+    if verdicts and verdict != AC:
+        # judging stops at the first failing testcase
+        verdicts[-1] = verdict
+
+    with transaction.atomic():
+        Submission.objects.create(
+            id=submission_id,
+            user_id=user_id,
+            problem_id=pid,
+            language=language,
+            verdict=verdict,
+            status=result.get('status', ""),
+            compile_time=result.get('compile_time', 0.0),
+        )
+        TestcaseResult.objects.bulk_create([
+            TestcaseResult(
+                submission_id=submission_id, index=i, verdict=case_verdict, time=run_time, memory=memory
+            )
+            for i, (case_verdict, run_time, memory) in enumerate(
+                zip(verdicts, run_times, memories)
+            )
+        ])
+
+        if user_id is not None and verdict == AC:
+            profile, _ = UserProfile.objects.select_for_update().get_or_create(user_id=user_id)
+            solved = [p for p in profile.last_5_solved_pids if p != pid]
+            profile.last_5_solved_pids = [*solved, pid][-5:]
+            profile.save(update_fields=['last_5_solved_pids'])
+
+
+def submission_state(submission_id):
+    """
+    The judge queue's state of a submission (see judge_queue.poll). Once the
+    queue has forgotten it, or it was judged behind another process, the
+    verdict comes from its Submission record. None if there is neither.
+    """
+    result = poll(submission_id)
+    if result is not None:
+        return result
+
+    submission = Submission.objects.filter(id=submission_id).first()
+    if submission is None:
+        return None
+    return {
+        'state': 'done',
+        'verdict': submission.verdict,
+        'status': submission.status,
+        'compile_time': submission.compile_time,
+    }
+
+
+def handle_run(code, language, testcases, problem):
     """
     Handle the run action.
     """
-    input_parts = []
-    for value in testcases[0]['input'].values():
-        if isinstance(value, list):
-            input_parts.append(' '.join(map(str, value)))
-        else:
-            input_parts.append(str(value))
-    cinput = '\n'.join(input_parts)
-    return run(code, cinput, language)
+    testcase = testcases[0]
+    cinput = testcase.get('stdin') or serialize_input(testcase['input'])
+    return run(code, cinput, language, problem.time_limit, problem.memory_limit)
 
 
-def handle_testcase(code, language, cinput):
+def handle_testcase(code, language, cinput, problem):
     """
     Handle the testcase action.
     """
-    return run(code, cinput, language)
\ No newline at end of file
+    return run(code, cinput, language, problem.time_limit, problem.memory_limit)
+
+
+def attach_ai_feedback(result, problem, code, action):
+    """
+    Request AI feedback on a failed run/submission without waiting for it:
+    the result gets the cached 'ai_feedback', or a 'feedback_id' to poll.
+    """
+    if result.get("cerror"):
+        result.update(request_feedback(problem.id, code, result, action))
+    return result
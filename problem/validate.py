@@ -1,13 +1,46 @@
-from compiler.views import execute
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import partial
 
-def run(code, cinput, language):
-    """
-    run, ctestcase, submit the code using a compiler app.
+from django.conf import settings
+
+from compiler.views import (
+    CE,
+    cleanup,
+    compile_code,
+    execute,
+    run_artifact,
+    run_artifact_batch,
+    supports_batch
+)
+
+from .checkers import SPECIAL, make_checker
+
+AC = 'AC'
+WA = 'WA'
+# the problem (its special judge or testcases) is broken, not the submission
+JE = 'JE'
 
+# testcases of one submission run concurrently on up to this many threads,
+# 1 runs them one after another
+PARALLEL_CASES = getattr(settings, 'JUDGE_PARALLEL_CASES', 1)
+
+
+def run(code, cinput, language, time_limit=1.0, memory_limit=256):
     """
-    result = execute(language, code, cinput)
+    run, ctestcase, submit the code using a compiler app,
+    under the problem's time (s) and memory (MB) limits.
+    """
+    result = execute(language, code, cinput, time_limit, memory_limit)
     return result
 
+def normalize_output(output):
+    """
+    The form outputs are compared in: lists space separated, stripped, lowercase.
+    """
+    if isinstance(output, list):
+        output = " ".join(map(str, output))
+    return str(output).strip().lower()
+
 def validate_submission(coutput, expected_output):
     """
     Validate the output of a code submission against the expected output.
@@ -15,58 +48,270 @@ def validate_submission(coutput, expected_output):
         True - output matches, 
         False - otherwise.
     """
-    if isinstance(coutput, list):
-        coutput = " ".join(map(str, coutput))
-    coutput = coutput.strip().lower()
+    return normalize_output(coutput) == normalize_output(expected_output)
 
-    if type(expected_output) == list:
-        expected_output = " ".join(map(str, expected_output))
-    expected_output = str(expected_output).strip().lower()
+def serialize_input(testcase_input):
+    """
+    Serialize the input dict of a JSON testcase back to the string the
+    executed code reads from stdin: one line per value, lists space separated.
+    """
+    input_parts = []
+    for value in testcase_input.values():
+        if isinstance(value, list):
+            input_parts.append(' '.join(map(str, value)))
+        else:
+            input_parts.append(str(value))
+    return '\n'.join(input_parts)
 
-    if coutput == expected_output:
-        return True
-    return False
+def prepare_testcase(testcase):
+    """
+    Add the serialized stdin and the normalized expected output to a JSON
+    testcase, so they are computed once instead of on every run.
+    Raises KeyError if 'input' or 'output' is missing.
+    """
+    return {
+        **testcase,
+        'stdin': serialize_input(testcase['input']),
+        'expected': normalize_output(testcase['output']),
+    }
 
-def evaluate_submission(code, language, testcases, pid):
+def _testcase_io(i, testcase, pid):
+    """
+    Returns (prepared testcase, None) for testcase i,
+    or (None, failure) if the testcase is malformed.
+    """
+    if 'stdin' in testcase:
+        return testcase, None
+    try:
+        # The input from the JSON file needs to be serialized back to a string
+        # that the executed code can read from stdin.
+        return prepare_testcase(testcase), None
+    except KeyError:
+        return None, {
+            'status': f"{pid}; Invalid test case format: 'input' or 'output' key missing in testcase {i+1}.",
+            'cerror': "Invalid test case format.",
+            'verdict': JE
+        }
+
+def _check_result(i, result, case, pid, checker):
+    """
+    Judge the run result of testcase i, whose output was fed to checker.
+    Returns the evaluation result describing the failure, or None if it passed.
+    """
+    cinput, expected_output = case['stdin'], case['output']
+    cerr = result.get("cerror", "").strip()
+    passed = not cerr and checker.finish()
+    coutput = checker.output
+
+    if cerr:
+        return {
+            'cerror': cerr + f" (Testcase {i+1}| {cinput} -> {expected_output} ~{coutput})",
+            'status': f"{pid}; Error in testcase {i+1}: {cerr}",
+            'verdict': result.get('verdict')
+        }
+
+    if checker.error:
+        return {
+            'cerror': checker.error,
+            'status': f"{pid}; Judge error in testcase {i+1}: {checker.error}",
+            'verdict': JE
+        }
+
+    if not passed:
+        status = f"{pid}; Testcase {i+1} failed: expected '{expected_output}', got '{coutput}'"
+        if checker.comment:
+            status += f" ({checker.comment})"
+        return {
+            'cerror': f"Testcase {cinput} : {coutput}",
+            'status': status,
+            'verdict': WA
+        }
+
+    return None
+
+def judge_testcase(artifact, i, testcase, pid, time_limit, memory_limit, new_checker=make_checker):
+    """
+    Runs a compiled artifact against testcase i.
+    new_checker(case) returns the checker for a testcase.
+    Returns (failure, usage): failure is the evaluation result describing
+    why the testcase failed, or None if it passed; usage is
+    (run time in s, peak memory in KB).
+    """
+    case, failure = _testcase_io(i, testcase, pid)
+    if failure:
+        return failure, (0.0, 0)
+
+    # the output is checked while the program runs, it is stopped at the
+    # first mismatch and never held in memory as a whole
+    checker = new_checker(case)
+    result = run_artifact(
+        artifact, case['stdin'], time_limit, memory_limit, stdout_sink=checker.feed
+    )
+    return _check_result(i, result, case, pid, checker), (result['time'], result['memory'])
+
+def evaluate_submission(code, language, testcases, pid, time_limit=1.0, memory_limit=256, batch=False,
+                        checker=None, on_progress=None):
     """
     Evaluates the user's code against a set of test cases.
-    Returns a dictionary with the evaluation result.
+    The code is compiled once and the artifact is run for every testcase;
+    with batch (harness mode, python only) a single process runs them all.
+    checker is the problem's Problem.checker_spec, None for exact matching.
+    on_progress(event) is called with {'stage': 'compiling'}, then
+    {'stage': 'running', 'total'} and {'stage': 'case', 'case', 'total',
+    'passed', 'time'} for every testcase judged.
+    Returns a dictionary with the evaluation result, including the
+    compile time and the run time (s) and peak memory (KB) of every
+    testcase that was run.
     """
-    for i, testcase in enumerate(testcases):
-        try:
-            # The input from the JSON file needs to be serialized back to a string
-            # that the executed code can read from stdin.
-            input_parts = []
-            for key, value in testcase['input'].items():
-                if isinstance(value, list):
-                    input_parts.append(' '.join(map(str, value)))
-                else:
-                    input_parts.append(str(value))
-            cinput = '\n'.join(input_parts)
-
-            expected_output = testcase['output']
-
-        except KeyError:
-            return {
-                'status': f"{pid}; Invalid test case format: 'input' or 'output' key missing in testcase {i+1}.",
-                'cerror': "Invalid test case format."
-            }
+    total = len(testcases)
 
-        result = run(code, cinput, language)
-        coutput = result.get("coutput", "").strip().lower()
-        cerr = result.get("cerror", "").strip()
+    def report(event):
+        if on_progress is not None:
+            on_progress(event)
 
-        
-        if cerr:
-            return {
-                'cerror': cerr + f" (Testcase {i+1}| {cinput} -> {expected_output} ~{coutput})",
-                'status': f"{pid}; Error in testcase {i+1}: {cerr}"
-            }
-        
-        if not validate_submission(coutput, expected_output):
+    def report_case(i, failure, usage):
+        report({
+            'stage': 'case', 'case': i + 1, 'total': total,
+            'passed': failure is None, 'time': usage[0],
+        })
+
+    report({'stage': 'compiling'})
+    judge = None
+    if checker and checker['name'] == SPECIAL:
+        # compiled once per submission, and the compile cache keeps it around
+        judge = compile_code('cpp', checker['code'] or "")
+        if judge.get('verdict') == CE:
             return {
-                'cerror': f"Testcase {cinput} : {coutput}",
-                'status': f"{pid}; Testcase {i+1} failed: expected '{expected_output}', got '{coutput}'"
+                'cerror': judge['cerror'],
+                'status': f"{pid}; The special judge of this problem does not compile",
+                'verdict': JE,
+                'compile_time': 0.0,
+                'run_times': [],
+                'memories': []
             }
-            
-    return {'status': "Accepted!"}
\ No newline at end of file
+    new_checker = partial(make_checker, checker, judge=judge)
+
+    artifact = compile_code(language, code)
+    if artifact.get('verdict') == CE:
+        if judge:
+            cleanup(judge)
+        return {
+            'cerror': artifact['cerror'],
+            'status': f"{pid}; Compilation error",
+            'verdict': CE,
+            'compile_time': artifact.get('compile_time', 0.0),
+            'run_times': [],
+            'memories': []
+        }
+
+    report({'stage': 'running', 'total': total})
+    args = (artifact, testcases, pid, time_limit, memory_limit, new_checker, report_case)
+    try:
+        if batch and supports_batch(language):
+            failure, usages = _judge_batch(*args)
+        elif PARALLEL_CASES > 1 and len(testcases) > 1:
+            failure, usages = _judge_parallel(*args)
+        else:
+            failure, usages = _judge_sequential(*args)
+    finally:
+        cleanup(artifact)
+        if judge:
+            cleanup(judge)
+
+    result = failure or {'status': "Accepted!", 'verdict': AC}
+    result['compile_time'] = artifact['compile_time']
+    result['run_times'] = [run_time for run_time, _ in usages]
+    result['memories'] = [memory for _, memory in usages]
+    return result
+
+def _judge_sequential(artifact, testcases, pid, time_limit, memory_limit, new_checker, report_case):
+    """
+    Run the testcases one after another, stopping at the first failure.
+    report_case(i, failure, usage) is called after each testcase.
+    Returns (failure or None, usage of the testcases that ran).
+    """
+    usages = []
+    for i, testcase in enumerate(testcases):
+        failure, usage = judge_testcase(
+            artifact, i, testcase, pid, time_limit, memory_limit, new_checker
+        )
+        report_case(i, failure, usage)
+        usages.append(usage)
+        if failure:
+            return failure, usages
+    return None, usages
+
+def _judge_batch(artifact, testcases, pid, time_limit, memory_limit, new_checker, report_case):
+    """
+    Harness mode: stream every testcase input to one process and validate
+    the framed outputs one by one.
+    Returns (failure or None, usage of the testcases that ran).
+    """
+    cases = []
+    for i, testcase in enumerate(testcases):
+        case, failure = _testcase_io(i, testcase, pid)
+        if failure:
+            return failure, []
+        cases.append(case)
+
+    results, unfinished = run_artifact_batch(
+        artifact, [case['stdin'] for case in cases], time_limit, memory_limit
+    )
+
+    usages = []
+    for i, result in enumerate(results):
+        usages.append((result['time'], result['memory']))
+        failure = _check_output(i, result, cases[i], pid, new_checker(cases[i]))
+        report_case(i, failure, usages[-1])
+        if failure:
+            return failure, usages
+
+    if unfinished:
+        i = len(results)
+        usages.append((unfinished['time'], unfinished['memory']))
+        failure = _check_output(i, unfinished, cases[i], pid, new_checker(cases[i]))
+        report_case(i, failure, usages[-1])
+        return failure, usages
+    return None, usages
+
+def _check_output(i, result, case, pid, checker):
+    """
+    _check_result for a run whose output was collected instead of streamed.
+    """
+    checker.feed(result.get('coutput', '').encode())
+    return _check_result(i, result, case, pid, checker)
+
+def _judge_parallel(artifact, testcases, pid, time_limit, memory_limit, new_checker, report_case):
+    """
+    Fan the testcases out over PARALLEL_CASES threads, each one waiting on
+    its own sandboxed process. Still fail-fast: once testcase i fails, every
+    pending testcase after i is cancelled, and the reported failure is the
+    first failing testcase by index, exactly as in a sequential run.
+    """
+    usages = [None] * len(testcases)
+    first_failure = None  # (index, failure)
+
+    with ThreadPoolExecutor(max_workers=PARALLEL_CASES) as pool:
+        futures = {
+            pool.submit(
+                judge_testcase, artifact, i, testcase, pid, time_limit, memory_limit, new_checker
+            ): i
+            for i, testcase in enumerate(testcases)
+        }
+        for future in as_completed(futures):
+            if future.cancelled():
+                continue
+            i = futures[future]
+            failure, usages[i] = future.result()
+            report_case(i, failure, usages[i])
+            if failure and (first_failure is None or i < first_failure[0]):
+                first_failure = (i, failure)
+                for pending, j in futures.items():
+                    if j > i:
+                        pending.cancel()
+
+    if first_failure is None:
+        return None, usages
+    # everything before the failing testcase has run, same as sequentially
+    i, failure = first_failure
+    return failure, usages[:i + 1]
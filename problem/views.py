@@ -1,18 +1,23 @@
 from django.shortcuts import render, redirect, get_object_or_404
 
 import problem
-from .models import Problem
+from .models import Chatspace, Problem
 from django.contrib.auth.decorators import login_required
 from .forms import ProblemForm, SubmissionForm
 
 import os
+from asgiref.sync import async_to_sync
 from django.conf import settings
-from .ai_request import aicall
+from .feedback import feedback_state
+from .presence import presence, room_name
+from .testcase_store import testcase_store
 from .utils import (
     load_testcases,
     handle_submission,
     handle_run,
-    handle_testcase
+    handle_testcase,
+    attach_ai_feedback,
+    submission_state
 )
 
 from rest_framework.views import APIView
@@ -60,26 +65,50 @@ class ProblemView(APIView):
                 return Response({"error": error}, status=status.HTTP_404_NOT_FOUND)
 
             if action == 'submit':
-                result = handle_submission(code, language, testcases, problem)
+                result = handle_submission(code, language, testcases, problem, request.user)
+                return Response(result, status=status.HTTP_202_ACCEPTED)
             elif action == 'run':
-                result = handle_run(code, language, testcases)
+                result = handle_run(code, language, testcases, problem)
             elif action == 'testcase':
-                result = handle_testcase(code, language, cinput)
-
-            if result.get("cerror"):
-                payload = [
-                    problem.title,
-                    problem.tags,
-                    problem.constraints,
-                    code,
-                    result['cerror'],
-                    result.get('status', "")
-                ]
-                result['ai_feedback'] = aicall(payload, action)                
+                result = handle_testcase(code, language, cinput, problem)
+
+            attach_ai_feedback(result, problem, code, action)
 
             return Response(result, status=status.HTTP_200_OK)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+
+class SubmissionView(APIView):
+    def get(self, request, submission_id):
+        """
+            Poll the judge queue for the verdict of a submission
+        """
+        result = submission_state(submission_id)
+        if result is None:
+            return Response({"error": "Submission not found"}, status=status.HTTP_404_NOT_FOUND)
+        return Response(result, status=status.HTTP_200_OK)
+
+class FeedbackView(APIView):
+    def get(self, request, feedback_id):
+        """
+            Poll for the AI feedback on a failed run or submission
+        """
+        result = feedback_state(feedback_id)
+        if result is None:
+            return Response({"error": "Feedback not found"}, status=status.HTTP_404_NOT_FOUND)
+        return Response(result, status=status.HTTP_200_OK)
+
+class ChatspacePresenceView(APIView):
+    def get(self, request, chatspace_id):
+        """
+            Members currently connected to a chatspace
+        """
+        chatspace = get_object_or_404(Chatspace, id=chatspace_id)
+        return Response(
+            async_to_sync(presence.snapshot)(room_name(chatspace.problem_id, chatspace.id)),
+            status=status.HTTP_200_OK,
+        )
+
 @api_view(['POST'])
 @login_required
 def create_chatspace_session(request):
@@ -107,6 +136,7 @@ def create_problem(request):
 
             with open(testcase_file, 'w') as f:
                 f.write(testcases)
+            testcase_store.invalidate(problem.id)
 
             return redirect('problem_detail', pid=problem.id)
         
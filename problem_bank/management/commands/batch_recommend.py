@@ -0,0 +1,46 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from accounts.models import UserProfile
+from problem_bank.recommendation_cache import (
+    BATCH_SIZE, DIFFICULTIES, active_profiles, cache_recommendations, recommend_ids
+)
+from recommender.state import get_state
+
+
+class Command(BaseCommand):
+    help = 'Computes and caches the recommendations of every active user, in batches.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE,
+                            help='users whose recommendations are computed together')
+        parser.add_argument('--all-users', action='store_true',
+                            help='every user, not only the ones who logged in lately')
+        parser.add_argument('--compare', action='store_true',
+                            help='also time computing them one user at a time')
+
+    def handle(self, *args, **options):
+        state = get_state()
+        if state is None:
+            raise CommandError("No recommender index, run genembeddng first.")
+        if options['all_users']:
+            profiles = list(UserProfile.objects.only('user_id', 'last_5_solved_pids'))
+        else:
+            profiles = list(active_profiles())
+
+        started = time.perf_counter()
+        computed = cache_recommendations(profiles, state, batch_size=options['batch_size'])
+        self.report("Batched", profiles, time.perf_counter() - started)
+        self.stdout.write(self.style.SUCCESS(f"Cached {computed} recommendation lists."))
+
+        if options['compare']:
+            started = time.perf_counter()
+            for profile in profiles:
+                for difficulty in DIFFICULTIES:
+                    recommend_ids(profile, state, difficulty)
+            self.report("One user at a time", profiles, time.perf_counter() - started)
+
+    def report(self, name, profiles, elapsed):
+        rate = len(profiles) / elapsed if elapsed > 0 else 0.0
+        self.stdout.write(f"{name}: {len(profiles)} users in {elapsed:.2f}s, {rate:.0f} users/sec")
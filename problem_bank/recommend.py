@@ -2,17 +2,12 @@ from django.db.models import Q, Count
 from django.db import models
 
 from django.test import tag
-from problem.models import Problem
+from problem.models import Problem, Tag
 from accounts.models import UserProfile
 
-import os
-import numpy as np
-import faiss
-
 from django.conf import settings
-from recommender.recommendation import rerank_recommendations
-
-FAISS_INDEX_PATH = os.path.join(settings.BASE_DIR, 'recommender', 'embedding', 'problems.faiss')
+from recommender.state import get_state
+from .recommendation_cache import cached_recommendation
 
 def load_recommendation(
         user, 
@@ -20,59 +15,33 @@ def load_recommendation(
         topk=10
     ):
     """
-    Generates personalized problem recommendations for a user using reranking.
+    Generates personalized problem recommendations for a user using reranking,
+    cached until the user solves a problem or the index changes.
     """
     userprofile = UserProfile.objects.filter(user=user).first()
-    print("user profile", userprofile)
     if not userprofile:
         return Problem.objects.none()
-    
-    all_problems = list(Problem.objects.all())
-    problem_map = {
-        p.id : p for p in all_problems
-    }
-    problem_list = []
-    for i, p in enumerate(all_problems):
-        embedding_bytes = p.embedding
-        if embedding_bytes:
-            embedding = np.frombuffer(embedding_bytes, dtype=np.float32)
-            problem_list.append({
-                'index': i,
-                'id': p.id,
-                'tags': p.tags_list,
-                'difficulty': p.difficulty.lower(),
-                'embedding': embedding
-            })
-
-    problemid_index = {
-        p['id'] : p['index'] for p in problem_list
-    }
-    solved_pid = userprofile.last_5_solved_pids
-    last_solved_indices = [problemid_index[pid] for pid in solved_pid if pid in problemid_index]
 
-    try:
-        faiss_index = faiss.read_index(FAISS_INDEX_PATH)
-    except RuntimeError:
+    state = get_state()
+    if state is None:
         # Fallback if index is not found
         return tag_ranker(user)
-    
-    recommended_data = rerank_recommendations(
-        last_solved_indices=last_solved_indices,
-        difficulty_filter=difficulty.lower(),
-        problems=problem_list,
-        faiss_index=faiss_index,
-        topk=topk
-    )
-    recommended_id = [data['pid'] for data in recommended_data]
+
+    recommended_id = cached_recommendation(userprofile, state, difficulty.lower(), topk)
     preserved_order = models.Case(*[models.When(pk=pk, then=pos) for pos, pk in enumerate(recommended_id)])
     recommended_problems = Problem.objects.filter(id__in=recommended_id).order_by(preserved_order)
     return recommended_problems
 
 def tag_ranker (user) :
+    """
+    Problems ranked by the tags of the user's last solved problems, when
+    there is no embedding index to recommend from.
+    """
     user_profile = UserProfile.objects.filter(user=user).first()
-    
-    
-    user_tags = user_profile.tags.all()
+    if not user_profile:
+        return Problem.objects.none()
+
+    user_tags = Tag.objects.filter(problems__id__in=user_profile.last_5_solved_pids).distinct()
     if not user_tags:
         return Problem.objects.none()
     _problem = _tag_ranker(user_tags)
@@ -96,4 +65,5 @@ def _tag_ranker (tags):
         'difficulty',       
         '-submission_count',
         '-created_at'       
-    )
\ No newline at end of file
+    )
+    return problems
\ No newline at end of file
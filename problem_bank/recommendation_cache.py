@@ -0,0 +1,154 @@
+"""
+Cached recommendations, so the problem bank page is a cache read.
+
+A user's recommendations of a difficulty are cached (as problem ids) for
+RECOMMENDER_CACHE_TIMEOUT under a key made of what they are computed
+from: the user's last_5_solved_pids and the version of the embedding
+index. Solving a problem or regenerating the index changes the key, so a
+stale list is never read again; it just expires. The warmer fills the
+cache in the background for users who logged in within
+RECOMMENDER_ACTIVE_DAYS, every RECOMMENDER_WARM_INTERVAL seconds, so
+their next page view doesn't compute anything. Both it and the
+batch_recommend command compute many users' recommendations in one batch
+(see batch_rerank_recommendations). The cache is the shared one (CACHES
+in settings), so what one process computed every process reads: the
+warmers of several web processes skip the lists another one cached.
+"""
+import threading
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import OperationalError, connections
+from django.utils import timezone
+
+from recommender.recommendation import batch_rerank_recommendations, rerank_recommendations
+from recommender.state import get_state
+
+CACHE_TIMEOUT = getattr(settings, 'RECOMMENDER_CACHE_TIMEOUT', 60 * 60)
+WARM_INTERVAL = getattr(settings, 'RECOMMENDER_WARM_INTERVAL', 60.0)
+ACTIVE_DAYS = getattr(settings, 'RECOMMENDER_ACTIVE_DAYS', 7)
+DIFFICULTIES = ('easy', 'medium', 'hard')
+# users whose recommendations are computed together
+BATCH_SIZE = 256
+# recommendations shown on the problem bank page
+TOPK = 20
+
+
+def cache_key(user_id, solved, difficulty, topk, version):
+    solved = '-'.join(map(str, solved))
+    return f'recommendations:{user_id}:{difficulty}:{topk}:{solved}:{version[0]}-{version[1]}'
+
+
+def last_solved_rows(profile, state):
+    return [state.rows[pid] for pid in profile.last_5_solved_pids if pid in state.rows]
+
+
+def recommend_ids(profile, state, difficulty, topk=TOPK):
+    """
+    The ids of the topk problems of difficulty recommended to profile's user.
+    """
+    last_solved_indices = last_solved_rows(profile, state)
+    recommended = rerank_recommendations(
+        state,
+        last_solved_indices=last_solved_indices,
+        difficulty_filter=difficulty,
+        topk=topk
+    )
+    return [data['pid'] for data in recommended]
+
+
+def cached_recommendation(profile, state, difficulty, topk=TOPK):
+    """
+    recommend_ids() from the cache, computed and cached on a miss.
+    """
+    key = cache_key(profile.user_id, profile.last_5_solved_pids, difficulty, topk, state.version)
+    recommended = cache.get(key)
+    if recommended is None:
+        recommended = recommend_ids(profile, state, difficulty, topk)
+        cache.set(key, recommended, CACHE_TIMEOUT)
+    return recommended
+
+
+def cache_recommendations(profiles, state, topk=TOPK, missing_only=False, batch_size=BATCH_SIZE):
+    """
+    Compute and cache the recommendations of every difficulty for
+    profiles, batch_size users at a time. missing_only skips the ones
+    already cached. Returns how many were computed.
+    """
+    computed = 0
+    for difficulty in DIFFICULTIES:
+        # decoded once for all batches
+        rows = state.difficulty_rows.get(difficulty)
+        vectors = state.vectors_of(rows) if rows is not None else None
+        for start in range(0, len(profiles), batch_size):
+            batch = profiles[start:start + batch_size]
+            keys = [
+                cache_key(profile.user_id, profile.last_5_solved_pids, difficulty, topk, state.version)
+                for profile in batch
+            ]
+            cached = cache.get_many(keys) if missing_only else {}
+            todo = [i for i, key in enumerate(keys) if key not in cached]
+            if not todo:
+                continue
+            recommended = batch_rerank_recommendations(
+                state, [last_solved_rows(batch[i], state) for i in todo], difficulty, topk,
+                same_difficulty_vectors=vectors,
+            )
+            cache.set_many({keys[i]: ids for i, ids in zip(todo, recommended)}, CACHE_TIMEOUT)
+            computed += len(todo)
+    return computed
+
+
+def active_profiles():
+    from accounts.models import UserProfile
+
+    cutoff = timezone.now() - timedelta(days=ACTIVE_DAYS)
+    return UserProfile.objects.filter(user__last_login__gte=cutoff).only('user_id', 'last_5_solved_pids')
+
+
+class RecommendationWarmer:
+    def __init__(self, interval):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._timer = None
+
+    def start(self):
+        """
+        Warm the cache now and every interval seconds from now on, in a
+        background thread. Does nothing if it already runs (or interval is 0).
+        """
+        with self._lock:
+            if self.interval <= 0 or self._timer is not None:
+                return
+            self._schedule(0)
+
+    def _schedule(self, delay):
+        self._timer = threading.Timer(delay, self._run)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _run(self):
+        try:
+            self.warm()
+        except OperationalError:
+            pass  # database busy, the next run catches up
+        finally:
+            # this thread's own database connection
+            connections.close_all()
+            with self._lock:
+                self._schedule(self.interval)
+
+    def warm(self, profiles=None):
+        """
+        Cache the recommendations of every difficulty that aren't cached
+        yet for profiles (the active users'). Returns how many were computed.
+        """
+        state = get_state()
+        if state is None:
+            return 0
+        profiles = list(active_profiles() if profiles is None else profiles)
+        return cache_recommendations(profiles, state, missing_only=True)
+
+
+warmer = RecommendationWarmer(WARM_INTERVAL)
@@ -1,28 +1,168 @@
+import io
+import os
+import tempfile
+from datetime import timedelta
+from unittest import mock
+
+import faiss
+import numpy as np
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connections
 from django.test import TestCase
 from django.contrib.auth.models import User
+from django.utils import timezone
 from accounts.models import UserProfile
 from problem.models import Problem, Tag
-from problem_bank.recommend import tag_ranker
+from problem_bank import recommendation_cache
+from problem_bank.recommend import load_recommendation, tag_ranker
+from problem_bank.recommendation_cache import DIFFICULTIES, TOPK, cache_key, warmer
+from recommender import state as recommender_state
+from recommender.index_store import write_index
+from recommender.recommendation import rerank_recommendations
 
 class RecommendTestCase(TestCase):
     def setUp(self):
         self.user = User.objects.create(username="testuser")
-        self.user_profile = UserProfile.objects.create(user=self.user)
-        
+
         # Create Tags
         self.tag1 = Tag.objects.create(name="Dynamic Programming")
         self.tag2 = Tag.objects.create(name="Graphs")
+        self.tag3 = Tag.objects.create(name="Math")
 
         # Create Problems and associate them with Tags
-        self.problem1 = Problem.objects.create(title="Problem 1", creator=self.user)  # Set creator
-        self.problem2 = Problem.objects.create(title="Problem 2", creator=self.user)  # Set creator
+        self.solved = Problem.objects.create(title="Solved", creator=self.user)
+        self.problem1 = Problem.objects.create(title="Problem 1", creator=self.user)
+        self.problem2 = Problem.objects.create(title="Problem 2", creator=self.user)
+        self.problem3 = Problem.objects.create(title="Problem 3", creator=self.user)
+        self.solved.tags.add(self.tag1, self.tag2)
         self.problem1.tags.add(self.tag1)
-        self.problem2.tags.add(self.tag2)
-        
-        # Add a Tag to the UserProfile
-        self.user_profile.tags.add(self.tag1)
+        self.problem2.tags.add(self.tag1, self.tag2)
+        self.problem3.tags.add(self.tag3)
+
+        # The user's tags are the tags of their last solved problems
+        self.user_profile = UserProfile.objects.create(user=self.user, last_5_solved_pids=[self.solved.id])
 
     def test_recommend_problems_for_user(self):
-        recommended = tag_ranker(self.user)  # Pass self.user_profile
-        self.assertIn(self.problem1, recommended)
-        self.assertNotIn(self.problem2, recommended)
\ No newline at end of file
+        recommended = list(tag_ranker(self.user))
+        # most shared tags first, problems without any left out
+        self.assertEqual(set(recommended[:2]), {self.solved, self.problem2})
+        self.assertEqual(recommended[2:], [self.problem1])
+        self.assertNotIn(self.problem3, recommended)
+
+    def test_no_solved_problems(self):
+        self.user_profile.last_5_solved_pids = []
+        self.user_profile.save()
+        self.assertFalse(tag_ranker(self.user).exists())
+
+class CachedRecommendationTestCase(TestCase):
+    # the cache table lives in its own database
+    databases = {'default', 'cache'}
+
+    def setUp(self):
+        self.user = User.objects.create(username="cached", last_login=timezone.now())
+        self.profile = UserProfile.objects.create(user=self.user)
+        self.problems = [
+            Problem.objects.create(title=f"Problem {i}", difficulty="Easy", creator=self.user)
+            for i in range(4)
+        ]
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = os.path.join(tmp.name, 'problems.faiss')
+        self.write_index(4)
+
+        patcher = mock.patch.object(recommender_state, 'FAISS_INDEX_PATH', self.path)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        recommender_state.invalidate()
+        self.addCleanup(recommender_state.invalidate)
+        cache.clear()
+        self.addCleanup(cache.clear)
+
+    def write_index(self, count):
+        index = faiss.IndexIDMap2(faiss.IndexFlatL2(384))
+        index.add_with_ids(
+            np.eye(count, 384, dtype=np.float32),
+            np.array([p.id for p in self.problems[:count]], dtype=np.int64),
+        )
+        write_index(index, self.path)
+
+    def recommend(self):
+        with mock.patch.object(
+            recommendation_cache, 'rerank_recommendations', wraps=rerank_recommendations
+        ) as rerank:
+            recommended = list(load_recommendation(self.user, "Easy", topk=20))
+        return recommended, rerank.call_count
+
+    def test_cached_until_the_user_solves_or_the_index_changes(self):
+        recommended, computed = self.recommend()
+        self.assertEqual(computed, 1)
+        self.assertEqual(set(recommended), set(self.problems))
+        self.assertEqual(self.recommend(), (recommended, 0))
+
+        self.profile.last_5_solved_pids = [self.problems[0].id]
+        self.profile.save()
+        recommended, computed = self.recommend()
+        self.assertEqual(computed, 1)
+        self.assertEqual(self.recommend()[1], 0)
+
+        self.write_index(2)
+        recommended, computed = self.recommend()
+        self.assertEqual(computed, 1)
+        self.assertEqual(set(recommended), set(self.problems[:2]))
+
+    def test_warmer_fills_the_cache_of_active_users(self):
+        idle = User.objects.create(username="idle", last_login=timezone.now() - timedelta(days=30))
+        UserProfile.objects.create(user=idle)
+
+        self.assertEqual(warmer.warm(), len(DIFFICULTIES))
+        self.assertEqual(warmer.warm(), 0)
+        self.assertEqual(self.recommend()[1], 0)
+
+    def test_batch_recommend_caches_every_active_user(self):
+        other = User.objects.create(username="other", last_login=timezone.now())
+        UserProfile.objects.create(user=other, last_5_solved_pids=[self.problems[1].id])
+        call_command('batch_recommend', batch_size=1, stdout=io.StringIO())
+
+        version = recommender_state.get_state().version
+        self.assertEqual(
+            cache.get(cache_key(other.id, [self.problems[1].id], "easy", TOPK, version))[0],
+            self.problems[1].id,
+        )
+        # in the cache table every process reads, not in this process's memory
+        with connections["cache"].cursor() as cursor:
+            cursor.execute("SELECT COUNT(*) FROM django_cache")
+            self.assertEqual(cursor.fetchone()[0], 2 * len(DIFFICULTIES))
+        self.assertEqual(warmer.warm(), 0)
+
+
+class NoIndexTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="noindex", password="noindex")
+        dp = Tag.objects.create(name="dp")
+        self.solved = Problem.objects.create(title="Solved", difficulty="Easy", creator=self.user)
+        self.similar = Problem.objects.create(title="Similar", difficulty="Easy", creator=self.user)
+        self.other = Problem.objects.create(title="Other", difficulty="Easy", creator=self.user)
+        self.solved.tags.add(dp)
+        self.similar.tags.add(dp)
+        UserProfile.objects.create(user=self.user, last_5_solved_pids=[self.solved.id])
+
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        patcher = mock.patch.object(
+            recommender_state, 'FAISS_INDEX_PATH', os.path.join(tmp.name, 'problems.faiss')
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        recommender_state.invalidate()
+        self.addCleanup(recommender_state.invalidate)
+
+    def test_recommends_by_the_tags_of_solved_problems(self):
+        recommended = list(load_recommendation(self.user, "Easy"))
+        self.assertIn(self.similar, recommended)
+        self.assertNotIn(self.other, recommended)
+
+    @mock.patch.object(warmer, 'interval', 0)
+    def test_problem_bank_page(self):
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get('/').status_code, 200)
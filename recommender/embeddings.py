@@ -0,0 +1,132 @@
+"""
+Incremental problem embeddings.
+
+Every problem's embedding is made from its title, tags, difficulty and
+description; Problem.embedding_hash is the hash of that text (and the
+model). update_embeddings() only encodes the problems whose hash changed,
+in batches, writes them with bulk_update and patches the FAISS index,
+an IndexIDMap2 keyed by problem id, in place: changed vectors are
+replaced, deleted problems removed. Adding one problem costs one encode.
+Changing RECOMMENDER_VECTOR_DTYPE rebuilds the index from the stored
+embeddings without encoding anything. An int8 index is trained on the
+vectors it is built with; later vectors outside that range are clipped
+until the next full rebuild.
+"""
+import hashlib
+import os
+
+import faiss
+import numpy as np
+
+from .index_store import (
+    FAISS_INDEX_PATH, VECTOR_DTYPE, ManifestError, new_index, normalize, read_index,
+    read_manifest, write_index,
+)
+from .recommendation import EMBEDDING_DIM, MODEL_NAME
+
+BATCH_SIZE = 64
+
+_model = None
+
+
+def embedding_text(problem):
+    return (
+        f"Title: {problem.title}. Tags: {', '.join(problem.tags_list)}. "
+        f"Difficulty: {problem.difficulty}. Description: {problem.description}"
+    )
+
+
+def content_hash(text):
+    return hashlib.sha256(f"{MODEL_NAME}\n{text}".encode()).hexdigest()
+
+
+def encode(texts):
+    """
+    Embeddings of texts with the sentence transformer, loaded once.
+    """
+    global _model
+    if _model is None:
+        from sentence_transformers import SentenceTransformer
+
+        _model = SentenceTransformer(MODEL_NAME)
+    return _model.encode(texts, batch_size=BATCH_SIZE, convert_to_numpy=True)
+
+
+def update_embeddings(encode=encode, path=FAISS_INDEX_PATH, dim=EMBEDDING_DIM, full=False,
+                      batch_size=BATCH_SIZE, dtype=VECTOR_DTYPE):
+    """
+    Bring the problems' embeddings and the index at path up to date.
+    full re-encodes every problem. Returns the number of problems
+    {'encoded', 'removed', 'unchanged'}.
+    """
+    from problem.models import Problem
+
+    index = None
+    if not full:
+        try:
+            if read_manifest(path).get('dtype') == dtype:
+                index = read_index(path, dim=dim)
+        except (OSError, ManifestError):
+            pass  # none yet, or unusable: rebuilt from scratch
+    if index is None:
+        index = new_index(dim, dtype)
+    indexed = set(faiss.vector_to_array(index.id_map).tolist())
+
+    problems = Problem.objects.prefetch_related('tags').defer('embedding').order_by('id')
+    changed, texts, unindexed, ids = [], [], {}, set()
+    for problem in problems:
+        ids.add(problem.id)
+        text = embedding_text(problem)
+        text_hash = content_hash(text)
+        if full or problem.embedding_hash != text_hash:
+            problem.embedding_hash = text_hash
+            changed.append(problem)
+            texts.append(text)
+        elif problem.id not in indexed:
+            unindexed[problem.id] = (problem, text)
+
+    # unchanged problems missing from the index (a new dtype) keep their
+    # stored embedding, if they have one
+    vectors, vector_ids = [], []
+    pending = list(unindexed)
+    for start in range(0, len(pending), batch_size):
+        stored = Problem.objects.filter(id__in=pending[start:start + batch_size]) \
+            .values_list('id', 'embedding')
+        for pid, blob in stored:
+            vector = np.frombuffer(blob or b'', dtype=np.float32)
+            if len(vector) == dim:
+                vectors.append(vector.reshape(1, dim))
+                vector_ids.append(pid)
+            else:
+                problem, text = unindexed[pid]
+                changed.append(problem)
+                texts.append(text)
+
+    removed = indexed - ids
+    stale = removed | (indexed & {p.id for p in changed})
+    if stale:
+        index.remove_ids(np.fromiter(stale, dtype=np.int64))
+
+    for start in range(0, len(changed), batch_size):
+        batch = changed[start:start + batch_size]
+        encoded = np.ascontiguousarray(encode(texts[start:start + batch_size]), dtype=np.float32)
+        for problem, vector in zip(batch, encoded):
+            problem.embedding = vector.tobytes()
+        vectors.append(encoded)
+        vector_ids += [p.id for p in batch]
+
+    if vectors:
+        vectors = normalize(np.vstack(vectors))
+        if not index.is_trained:
+            index.train(vectors)
+        index.add_with_ids(vectors, np.array(vector_ids, dtype=np.int64))
+    if changed or removed or unindexed or not os.path.exists(path):
+        write_index(index, path, dtype=dtype)
+    # hashes only once the index has the vectors: if this is interrupted
+    # the next run encodes the problems again
+    Problem.objects.bulk_update(changed, ['embedding', 'embedding_hash'], batch_size=batch_size)
+    return {
+        'encoded': len(changed),
+        'removed': len(removed),
+        'unchanged': len(ids) - len(changed),
+    }
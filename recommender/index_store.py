@@ -0,0 +1,173 @@
+"""
+The FAISS index file and its manifest.
+
+The index is keyed by problem id (an IndexIDMap2, see embeddings.py), so
+inserting or deleting problems can't shift other problems' vectors. It
+holds unit length vectors, so L2 distance ranks like cosine similarity,
+stored as float32, float16 or int8 (RECOMMENDER_VECTOR_DTYPE, FAISS scalar
+quantizers). The index's codes are the only copy of the vectors: searches
+read them, and stored_vectors() hands the same memory to numpy for
+scoring (see state.py), decoded the way FAISS decodes them. Next to it,
+<index>.json is the manifest:
+    {"format", "model", "dim", "count", "dtype", "checksum", "stat"}
+read_index() refuses an index that doesn't match its manifest, or that was
+built by another model, instead of recommending from the wrong vectors.
+An index file with the size and mtime it was written with ("stat") isn't
+checksummed again, so loading a memory-mapped index takes milliseconds.
+"""
+import json
+import os
+import zlib
+
+import faiss
+import numpy as np
+from django.conf import settings
+
+from .recommendation import EMBEDDING_DIM, MODEL_NAME
+
+FAISS_INDEX_PATH = getattr(
+    settings, 'RECOMMENDER_INDEX_PATH',
+    os.path.join(settings.BASE_DIR, 'recommender', 'embedding', 'problems.faiss'),
+)
+VECTOR_DTYPE = getattr(settings, 'RECOMMENDER_VECTOR_DTYPE', 'float16')
+MANIFEST_FORMAT = 3
+
+# FAISS storage of each vector dtype, None for uncompressed
+QUANTIZERS = {
+    'float32': None,
+    'float16': faiss.ScalarQuantizer.QT_fp16,
+    'int8': faiss.ScalarQuantizer.QT_8bit,
+}
+
+
+class ManifestError(Exception):
+    pass
+
+
+def manifest_path(path):
+    return f"{path}.json"
+
+
+def checksum(path):
+    crc = 0
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            crc = zlib.crc32(chunk, crc)
+    return f"crc32:{crc:08x}"
+
+
+def _stat(path):
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def _unchanged(path, expected_checksum, expected_stat):
+    # a rename keeps the mtime, writing in place or copying doesn't
+    return _stat(path) == expected_stat or checksum(path) == expected_checksum
+
+
+def normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return np.divide(vectors, norms, out=np.zeros_like(vectors), where=norms > 0)
+
+
+def stored_vectors(index):
+    """
+    The vectors of an id-keyed index as stored, a read-only (rows, dim)
+    numpy view of its codes (no copy; valid as long as the index is):
+    float32 or float16, or the uint8 codes of an int8 index. For those,
+    also the per dimension scale and offset turning codes back into
+    values (codes * scale + offset), None for float types.
+    """
+    inner = faiss.downcast_index(index.index)
+    codes = faiss.rev_swig_ptr(inner.codes.data(), inner.ntotal * inner.code_size) \
+        if inner.ntotal else np.empty(0, dtype=np.uint8)
+    codes.flags.writeable = False
+    if isinstance(inner, faiss.IndexFlat):
+        return codes.view(np.float32).reshape(-1, inner.d), None, None
+    if inner.sq.qtype == faiss.ScalarQuantizer.QT_fp16:
+        return codes.view(np.float16).reshape(-1, inner.d), None, None
+    if inner.sq.qtype != faiss.ScalarQuantizer.QT_8bit:
+        raise ManifestError(f"unsupported quantizer {inner.sq.qtype}")
+    # QT_8bit: a code c of dimension j is vmin[j] + (c + 0.5) / 255 * vdiff[j]
+    vmin, vdiff = faiss.vector_to_array(inner.sq.trained).reshape(2, inner.d)
+    scale = vdiff / 255
+    return codes.reshape(-1, inner.d), scale, vmin + 0.5 * scale
+
+
+def new_index(dim=EMBEDDING_DIM, dtype=VECTOR_DTYPE):
+    """
+    An empty index for dtype vectors. int8 has to be trained before
+    vectors are added.
+    """
+    quantizer = QUANTIZERS[dtype]
+    if quantizer is None:
+        return faiss.IndexIDMap2(faiss.IndexFlatL2(dim))
+    return faiss.IndexIDMap2(faiss.IndexScalarQuantizer(dim, quantizer, faiss.METRIC_L2))
+
+
+def _write_aside(path, write, mode='wb'):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, mode) as f:
+        write(f)
+    return tmp_path
+
+
+def write_index(index, path=FAISS_INDEX_PATH, model=MODEL_NAME, dtype=VECTOR_DTYPE):
+    """
+    Write the index and its manifest. Both are written aside and renamed, so running servers never read a half written file
+    (they reload the index when it changes).
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_index = _write_aside(path, lambda f: faiss.write_index(index, faiss.PyCallbackIOWriter(f.write)))
+    manifest = {
+        'format': MANIFEST_FORMAT,
+        'model': model,
+        'dim': index.d,
+        'count': index.ntotal,
+        'dtype': dtype,
+        'checksum': checksum(tmp_index),
+        'stat': _stat(tmp_index),
+    }
+    tmp_manifest = _write_aside(manifest_path(path), lambda f: json.dump(manifest, f), 'w')
+    os.replace(tmp_index, path)
+    os.replace(tmp_manifest, manifest_path(path))
+
+
+def read_manifest(path=FAISS_INDEX_PATH):
+    """
+    The manifest of the index at path. Raises OSError if there is none.
+    """
+    try:
+        with open(manifest_path(path)) as f:
+            manifest = json.load(f)
+    except ValueError as e:
+        raise ManifestError(f"unreadable manifest: {e}") from e
+    if manifest.get('format') != MANIFEST_FORMAT:
+        raise ManifestError(f"manifest format {manifest.get('format')}, expected {MANIFEST_FORMAT}")
+    return manifest
+
+
+def read_index(path=FAISS_INDEX_PATH, mmap=False, model=MODEL_NAME, dim=EMBEDDING_DIM):
+    """
+    The id-keyed index at path, checked against its manifest. Raises OSError if there is none,
+    ManifestError if they don't match.
+    """
+    manifest = read_manifest(path)
+    if manifest.get('model') != model or manifest.get('dim') != dim:
+        raise ManifestError(
+            f"index of {manifest.get('model')} ({manifest.get('dim')}d), expected {model} ({dim}d)"
+        )
+    if not _unchanged(path, manifest.get('checksum'), manifest.get('stat')):
+        raise ManifestError("index doesn't match its manifest")
+
+    try:
+        index = faiss.read_index(path, faiss.IO_FLAG_MMAP_IFC | faiss.IO_FLAG_READ_ONLY if mmap else 0)
+    except (RuntimeError, ValueError) as e:
+        raise ManifestError(f"unreadable index: {e}") from e
+    if not isinstance(index, faiss.IndexIDMap2):
+        raise ManifestError("index isn't keyed by problem id")
+    if index.d != dim or index.ntotal != manifest.get('count'):
+        raise ManifestError("index doesn't match its manifest")
+    return index
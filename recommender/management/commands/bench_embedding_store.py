@@ -0,0 +1,79 @@
+import os
+import tempfile
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from recommender.index_store import (
+    QUANTIZERS, new_index, normalize, read_index, stored_vectors, write_index
+)
+from recommender.recommendation import EMBEDDING_DIM
+
+
+def _catalogue(problems, dim, seed=0):
+    """
+    Unit length vectors in clusters, like embeddings of problems on a
+    handful of topics, ids from 1.
+    """
+    rng = np.random.default_rng(seed)
+    centres = rng.standard_normal((max(1, problems // 500), dim)).astype(np.float32)
+    vectors = centres[rng.integers(len(centres), size=problems)]
+    vectors += 0.5 * rng.standard_normal((problems, dim)).astype(np.float32)
+    return normalize(vectors), np.arange(1, problems + 1, dtype=np.int64)
+
+
+def _recall(found, truth):
+    return np.mean([len(set(f) & set(t)) / len(t) for f, t in zip(found.tolist(), truth.tolist())])
+
+
+class Command(BaseCommand):
+    help = 'Compares the size, load time, search time and recall of the index vector dtypes.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--problems', type=int, default=100_000)
+        parser.add_argument('--dim', type=int, default=EMBEDDING_DIM)
+        parser.add_argument('--queries', type=int, default=200)
+        parser.add_argument('--k', type=int, default=20)
+        parser.add_argument('--dtypes', nargs='+', choices=sorted(QUANTIZERS),
+                            default=['float32', 'float16', 'int8'])
+
+    def handle(self, *args, **options):
+        dim, k = options['dim'], options['k']
+        vectors, ids = _catalogue(options['problems'], dim)
+        rng = np.random.default_rng(1)
+        queries = vectors[rng.integers(len(vectors), size=options['queries'])]
+        # exact neighbours, and scores as the reranker computes them
+        truth = ids[np.argsort(-(queries @ vectors.T), axis=1)[:, :k]]
+        exact_scores = queries @ vectors[:1000].T
+
+        self.stdout.write(
+            f"{'dtype':>8} {'index MB':>9} {'load ms':>8} "
+            f"{'search ms':>10} {f'recall@{k}':>10} {'score err':>10}"
+        )
+        with tempfile.TemporaryDirectory() as tmp:
+            for dtype in options['dtypes']:
+                path = os.path.join(tmp, f'{dtype}.faiss')
+                index = new_index(dim, dtype)
+                index.train(vectors)
+                index.add_with_ids(vectors, ids)
+                write_index(index, path, dtype=dtype)
+                del index
+
+                started = time.perf_counter()
+                index = read_index(path, mmap=True, dim=dim)
+                matrix, scale, offset = stored_vectors(index)
+                load = time.perf_counter() - started
+
+                started = time.perf_counter()
+                _, found = index.search(queries, k)
+                search = (time.perf_counter() - started) / len(queries)
+
+                stored = matrix[:1000].astype(np.float32)
+                if scale is not None:
+                    stored = stored * scale + offset
+                error = np.abs(queries @ stored.T - exact_scores).max()
+                self.stdout.write(
+                    f"{dtype:>8} {os.path.getsize(path) / 1e6:>9.1f} {load * 1e3:>8.1f} "
+                    f"{search * 1e3:>10.2f} {_recall(found, truth):>10.3f} {error:>10.4f}"
+                )
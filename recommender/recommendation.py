@@ -2,11 +2,14 @@ from typing import List, Dict
 
 import numpy as np
 import faiss
+from django.conf import settings
 
 np.random.seed(42)
 
 MODEL_NAME = "all-MiniLM-L6-v2"
 EMBEDDING_DIM = 384 
+# candidates scored per recommendation
+CANDIDATE_POOL = getattr(settings, 'RECOMMENDER_CANDIDATES', 1000)
 
 problems = []
 
@@ -22,6 +25,35 @@ def get_similar_by_embedding(query_embedding: np.ndarray, faiss_index, topk: int
     return indices[0].tolist()
 
 
+def search_by_difficulty(state, query_embedding: np.ndarray, difficulty: str, k: int) -> np.ndarray:
+    """
+    The k rows of the given difficulty nearest to query_embedding, nearest
+    first. FAISS only visits rows of that difficulty; an index that can't
+    filter is searched with a k doubled until k of them survive.
+    """
+    rows = state.difficulty_rows.get(difficulty)
+    if rows is None:
+        return np.empty(0, dtype=np.int64)
+    k = min(k, len(rows))
+    query = query_embedding.reshape(1, -1)
+
+    try:
+        params = faiss.SearchParameters(sel=state.difficulty_selectors[difficulty])
+        _, found = state.index.search(query, k, params=params)
+        return state.rows_of(found[0])
+    except RuntimeError:
+        pass  # no search parameters for this index type
+
+    wanted, matches = k, state.difficulties == difficulty
+    while True:
+        _, found = state.index.search(query, k)
+        found = state.rows_of(found[0])
+        hits = found[matches[found]]
+        if len(hits) >= wanted or k >= state.index.ntotal:
+            return hits[:wanted]
+        k = min(2 * k, state.index.ntotal)
+
+
 def compute_tag_score(candidate_tags: List[str], reference_tags: List[str]) -> float:
     """
     Compute normalized tag overlap score.
@@ -36,77 +68,144 @@ def compute_tag_score(candidate_tags: List[str], reference_tags: List[str]) -> f
 score = compute_tag_score(['dp', 'graph'], ['dp', 'array', 'graph'])
 
 def rerank_recommendations(
+    state,
     last_solved_indices: List[int],
     difficulty_filter: str,
-    problems: List[Dict],
-    faiss_index,
-    topk: int = 20
+    topk: int = 20,
+    pool: int = CANDIDATE_POOL
 ) -> List[Dict]:
     """
     Rerank problems using:
       40%: embedding similarity to last 2 solved
       60%: tag overlap with last 5 solved
     Only recommend problems matching difficulty_filter.
+
+    The pool problems of that difficulty nearest to the last 2 solved
+    (see search_by_difficulty) are scored together:
+    similarities as one product with the unit length vectors, tag
+    overlaps as one with the tag matrix of the RecommenderState, and only
+    the topk best are sorted.
     """
-    # Part A: Getting avg embedding of last 2 solved,
-    if len(last_solved_indices) >= 2:
-        last_2 = last_solved_indices[-2:]
-    elif len(last_solved_indices) == 1:
-        last_2 = last_solved_indices
+    # Part A: Getting avg embedding of last 2 solved, and the candidates:
+    # problems of the wanted difficulty only
+    last_2 = last_solved_indices[-2:]
+    same_difficulty = state.difficulty_rows.get(difficulty_filter, np.empty(0, dtype=np.int64))
+    if last_2:
+        avg_embedding = state.vectors_of(last_2).mean(axis=0)
+        if pool < len(same_difficulty):
+            candidates = search_by_difficulty(state, avg_embedding, difficulty_filter, pool)
+        else:
+            candidates = same_difficulty
     else:
-        last_2 = []
+        # No history → use the first problems as candidates
+        candidates = same_difficulty[:pool]
 
+    # embedding similarity score - 40%
     if last_2:
-        avg_embedding = np.mean(
-            [problems[i]['embedding'] for i in last_2],
-            axis=0
-        ).astype('float32')
-        # Get 10 most similar by embedding
-        candidate_indices = get_similar_by_embedding(avg_embedding, faiss_index, topk=10)
+        norm = np.linalg.norm(avg_embedding)
+        direction = avg_embedding / norm if norm > 0 else avg_embedding
+        similarity = np.clip(state.vectors_of(candidates) @ direction, 0.0, 1.0)  # \in [0,1]
     else:
-        # No history → use first 10 problems as candidates
-        candidate_indices = list(range(min(10, len(problems))))
-
-    # Part B: Collect tags from last 5 solved,
-    last_5   = last_solved_indices[-5:] if len(last_solved_indices) >= 5 else last_solved_indices
-    reference_tags = []
-    for idx in last_5:
-        reference_tags.extend(problems[idx]['tags'])
-
-    # Part C: Scoring
-    scored_candidates = []
-
-    for idx in candidate_indices:
-        prob = problems[idx]
-        if prob['difficulty'] != difficulty_filter:
-            continue  # skip =/= diffaclty
-
-        # embedding similarity score - 40%
-        if last_2:
-            candidate_emb = prob['embedding']
-            cos_sim = np.dot(candidate_emb, avg_embedding) / (
-                np.linalg.norm(candidate_emb) * np.linalg.norm(avg_embedding) + 1e-6
-            )
-            similarity_score = max(0.0, min(1.0, cos_sim))  # \in [0,1]
-        else:
-            similarity_score = 0.5  # or neutral
-
-        # Compute tag score - 60%
-        tag_score = compute_tag_score(prob['tags'], reference_tags)
-
-        # Combine
-        score = 0.4 * similarity_score + 0.6 * tag_score
-
-        scored_candidates.append({
-            'pid': prob['id'],
-            'index': idx,
-            'score': score,
-            'similarity_score': similarity_score,
-            'tag_score': tag_score,
-            'tags': prob['tags'],
-            'difficulty': prob['difficulty']
-        })
-
-    # Sort by final score (descending)
-    scored_candidates.sort(key=lambda x: x['score'], reverse=True)
-    return scored_candidates[:topk]
\ No newline at end of file
+        similarity = np.full(len(candidates), 0.5, dtype=np.float32)  # or neutral
+
+    # Part B: tag score - 60%, the share of the last 5 solved's tags
+    # (repeats counted) that a candidate has
+    reference = state.tag_matrix[last_solved_indices[-5:]]
+    reference_count = reference.sum()
+    if reference_count:
+        tag_score = state.tag_matrix[candidates] @ (reference.max(axis=0) / reference_count)
+    else:
+        tag_score = np.zeros(len(candidates), dtype=np.float32)
+
+    # Part C: Combine, best topk first
+    score = 0.4 * similarity + 0.6 * tag_score
+    if topk < len(candidates):
+        best = np.argpartition(-score, topk - 1)[:topk]
+    else:
+        best = np.arange(len(candidates))
+    best = best[np.argsort(-score[best], kind='stable')]
+
+    return [
+        {
+            'pid': int(state.ids[row]),
+            'index': int(row),
+            'score': float(score[i]),
+            'similarity_score': float(similarity[i]),
+            'tag_score': float(tag_score[i]),
+            'tags': state.tags[row],
+            'difficulty': str(state.difficulties[row])
+        }
+        for i, row in zip(best.tolist(), candidates[best].tolist())
+    ]
+
+
+def batch_rerank_recommendations(
+    state,
+    last_solved: List[List[int]],
+    difficulty_filter: str,
+    topk: int = 20,
+    pool: int = CANDIDATE_POOL,
+    same_difficulty_vectors: np.ndarray = None
+) -> List[List[int]]:
+    """
+    rerank_recommendations for many users at once, last_solved holding
+    each user's last_solved_indices. Returns each user's recommended
+    problem ids, best first. same_difficulty_vectors are the float32
+    vectors of the difficulty's rows, for callers scoring many batches
+    of one difficulty to decode them once.
+
+    The users' query vectors are stacked and scored against every problem
+    of the difficulty with one matrix product, which also yields their
+    nearest pool candidates (the index is exhaustive, so a search would
+    visit the same vectors); the scores of all users' candidates are
+    computed as matrices.
+    """
+    same_difficulty = state.difficulty_rows.get(difficulty_filter, np.empty(0, dtype=np.int64))
+    width = min(pool, len(same_difficulty))
+    if not last_solved or not width:
+        return [[] for _ in last_solved]
+
+    # Part A: a query per user with history, and every user's candidates
+    # (the first problems of the difficulty without history)
+    candidates = np.tile(same_difficulty[:width], (len(last_solved), 1))
+    similarity = np.full(candidates.shape, 0.5, dtype=np.float32)
+    users = np.array([i for i, rows in enumerate(last_solved) if rows], dtype=np.int64)
+    if len(users):
+        last_2 = np.full((len(users), 2), -1, dtype=np.int64)
+        for i, user in enumerate(users.tolist()):
+            rows = last_solved[user][-2:]
+            last_2[i, 2 - len(rows):] = rows
+        known = last_2 >= 0
+        vectors = state.vectors_of(np.maximum(last_2, 0).ravel()).reshape(len(users), 2, -1)
+        queries = (vectors * known[:, :, None]).sum(axis=1) / known.sum(axis=1, keepdims=True)
+        norms = np.linalg.norm(queries, axis=1)
+
+        # for unit length vectors, the nearest are the largest dot products
+        if same_difficulty_vectors is None:
+            same_difficulty_vectors = state.vectors_of(same_difficulty)
+        dots = queries @ same_difficulty_vectors.T
+        if width < len(same_difficulty):
+            nearest = np.argpartition(-dots, width - 1, axis=1)[:, :width]
+            candidates[users] = same_difficulty[nearest]
+            dots = np.take_along_axis(dots, nearest, axis=1)
+        direction = np.where(norms > 0, norms, 1)[:, None]
+        similarity[users] = np.clip(dots / direction, 0.0, 1.0)
+
+    # Part B: tag score, each user's tag weights against their candidates' tags
+    weights = np.zeros((len(last_solved), state.tag_matrix.shape[1]), dtype=np.float32)
+    for user, rows in enumerate(last_solved):
+        reference = state.tag_matrix[rows[-5:]]
+        if reference.sum():
+            weights[user] = reference.max(axis=0) / reference.sum()
+    tag_score = np.einsum('uct,ut->uc', state.tag_matrix[candidates], weights)
+
+    # Part C: combine, each user's best topk first
+    score = 0.4 * similarity + 0.6 * tag_score
+    if topk < width:
+        best = np.argpartition(-score, topk - 1, axis=1)[:, :topk]
+    else:
+        best = np.tile(np.arange(width), (len(last_solved), 1))
+    order = np.argsort(-np.take_along_axis(score, best, axis=1), axis=1, kind='stable')
+    best = np.take_along_axis(best, order, axis=1)
+
+    return state.ids[np.take_along_axis(candidates, best, axis=1)].tolist()
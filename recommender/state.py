@@ -0,0 +1,151 @@
+"""
+Recommender state shared by every request of the process.
+
+Recommending used to read the FAISS index from disk, decode every
+problem's embedding blob and run a tag query per problem on each problem
+bank page view. RecommenderState holds all of it, built once: the index
+(keyed by problem id, see index_store.py), its unit length vectors,
+problem id <-> row maps, difficulties and tags, with row i of each being
+row i of the index. The vectors are the index's own codes, viewed as a
+numpy matrix (see stored_vectors()): they are stored once, and scoring
+reads exactly what the search reads.
+
+get_state() rebuilds it when the index file changes (the embeddings were
+regenerated) and swaps it in as one reference, so a request keeps using
+the state it started with. Problem edits are picked up with the next
+regeneration (or invalidate()). With RECOMMENDER_MMAP_INDEX the index is
+memory-mapped instead of read, and the pages are shared between processes.
+"""
+import os
+import threading
+from collections import defaultdict
+
+import faiss
+import numpy as np
+from django.conf import settings
+
+from .index_store import FAISS_INDEX_PATH, ManifestError, read_index, stored_vectors
+from .recommendation import EMBEDDING_DIM
+
+MMAP_INDEX = getattr(settings, 'RECOMMENDER_MMAP_INDEX', True)
+
+
+class RecommenderState:
+    def __init__(self, index, ids, vectors, difficulties, tags, version=None, scale=None, offset=None):
+        self.index = index
+        self.ids = ids                    # row -> problem id, what searches return
+        self.rows = {pid: row for row, pid in enumerate(ids.tolist())}
+        self._order = np.argsort(ids)
+        self.vectors = vectors            # (rows, dim) float32, float16 or uint8 codes
+        self.scale = scale                # per dimension, codes -> values (None for floats)
+        self.offset = offset
+        self.difficulties = difficulties  # row -> lowercased difficulty
+        self.tags = tags                  # row -> list of tag names
+        self.version = version            # (mtime, size) of the index file
+        # for scoring (see recommendation.py): a row -> tag indicator matrix
+        # over the tag names in tag_columns
+        self.tag_columns = {name: col for col, name in enumerate(sorted({t for ts in tags for t in ts}))}
+        self.tag_matrix = np.zeros((len(ids), len(self.tag_columns)), dtype=np.uint8)
+        for row, names in enumerate(tags):
+            self.tag_matrix[row, [self.tag_columns[name] for name in names]] = 1
+        # rows of each difficulty, and FAISS selectors restricting a search to them
+        self.difficulty_rows = {
+            difficulty: np.flatnonzero(difficulties == difficulty)
+            for difficulty in np.unique(difficulties).tolist()
+        }
+        self.difficulty_selectors = {
+            difficulty: faiss.IDSelectorBatch(ids[rows])
+            for difficulty, rows in self.difficulty_rows.items()
+        }
+
+    def __len__(self):
+        return len(self.ids)
+
+    def vectors_of(self, rows):
+        """
+        The float32 vectors of rows.
+        """
+        vectors = self.vectors[rows].astype(np.float32)
+        if self.scale is not None:
+            vectors *= self.scale
+            vectors += self.offset
+        return vectors
+
+    def rows_of(self, labels):
+        """
+        The rows of the problem ids returned by an index search.
+        """
+        labels = labels[labels >= 0]
+        if not len(self.ids):
+            return labels[:0]
+        positions = np.minimum(np.searchsorted(self.ids, labels, sorter=self._order), len(self.ids) - 1)
+        rows = self._order[positions]
+        return rows[self.ids[rows] == labels]
+
+    @classmethod
+    def load(cls, path=FAISS_INDEX_PATH, mmap=MMAP_INDEX, dim=EMBEDDING_DIM):
+        """
+        Read the index at path, and the difficulties and tags of its problems.
+        Raises OSError if there is no index, ManifestError if it isn't usable.
+        """
+        from problem.models import Problem
+
+        stat = os.stat(path)
+        index = read_index(path, mmap=mmap, dim=dim)
+        vectors, scale, offset = stored_vectors(index)
+        ids = faiss.vector_to_array(index.id_map).astype(np.int64)
+
+        # problems deleted since the index was written have no difficulty,
+        # so they never match a filter
+        by_id = dict(Problem.objects.values_list('id', 'difficulty'))
+        difficulties = np.array([(by_id.get(pid) or "").lower() for pid in ids.tolist()])
+        names = defaultdict(list)
+        for pid, name in Problem.tags.through.objects.values_list('problem_id', 'tag__name'):
+            names[pid].append(name)
+        tags = [names[pid] for pid in ids.tolist()]
+
+        return cls(index, ids, vectors, difficulties, tags, (stat.st_mtime_ns, stat.st_size), scale, offset)
+
+
+_state = None
+_lock = threading.Lock()
+
+
+def _index_version(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def get_state():
+    """
+    The current recommender state, None if there is no index to load.
+    """
+    global _state
+    state = _state
+    version = _index_version(FAISS_INDEX_PATH)
+    if state is not None and state.version == version:
+        return state
+    if version is None:
+        return None
+
+    with _lock:
+        # another request may have loaded it meanwhile
+        if _state is not None and _state.version == version:
+            return _state
+        try:
+            _state = RecommenderState.load(FAISS_INDEX_PATH)
+        except (OSError, ManifestError):
+            return None
+        return _state
+
+
+def invalidate():
+    """
+    Drop the state, the next get_state() loads it again.
+    """
+    global _state
+    with _lock:
+        _state = None
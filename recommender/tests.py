@@ -1,3 +1,247 @@
-from django.test import TestCase
+import hashlib
+import os
+import tempfile
+from unittest import mock
 
-# Create your tests here.
+import faiss
+import numpy as np
+from django.contrib.auth.models import User
+from django.test import SimpleTestCase, TestCase
+
+from problem.models import Problem, Tag
+from recommender import state as recommender_state
+from recommender.embeddings import update_embeddings
+from recommender.index_store import (
+    ManifestError, new_index, normalize, read_manifest, stored_vectors, write_index
+)
+from recommender.recommendation import (
+    MODEL_NAME, batch_rerank_recommendations, compute_tag_score, rerank_recommendations,
+    search_by_difficulty
+)
+from recommender.state import RecommenderState, get_state
+
+
+class RecommenderStateTestCase(TestCase):
+    def setUp(self):
+        user = User.objects.create_user(username="recommender", password="recommender")
+        dp = Tag.objects.create(name="dp")
+        self.embeddings = np.eye(3, 384, dtype=np.float32)
+        self.problems = []
+        for i, difficulty in enumerate(["Easy", "Hard", "Easy"]):
+            problem = Problem.objects.create(
+                title=f"Problem {i}", description="", difficulty=difficulty, creator=user,
+                embedding=self.embeddings[i].tobytes(),
+            )
+            self.problems.append(problem)
+        self.problems[1].tags.add(dp)
+
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = os.path.join(tmp.name, 'problems.faiss')
+        self.write_index(self.embeddings)
+
+        patcher = mock.patch.object(recommender_state, 'FAISS_INDEX_PATH', self.path)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        recommender_state.invalidate()
+        self.addCleanup(recommender_state.invalidate)
+
+    def write_index(self, embeddings, model=MODEL_NAME):
+        index = new_index(embeddings.shape[1])
+        ids = np.array([p.id for p in self.problems[:len(embeddings)]], dtype=np.int64)
+        index.add_with_ids(embeddings, ids)
+        write_index(index, self.path, model=model)
+
+    def test_loads_rows_in_index_order(self):
+        state = RecommenderState.load(self.path, mmap=True)
+        self.assertEqual(state.ids.tolist(), [p.id for p in self.problems])
+        # the index's own codes, not a copy
+        self.assertFalse(state.vectors.flags.owndata)
+        self.assertFalse(state.vectors.flags.writeable)
+        self.assertEqual(state.vectors.dtype, np.float16)
+        np.testing.assert_array_equal(state.vectors_of(np.arange(3)), self.embeddings)
+        self.assertEqual(state.difficulties.tolist(), ["easy", "hard", "easy"])
+        self.assertEqual(state.tags, [[], ["dp"], []])
+        self.assertEqual(state.rows[self.problems[2].id], 2)
+
+    def test_loaded_once_and_swapped_when_the_index_changes(self):
+        state = get_state()
+        with mock.patch.object(RecommenderState, 'load') as load:
+            self.assertIs(get_state(), state)
+        load.assert_not_called()
+
+        self.write_index(self.embeddings[:2])
+        new_state = get_state()
+        self.assertIsNot(new_state, state)
+        self.assertEqual(new_state.index.ntotal, 2)
+
+    def test_index_must_match_its_manifest(self):
+        with open(self.path, 'r+b') as f:
+            f.seek(-4, os.SEEK_END)
+            f.write(b'\xff' * 4)
+        with self.assertRaisesMessage(ManifestError, "doesn't match"):
+            RecommenderState.load(self.path)
+        self.assertIsNone(get_state())
+
+        self.write_index(self.embeddings, model="another-model")
+        with self.assertRaisesMessage(ManifestError, "another-model"):
+            RecommenderState.load(self.path)
+
+    def test_no_index(self):
+        os.remove(self.path)
+        self.assertIsNone(get_state())
+
+
+class RerankTestCase(SimpleTestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.vectors = normalize(rng.random((200, 8), dtype=np.float32))
+        index = faiss.IndexIDMap2(faiss.IndexFlatL2(8))
+        index.add_with_ids(self.vectors, np.arange(1000, 1200))
+        names = ["dp", "graph", "greedy", "math"]
+        tags = [[n for n in names if rng.random() < 0.4] for _ in range(200)]
+        difficulties = np.array([rng.choice(["easy", "medium", "hard"]) for _ in range(200)])
+        self.state = RecommenderState(
+            index, np.arange(1000, 1200), self.vectors, difficulties, tags
+        )
+
+    def expected(self, solved, difficulty, topk):
+        # the scoring, one candidate at a time
+        state = self.state
+        avg = self.vectors[solved[-2:]].mean(axis=0)
+        reference_tags = [t for row in solved[-5:] for t in state.tags[row]]
+        scored = []
+        for row in range(len(state)):
+            if state.difficulties[row] != difficulty:
+                continue
+            emb = self.vectors[row]
+            cos = np.dot(emb, avg) / (np.linalg.norm(emb) * np.linalg.norm(avg))
+            tag_score = compute_tag_score(state.tags[row], reference_tags)
+            scored.append((0.4 * max(0.0, min(1.0, cos)) + 0.6 * tag_score, row))
+        scored.sort(key=lambda s: -s[0])
+        return scored[:topk]
+
+    def test_matches_per_candidate_scoring(self):
+        solved = [3, 17, 42, 99, 150]
+        recommended = rerank_recommendations(self.state, solved, "medium", topk=10, pool=200)
+        expected = self.expected(solved, "medium", 10)
+
+        self.assertEqual([r['index'] for r in recommended], [row for _, row in expected])
+        np.testing.assert_allclose([r['score'] for r in recommended], [s for s, _ in expected], rtol=1e-5)
+        self.assertEqual(recommended[0]['pid'], 1000 + expected[0][1])
+
+    def test_candidates_are_the_nearest_of_the_difficulty(self):
+        recommended = rerank_recommendations(self.state, [5], "easy", topk=5, pool=20)
+        easy = np.flatnonzero(self.state.difficulties == "easy")
+        distances = ((self.vectors[easy] - self.vectors[5]) ** 2).sum(axis=1)
+        nearest_easy = set(easy[np.argsort(distances)[:20]].tolist())
+
+        self.assertEqual(len(recommended), 5)
+        self.assertTrue({r['index'] for r in recommended} <= nearest_easy)
+
+    def test_widens_k_on_indexes_without_filtering(self):
+        self.state.index = faiss.IndexIDMap2(faiss.IndexLSH(8, 64))
+        self.state.index.add_with_ids(self.vectors, self.state.ids)
+        found = search_by_difficulty(self.state, self.vectors[5], "hard", 30)
+
+        self.assertEqual(len(found), 30)
+        self.assertTrue(all(self.state.difficulties[found] == "hard"))
+
+    def test_batch_matches_one_user_at_a_time(self):
+        last_solved = [[3, 17, 42, 99, 150], [5], [], [60, 61], [7, 8, 9]]
+        for pool in (20, 200):
+            recommended = batch_rerank_recommendations(self.state, last_solved, "hard", topk=10, pool=pool)
+            decoded = self.state.vectors_of(self.state.difficulty_rows["hard"])
+            self.assertEqual(recommended, batch_rerank_recommendations(
+                self.state, last_solved, "hard", topk=10, pool=pool, same_difficulty_vectors=decoded
+            ))
+            self.assertEqual(recommended, [
+                [r['pid'] for r in rerank_recommendations(self.state, rows, "hard", topk=10, pool=pool)]
+                for rows in last_solved
+            ])
+
+    def test_quantized_vectors_score_alike(self):
+        solved = [3, 17, 42, 99, 150]
+        exact = rerank_recommendations(self.state, solved, "medium", topk=10, pool=200)
+        for dtype in ("float16", "int8"):
+            index = new_index(8, dtype)
+            index.train(self.vectors)
+            index.add_with_ids(self.vectors, self.state.ids)
+            self.state.index = index
+            self.state.vectors, self.state.scale, self.state.offset = stored_vectors(index)
+            np.testing.assert_allclose(self.state.vectors_of(np.arange(200)), self.vectors, atol=0.01)
+            recommended = rerank_recommendations(self.state, solved, "medium", topk=10, pool=200)
+            np.testing.assert_allclose(
+                [r['score'] for r in recommended], [r['score'] for r in exact], atol=0.01
+            )
+
+
+class UpdateEmbeddingsTestCase(TestCase):
+    def setUp(self):
+        user = User.objects.create_user(username="embedder", password="embedder")
+        self.problems = [
+            Problem.objects.create(title=f"Problem {i}", description="", difficulty="Easy", creator=user)
+            for i in range(3)
+        ]
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = os.path.join(tmp.name, 'problems.faiss')
+        self.encoded = []
+
+    def encode(self, texts):
+        # stands in for the sentence transformer: a fixed vector per text
+        self.encoded += texts
+        return np.array([
+            np.frombuffer(hashlib.sha256(text.encode()).digest()[:8], dtype=np.uint8)
+            for text in texts
+        ], dtype=np.float32)
+
+    def update(self, **kwargs):
+        return update_embeddings(encode=self.encode, path=self.path, dim=8, batch_size=2, **kwargs)
+
+    def indexed_ids(self):
+        index = faiss.read_index(self.path)
+        return sorted(faiss.vector_to_array(index.id_map).tolist())
+
+    def test_only_new_and_changed_problems_are_encoded(self):
+        self.assertEqual(self.update(), {'encoded': 3, 'removed': 0, 'unchanged': 0})
+        self.assertEqual(self.indexed_ids(), [p.id for p in self.problems])
+        self.assertEqual(self.update(), {'encoded': 0, 'removed': 0, 'unchanged': 3})
+        self.assertEqual(len(self.encoded), 3)
+
+        self.problems[1].title = "Renamed"
+        self.problems[1].save()
+        self.problems[2].delete()
+        self.assertEqual(self.update(), {'encoded': 1, 'removed': 1, 'unchanged': 1})
+        self.assertIn("Title: Renamed", self.encoded[-1])
+        self.assertEqual(self.indexed_ids(), [p.id for p in self.problems[:2]])
+
+        problem = Problem.objects.get(id=self.problems[1].id)
+        index = faiss.read_index(self.path)
+        embedding = np.frombuffer(problem.embedding, dtype=np.float32)
+        np.testing.assert_allclose(
+            index.reconstruct(problem.id), normalize(embedding[None])[0], atol=1e-3
+        )
+
+    def test_state_of_an_id_keyed_index(self):
+        self.update()
+        state = RecommenderState.load(self.path, dim=8)
+        row = state.rows[self.problems[2].id]
+        _, found = state.index.search(state.vectors_of([row]), 1)
+        self.assertEqual(state.rows_of(found[0]).tolist(), [row])
+
+    def test_changing_the_dtype_rebuilds_without_encoding(self):
+        self.update()
+        self.assertEqual(self.update(dtype="int8"), {'encoded': 0, 'removed': 0, 'unchanged': 3})
+        self.assertEqual(len(self.encoded), 3)
+        self.assertEqual(read_manifest(self.path)['dtype'], "int8")
+        self.assertEqual(self.indexed_ids(), [p.id for p in self.problems])
+
+        state = RecommenderState.load(self.path, dim=8)
+        self.assertEqual(state.vectors.dtype, np.uint8)
+        np.testing.assert_allclose(
+            state.vectors_of(np.arange(3)), state.index.index.reconstruct_n(0, 3), atol=1e-6
+        )
+        row = state.rows[self.problems[0].id]
+        _, found = state.index.search(state.vectors_of([row]), 1)
+        self.assertEqual(state.rows_of(found[0]).tolist(), [row])
@@ -151,7 +151,15 @@ function handleAction(action, editor) {
     })
     .then(response => response.ok ? response.json() : Promise.reject(response))
     .then(data => {
+        if (data.submission_id) {
+            updateOutput({ status: data.status });
+            followSubmission(data.submission_id);
+            return;
+        }
         updateOutput(data.error ? { cerror: data.error } : data);
+        if (data.feedback_id) {
+            pollFeedback(data.feedback_id);
+        }
     })
     .catch(error => {
         console.error("Fetch Error:", error);
@@ -159,6 +167,98 @@ function handleAction(action, editor) {
     });
 }
 
+/**
+ * Follows the judge's progress on a submission over its websocket, falling
+ * back to polling if the socket can't be opened or drops before the verdict.
+ * @param {string} submissionId - The id returned when the submission was queued.
+ */
+function followSubmission(submissionId) {
+    if (typeof WebSocket === 'undefined') {
+        pollSubmission(submissionId);
+        return;
+    }
+
+    const protocol = window.location.protocol === 'https:' ? 'wss' : 'ws';
+    const socket = new WebSocket(`${protocol}://${window.location.host}/ws/submission/${submissionId}/`);
+    let verdict = null;
+
+    socket.onmessage = (event) => {
+        const data = JSON.parse(event.data);
+        switch (data.stage) {
+            case 'compiling':
+                updateOutput({ status: "Compiling..." });
+                break;
+            case 'running':
+                updateOutput({ status: `Running ${data.total} testcases...` });
+                break;
+            case 'case':
+                updateOutput({ status: `Testcase ${data.case}/${data.total} ${data.passed ? 'passed' : 'failed'}` });
+                break;
+            case 'done':
+                verdict = data;
+                updateOutput(data);
+                if (!data.feedback_id) socket.close();
+                break;
+            case 'feedback':
+                if (verdict) updateOutput({ ...verdict, ai_feedback: data.ai_feedback });
+                socket.close();
+                break;
+        }
+    };
+    socket.onclose = () => {
+        if (!verdict) pollSubmission(submissionId);
+    };
+}
+
+/**
+ * Polls the judge queue until the verdict of a submission is available.
+ * @param {string} submissionId - The id returned when the submission was queued.
+ * @param {number} interval - Delay between polls in milliseconds.
+ */
+function pollSubmission(submissionId, interval = 1000) {
+    fetch(`/problem/api/submission/${submissionId}/`)
+    .then(response => response.ok ? response.json() : Promise.reject(response))
+    .then(data => {
+        if (data.state === 'done') {
+            updateOutput(data);
+            if (data.feedback_id) {
+                pollFeedback(data.feedback_id);
+            }
+            return;
+        }
+        updateOutput({ status: data.state === 'running' ? "Running..." : "Queued" });
+        setTimeout(() => pollSubmission(submissionId, interval), interval);
+    })
+    .catch(error => {
+        console.error("Poll Error:", error);
+        updateOutput({ cerror: "An error occurred while fetching the verdict." });
+    });
+}
+
+/**
+ * Polls for the AI feedback on a failed run or submission and adds it to
+ * the output once it is ready, leaving the verdict on screen meanwhile.
+ * @param {string} feedbackId - The id returned with the failed result.
+ * @param {number} interval - Delay between polls in milliseconds.
+ */
+function pollFeedback(feedbackId, interval = 1000) {
+    fetch(`/problem/api/feedback/${feedbackId}/`)
+    .then(response => response.ok ? response.json() : Promise.reject(response))
+    .then(data => {
+        if (data.state !== 'done') {
+            setTimeout(() => pollFeedback(feedbackId, interval), interval);
+            return;
+        }
+        const tabBtn = document.querySelector('.output-section [data-target="#ai-feedback-pane"]');
+        const pane = document.querySelector('#ai-feedback-pane');
+        if (tabBtn && pane) {
+            pane.querySelector('.ai-feedback').textContent = data.ai_feedback;
+            tabBtn.style.display = 'inline-block';
+        }
+    })
+    .catch(error => console.error("Feedback Poll Error:", error));
+}
+
 /**
  * Main application entry point.
  */
@@ -175,12 +275,16 @@ document.addEventListener("DOMContentLoaded", async () => {
     const shareUrlInput = document.getElementById('share-url');
     const copyUrlBtn = document.getElementById('copy-url-btn');
     const chatLog = document.getElementById('chat-log');
+    const chatPresence = document.getElementById('chat-presence');
     const chatMessageInput = document.getElementById('chat-message-input');
     const chatMessageSubmit = document.getElementById('chat-message-submit');
     const languageSelect = document.querySelector(".language-selector select");
 
     // --- State Variables ---
     let chatSocket = null;
+    let historyBefore = null;   // cursor of the next older page of chat history
+    let historyMore = false;
+    let loadingHistory = false;
     let chatspaceUUID = new URLSearchParams(window.location.search).get('cs');
     const problemId = problemContainer?.dataset.tab;
 
@@ -329,18 +433,60 @@ document.addEventListener("DOMContentLoaded", async () => {
         }
     }
 
-    function appendChatMessage(message, type = 'normal') {
-        if (!chatLog) return;
+    function chatEntry(message, type = 'normal') {
         const entry = document.createElement('div');
         entry.textContent = message;
         if (type === 'system') {
             entry.style.fontStyle = 'italic';
             entry.style.color = '#666';
         }
-        chatLog.appendChild(entry);
+        return entry;
+    }
+
+    function appendChatMessage(message, type = 'normal') {
+        if (!chatLog) return;
+        chatLog.appendChild(chatEntry(message, type));
         chatLog.scrollTop = chatLog.scrollHeight;
     }
 
+    // A page of chat history arrives as one frame: the latest page on
+    // connect, older pages when the log is scrolled to the top.
+    function showChatHistory(data) {
+        if (!chatLog) return;
+        const entries = document.createDocumentFragment();
+        for (const m of data.messages || []) {
+            entries.appendChild(chatEntry(m.message));
+        }
+        if (loadingHistory) {
+            const fromBottom = chatLog.scrollHeight - chatLog.scrollTop;
+            chatLog.insertBefore(entries, chatLog.firstChild);
+            chatLog.scrollTop = chatLog.scrollHeight - fromBottom;
+        } else {
+            chatLog.appendChild(entries);
+            chatLog.scrollTop = chatLog.scrollHeight;
+        }
+        historyBefore = data.before;
+        historyMore = data.more;
+        loadingHistory = false;
+    }
+
+    function showPresence(data) {
+        if (!chatPresence) return;
+        const others = data.count - data.members.length;
+        chatPresence.textContent = `${data.count} online: ${data.members.join(', ')}`
+            + (others > 0 ? ` and ${others} more` : '');
+    }
+
+    function loadOlderChatHistory() {
+        if (!historyMore || loadingHistory || !chatSocket || chatSocket.readyState !== WebSocket.OPEN) return;
+        loadingHistory = true;
+        chatSocket.send(JSON.stringify({ type: 'history', before: historyBefore }));
+    }
+
+    chatLog?.addEventListener('scroll', () => {
+        if (chatLog.scrollTop === 0) loadOlderChatHistory();
+    });
+
     function sendChatMessage() {
         if (!chatMessageInput) return;
         const message = chatMessageInput.value.trim();
@@ -353,6 +499,8 @@ document.addEventListener("DOMContentLoaded", async () => {
     function setupWebSocket(uuid) {
         if (!problemId || !uuid) return;
         if (chatSocket) chatSocket.close();
+        if (chatLog) chatLog.replaceChildren();
+        loadingHistory = false;
 
         const protocol = window.location.protocol === 'https:' ? 'wss' : 'ws';
         chatSocket = new WebSocket(`${protocol}://${window.location.host}/ws/problem/${problemId}/${uuid}/`);
@@ -365,6 +513,12 @@ document.addEventListener("DOMContentLoaded", async () => {
         chatSocket.onmessage = (event) => {
             const data = JSON.parse(event.data);
             switch (data.type) {
+                case 'history':
+                    showChatHistory(data);
+                    break;
+                case 'presence':
+                    showPresence(data);
+                    break;
                 case 'chat_message':
                     if (typeof data.message === 'string') {
                         appendChatMessage(data.message);